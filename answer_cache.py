@@ -0,0 +1,228 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+
+from cache_utils import LRUCache
+from database_utils import get_connection
+from knowledge_base import get_knowledge_base, normalize_name
+from safety_rules import RULES_VERSION
+
+# =====================================================
+# CACHE CÂU TRẢ LỜI CHATBOT (SẢN PHẨM + HỒ SƠ + CÂU HỎI)
+# =====================================================
+# Khóa = SHA-256(bộ thành phần chuẩn hóa + phiên bản dữ liệu, hồ sơ da, câu hỏi chuẩn hóa, model):
+# - bộ thành phần không phụ thuộc thứ tự / hoa thường -> cùng sản phẩm quét lại vẫn trúng
+# - phiên bản dữ liệu = phiên bản KB + RULES_VERSION + hash bản tóm tắt nhãn đưa vào prompt
+#   -> sửa dữ liệu thành phần / luật an toàn thì câu trả lời cũ tự động không còn được dùng
+# - câu hỏi bỏ dấu câu, hoa thường, khoảng trắng thừa (GIỮ dấu tiếng Việt: "bầu" khác "bâu")
+# Tầng 1: LRU trong RAM. Tầng 2: bảng Chat_Answer_Cache (dùng chung mọi phiên / process).
+# Hết hạn theo TTL; bảng SQLite bị cắt theo LRU (last_used_at) khi vượt MAX_ROWS.
+# Lần trúng ở tầng RAM cũng được ghi lại vào last_used_at (gộp theo lô, tối đa 1 lần ghi / TOUCH_FLUSH_S)
+# để việc cắt bảng không xóa đúng những câu trả lời đang được dùng nhiều nhất.
+MEMORY_SIZE = 512
+TTL_SECONDS = 7 * 24 * 3600
+MAX_ROWS = 20000
+EVICT_EVERY = 100     # Dọn bảng SQLite sau mỗi N lần ghi
+TOUCH_FLUSH_S = 30.0  # Ghi dồn last_used_at của các lần trúng RAM sau mỗi ngần này giây
+
+_PUNCT = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_question(text):
+    text = unicodedata.normalize('NFC', str(text or '')).casefold()
+    return " ".join(_PUNCT.sub(' ', text).split())
+
+
+def data_version(digest=None):
+    """Phiên bản dữ liệu mà câu trả lời dựa vào: KB + luật an toàn + nội dung tóm tắt nhãn"""
+    kb = get_knowledge_base()
+    kb_version = "|".join(map(str, kb.version)) if kb is not None else 'UNKNOWN'
+    digest_hash = hashlib.sha256(str(digest or '').encode('utf-8')).hexdigest()
+    return f"{kb_version}|r{RULES_VERSION}|{digest_hash}"
+
+
+def ingredients_hash(ingredients, version=''):
+    names = sorted({normalize_name(name) for name in ingredients or [] if str(name).strip()})
+    return hashlib.sha256("\n".join(names + [version]).encode('utf-8')).hexdigest()
+
+
+def make_key(ing_hash, profile, question, model_name):
+    raw = "\x1f".join([ing_hash, " ".join(str(profile).split()), normalize_question(question), model_name])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, memory_size=MEMORY_SIZE, ttl=TTL_SECONDS, max_rows=MAX_ROWS, persist=True):
+        self.memory = LRUCache(memory_size)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.persist = persist
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self._touched = {}   # cache_key -> [lần dùng cuối, số lần trúng RAM] chưa ghi xuống DB
+        self._flushed_at = time.monotonic()
+
+    def get(self, ing_hash, profile, question, model_name):
+        """Câu trả lời đã lưu (còn hạn) hoặc None"""
+        if not normalize_question(question):
+            return None
+        key = make_key(ing_hash, profile, question, model_name)
+        now = time.time()
+        cached = self.memory.get(key)
+        if cached is not None and cached[1] > now:
+            with self._lock:
+                self.memory_hits += 1
+                touch = self._touched.setdefault(key, [now, 0])
+                touch[0] = now
+                touch[1] += 1
+                flush = time.monotonic() - self._flushed_at >= TOUCH_FLUSH_S
+            if flush:
+                self.flush_touches()
+            return cached[0]
+
+        answer = self._lookup_db(key, now)
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.db_hits += 1
+        if answer is not None:
+            self.memory.put(key, answer)
+        return answer[0] if answer else None
+
+    def put(self, ing_hash, profile, question, model_name, answer):
+        question_norm = normalize_question(question)
+        if not question_norm or not answer:
+            return
+        key = make_key(ing_hash, profile, question, model_name)
+        now = time.time()
+        self.memory.put(key, (answer, now + self.ttl))
+        with self._lock:
+            self.stores += 1
+            evict = self.stores % EVICT_EVERY == 0
+        if not self.persist:
+            return
+        conn = get_connection()
+        if not conn: return
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO Chat_Answer_Cache
+                (cache_key, ingredients_hash, profile, question, model_name, answer, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, ing_hash, " ".join(str(profile).split()), question_norm, model_name, answer, now, now))
+            conn.commit()
+            if evict:
+                self.flush_touches(conn)   # LRU của DB phải thấy cả các lần trúng RAM trước khi cắt bảng
+                self._evict(conn, now)
+        except Exception as e:
+            print(f"⚠️ Lỗi lưu cache câu trả lời: {e}")
+        finally:
+            conn.close()
+
+    def _lookup_db(self, key, now):
+        """(câu trả lời, hạn dùng) từ SQLite, cập nhật last_used_at cho LRU"""
+        if not self.persist:
+            return None
+        conn = get_connection()
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT answer, created_at FROM Chat_Answer_Cache WHERE cache_key = ? AND created_at > ?",
+                           (key, now - self.ttl))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE Chat_Answer_Cache SET last_used_at = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                           (now, key))
+            conn.commit()
+            return row['answer'], row['created_at'] + self.ttl
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc cache câu trả lời: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def flush_touches(self, conn=None):
+        """Ghi dồn last_used_at / hit_count của các lần trúng tầng RAM xuống Chat_Answer_Cache"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._flushed_at = time.monotonic()
+        if not touched or not self.persist:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = get_connection()
+            if not conn: return
+        try:
+            conn.executemany("""
+                UPDATE Chat_Answer_Cache SET last_used_at = MAX(last_used_at, ?), hit_count = hit_count + ?
+                WHERE cache_key = ?
+            """, [(used_at, hits, key) for key, (used_at, hits) in touched.items()])
+            conn.commit()
+        except Exception as e:
+            print(f"⚠️ Lỗi cập nhật lần dùng cache câu trả lời: {e}")
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _evict(self, conn, now):
+        """Xóa bản hết hạn, rồi cắt bớt bản lâu không dùng nhất nếu vượt max_rows"""
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM Chat_Answer_Cache WHERE created_at <= ?", (now - self.ttl,))
+        removed = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM Chat_Answer_Cache WHERE cache_key IN (
+                SELECT cache_key FROM Chat_Answer_Cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_rows,))
+        removed += cursor.rowcount
+        conn.commit()
+        with self._lock:
+            self.evicted += removed
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self._touched = {}
+        if not self.persist:
+            return
+        conn = get_connection()
+        if not conn: return
+        try:
+            conn.execute("DELETE FROM Chat_Answer_Cache")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / total, 3) if total else 0.0,
+            'stores': self.stores,
+            'evicted': self.evicted,
+            'memory_size': len(self.memory),
+        }
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
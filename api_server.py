@@ -0,0 +1,523 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from answer_cache import get_answer_cache
+from perf_metrics import export_prometheus, observe
+from resource_cache import get_analyzer
+from safety_rules import SKIN_TYPES
+
+# =====================================================
+# API PHÂN TÍCH KHÔNG CẦN STREAMLIT (ASGI)
+# =====================================================
+# uvicorn api_server:app --workers 4                  (Gemini thật: cần GOOGLE_API_KEY)
+# AESTHETIC_BACKEND=stub uvicorn api_server:app        (vision + chat giả lập, chạy offline)
+# python api_server.py --backend stub --port 8000
+#
+#   GET  /health
+#   POST /score         {"ingredients": [...], "skin_type": "Oily", "is_pregnant": false}
+#   POST /interactions  {"ingredients": [...]}  hoặc  {"a": id, "b": id}
+#   POST /scan          body = bytes ảnh (image/*) + ?skin_type=&is_pregnant=&save=1
+#                       hoặc JSON {"image_base64": "...", "skin_type": ..., "save": true}
+#   POST /chat          {"session_id"?, "message", "ingredients"?, "skin_type", "is_pregnant", "stream"?}
+#                       (phiên được lưu vào SQLite -> worker nào nhận follow-up cũng dựng lại được)
+#   GET  /history       ?limit=&before=&risk_level=&ingredient_id=
+#   GET  /search        ?q=&limit=   (typeahead hoạt chất, FTS5)
+#   GET  /metrics       (Prometheus, khi bật AESTHETIC_PERF=1)
+#
+# SQLite và Gemini đều là lời gọi chặn -> chạy trong 2 thread pool có giới hạn riêng;
+# khi hàng đợi đầy, API trả 503 ngay thay vì dồn request. Nhiều worker process dùng chung
+# 1 file DB an toàn: mỗi process có pool kết nối riêng (WAL + busy_timeout), migration
+# chạy trong BEGIN IMMEDIATE và lịch sử được ghi theo lô bởi writer của từng process.
+BACKEND_ENV = 'AESTHETIC_BACKEND'
+DB_WORKERS = 4
+AI_WORKERS = 8
+MAX_PENDING = 64            # Số tác vụ tối đa chờ trong mỗi pool trước khi trả 503
+MAX_BODY_BYTES = 15 * 1024 * 1024
+CHAT_SESSIONS = 200         # Số phiên chat giữ trong RAM mỗi process (LRU)
+HISTORY_PAGE_MAX = 100
+SEARCH_LIMIT_MAX = 50
+# Lỗi OCR theo loại -> mã HTTP: quá hạn 504, dịch vụ quá tải/mất kết nối 503, bị từ chối 502
+OCR_ERROR_STATUS = {'timeout': 504, 'transient': 503, 'fatal': 502}
+
+
+class ChatSession:
+    """Phiên chat trong RAM + dữ liệu gốc để lưu vào DB và dựng lại ở worker khác"""
+    __slots__ = ('bot', 'names', 'skin_type', 'is_pregnant')
+
+    def __init__(self, bot, names, skin_type, is_pregnant):
+        self.bot = bot
+        self.names = names
+        self.skin_type = skin_type
+        self.is_pregnant = is_pregnant
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class BoundedExecutor:
+    """Thread pool + giới hạn số tác vụ đang chờ (fail fast khi quá tải)"""
+
+    def __init__(self, name, workers, max_pending=MAX_PENDING):
+        self.name = name
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"api-{name}")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(503, f"Hệ thống đang quá tải ({self.name}), vui lòng thử lại.")
+        self.pending += 1   # Chỉ sửa trên thread của event loop -> không cần lock
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, lambda: fn(*args))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+# --- ĐỌC / GHI HTTP ---
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(499, "Client đã ngắt kết nối")
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, "Dữ liệu gửi lên quá lớn")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def parse_json(body):
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "JSON không hợp lệ")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Body phải là JSON object")
+    return data
+
+
+async def send_response(send, status, body, content_type='application/json; charset=utf-8'):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload):
+    await send_response(send, status, json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+async def _send_error(send, state, status, message):
+    """Báo lỗi đúng với trạng thái response: chưa gửi header -> JSON; đang stream SSE -> event lỗi rồi đóng"""
+    if not state['started']:
+        await send_json(send, status, {'error': message})
+    elif not state['finished']:
+        error = json.dumps({'error': message, 'status': status}, ensure_ascii=False)
+        await send({'type': 'http.response.body', 'body': f"event: error\ndata: {error}\n\n".encode('utf-8')})
+
+
+def _get_header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.decode('latin-1').lower() == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def read_profile(data):
+    skin_type = data.get('skin_type', 'Normal')
+    if skin_type not in SKIN_TYPES:
+        raise HTTPError(400, f"skin_type phải là một trong {SKIN_TYPES}")
+    return skin_type, _as_bool(data.get('is_pregnant', False))
+
+
+def read_ingredients(data, required=True):
+    names = data.get('ingredients')
+    if names is None and not required:
+        return None
+    if isinstance(names, str):
+        names = [x.strip() for x in names.split(',')]
+    if not isinstance(names, list) or not all(isinstance(x, str) for x in names):
+        raise HTTPError(400, "ingredients phải là list tên chất")
+    names = [x.strip() for x in names if x.strip()]
+    if required and not names:
+        raise HTTPError(400, "Danh sách ingredients trống")
+    return names
+
+
+# --- XỬ LÝ NGHIỆP VỤ (CHẠY TRONG THREAD POOL) ---
+
+def score_ingredients(names, skin_type, is_pregnant):
+    """Chấm điểm 1 nhãn + các cặp tương tác ngay trong sản phẩm"""
+    analyzer = get_analyzer(skin_type, is_pregnant)
+    label = analyzer.analyze_label(names)
+    label['interactions'] = [
+        {'a': a, 'b': b, 'type': t, 'level': l, 'advice': adv}
+        for a, b, t, l, adv in analyzer.find_interactions(label['product_ids'])
+    ]
+    return label
+
+
+def make_vision_backend(kind, model_name='gemini-1.5-flash'):
+    from vision_service import GeminiVisionBackend, StubVisionBackend
+    if kind == 'stub':
+        return StubVisionBackend()
+    return GeminiVisionBackend(model_name)
+
+
+class AnalysisAPI:
+    """Ứng dụng ASGI. Khởi tạo 1 lần cho mỗi worker process."""
+
+    def __init__(self, backend='gemini', api_key=None, model_name='gemini-1.5-flash',
+                 vision_backend=None, chat_model_factory=None):
+        self.backend = backend
+        self.api_key = api_key
+        self.model_name = model_name
+        self.vision = vision_backend or make_vision_backend(backend, model_name)
+        self.chat_model_factory = chat_model_factory
+        self.db = BoundedExecutor('db', DB_WORKERS)
+        self.ai = BoundedExecutor('ai', AI_WORKERS)
+        self.sessions = OrderedDict()   # session_id -> ChatSession (LRU; bản gốc nằm ở bảng Chat_Sessions)
+        self.session_locks = {}
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('POST', '/score'): self.score,
+            ('POST', '/interactions'): self.interactions,
+            ('POST', '/scan'): self.scan,
+            ('POST', '/chat'): self.chat,
+            ('GET', '/history'): self.history,
+            ('GET', '/search'): self.search,
+            ('GET', '/metrics'): self.metrics,
+        }
+        if backend == 'gemini' and api_key:
+            from resource_cache import ensure_genai_configured
+            ensure_genai_configured(api_key)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        start = time.perf_counter()
+        state = {'started': False, 'finished': False}
+
+        async def _send(message):
+            if message['type'] == 'http.response.start':
+                state['started'] = True
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                state['finished'] = True
+            await send(message)
+
+        try:
+            if handler is None:
+                methods = [m for m, p in self.routes if p == scope['path']]
+                raise HTTPError(405 if methods else 404, "Phương thức không hỗ trợ" if methods else "Không tìm thấy")
+            await handler(scope, receive, _send)
+        except HTTPError as e:
+            await _send_error(send, state, e.status, e.message)
+        except Exception as e:
+            print(f"❌ Lỗi API {scope['path']}: {e}")
+            await _send_error(send, state, 500, "Lỗi hệ thống")
+        finally:
+            observe(f"api.{scope['method']} {scope['path']}", (time.perf_counter() - start) * 1000)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Nạp sẵn kho tri thức + đồ thị để request đầu tiên không phải chờ
+                try:
+                    await self.db.run(lambda: get_analyzer('Normal', False).analyze_label(['Water']))
+                except Exception as e:
+                    print(f"❌ Khởi động API thất bại: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': f"{type(e).__name__}: {e}"})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        from history_writer import get_history_writer
+        get_history_writer().flush()
+        self.db.shutdown()
+        self.ai.shutdown()
+
+    # --- ENDPOINTS ---
+
+    async def health(self, scope, receive, send):
+        from scan_pipeline import remote_call_stats
+        await send_json(send, 200, {
+            'status': 'ok', 'backend': self.backend, 'pid': os.getpid(),
+            'chat_sessions': len(self.sessions),
+            'pending': {'db': self.db.pending, 'ai': self.ai.pending},
+            'rejected': {'db': self.db.rejected, 'ai': self.ai.rejected},
+            'answer_cache': get_answer_cache().stats(),
+            'remote_calls': remote_call_stats(),
+        })
+
+    async def score(self, scope, receive, send):
+        data = parse_json(await read_body(receive))
+        names = read_ingredients(data)
+        skin_type, is_pregnant = read_profile(data)
+        result = await self.db.run(score_ingredients, names, skin_type, is_pregnant)
+        await send_json(send, 200, result)
+
+    async def interactions(self, scope, receive, send):
+        data = parse_json(await read_body(receive))
+        analyzer = get_analyzer('Normal', False)   # Tương tác không phụ thuộc hồ sơ da
+        if 'a' in data and 'b' in data:
+            try:
+                id_a, id_b = int(data['a']), int(data['b'])
+            except (TypeError, ValueError):
+                raise HTTPError(400, "a, b phải là ingredient_id")
+            found = await self.db.run(analyzer.check_interaction, id_a, id_b)
+            payload = {'a': id_a, 'b': id_b, 'interaction': None}
+            if found:
+                payload['interaction'] = dict(zip(('type', 'level', 'advice'), found))
+            await send_json(send, 200, payload)
+            return
+        label = await self.db.run(score_ingredients, read_ingredients(data), 'Normal', False)
+        await send_json(send, 200, {'ingredient_ids': label['ingredient_ids'], 'interactions': label['interactions']})
+
+    async def scan(self, scope, receive, send):
+        body = await read_body(receive)
+        query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        if _get_header(scope, 'content-type').startswith('application/json'):
+            data = parse_json(body)
+            try:
+                image_bytes = base64.b64decode(data.get('image_base64', ''), validate=True)
+            except (binascii.Error, ValueError):
+                raise HTTPError(400, "image_base64 không hợp lệ")
+        else:
+            data, image_bytes = query, body
+        if not image_bytes:
+            raise HTTPError(400, "Thiếu dữ liệu ảnh")
+        skin_type, is_pregnant = read_profile(data)
+
+        from scan_pipeline import StageError
+        try:
+            detected, metrics = await self.ai.run(self._ocr, image_bytes)
+        except StageError as e:
+            await send_json(send, OCR_ERROR_STATUS.get(e.kind, 502), {'error': e.user_message, 'detail': e.as_dict()})
+            return
+        if not detected:
+            await send_json(send, 422, {'error': "Không đọc được chữ trên ảnh", 'metrics': metrics})
+            return
+        result = await self.db.run(score_ingredients, detected, skin_type, is_pregnant)
+        if _as_bool(data.get('save', False)):
+            from database_utils import save_scan_result
+            await self.db.run(lambda: save_scan_result(detected, result['risk_summary'],
+                                                       ingredient_ids=result['ingredient_ids']))
+        result.update({'detected': detected, 'metrics': metrics})
+        await send_json(send, 200, result)
+
+    def _ocr(self, image_bytes):
+        """OCR qua cache; cache miss thì gọi vision với deadline + retry (ném StageError khi thất bại)"""
+        from ocr_cache import get_ocr_cache
+        from scan_pipeline import call_with_retry
+        from vision_service import analyze_label_image
+        metrics = {'cached': True}
+
+        def _compute(data):
+            detected, m = call_with_retry('ocr', analyze_label_image, data, self.vision)
+            metrics.update(m, cached=False)
+            return detected
+
+        detected = get_ocr_cache().get_or_compute(image_bytes, self.vision.model_name, _compute)
+        return detected, metrics
+
+    async def chat(self, scope, receive, send):
+        data = parse_json(await read_body(receive))
+        message = str(data.get('message') or '').strip()
+        if not message:
+            raise HTTPError(400, "Thiếu message")
+
+        session_id, session = await self._get_session(data.get('session_id'), data)
+        bot = session.bot
+        lock = self.session_locks.setdefault(session_id, asyncio.Lock())
+        async with lock:   # 1 phiên chỉ xử lý 1 tin nhắn tại 1 thời điểm (giữ đúng thứ tự ngữ cảnh)
+            if _as_bool(data.get('stream', False)):
+                await self._stream_chat(send, session, session_id, message)
+            else:
+                reply = await self.ai.run(bot.send_message, message)
+                await self._save_session(session_id, session)
+                await send_json(send, 200, {'session_id': session_id, 'reply': reply, 'metrics': bot.last_metrics})
+
+    async def _get_session(self, session_id, data):
+        """
+        Phiên trong RAM -> phiên đã lưu ở DB (VD: do worker khác tạo) -> phiên mới từ ingredients.
+        Trả về (session_id, ChatSession).
+        """
+        from database_utils import load_chat_session
+        session = self.sessions.get(session_id) if session_id else None
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            return session_id, session
+
+        stored = await self.db.run(load_chat_session, session_id) if session_id else None
+        if stored is not None:
+            names, skin_type, is_pregnant = stored['ingredients'], stored['skin_type'], stored['is_pregnant']
+        else:
+            if session_id and data.get('ingredients') is None:
+                raise HTTPError(404, "Phiên chat đã hết hạn, hãy gửi kèm ingredients để tạo phiên mới")
+            names = read_ingredients(data)
+            skin_type, is_pregnant = read_profile(data)
+            session_id = session_id or uuid.uuid4().hex
+        bot = await self.ai.run(self._start_session, names, skin_type, is_pregnant)
+        if stored is not None:
+            bot.context.restore(stored['turns'], stored['summary_lines'])
+        session = ChatSession(bot, names, skin_type, is_pregnant)
+        self._remember_session(session_id, session)
+        return session_id, session
+
+    async def _save_session(self, session_id, session):
+        from database_utils import save_chat_session
+        context = session.bot.context
+        await self.db.run(save_chat_session, session_id, session.names, session.skin_type, session.is_pregnant,
+                          context.turns, context.summary_lines)
+
+    def _start_session(self, names, skin_type, is_pregnant):
+        from chat_service import AIChatbot
+        if self.chat_model_factory is not None:
+            bot = AIChatbot(None, model=self.chat_model_factory())
+        elif self.backend == 'stub':
+            from chat_service import StubChatModel
+            bot = AIChatbot(None, model=StubChatModel())
+        else:
+            if not self.api_key:
+                raise HTTPError(503, "Chưa cấu hình GOOGLE_API_KEY cho chat")
+            bot = AIChatbot(self.api_key, self.model_name)
+        digest = get_analyzer(skin_type, is_pregnant).summarize_for_chat(names)
+        bot.start_new_session(names, f"Da {skin_type}, Bầu: {is_pregnant}", digest=digest)
+        return bot
+
+    def _remember_session(self, session_id, session):
+        self.sessions[session_id] = session
+        while len(self.sessions) > CHAT_SESSIONS:
+            old_id, _ = self.sessions.popitem(last=False)
+            self.session_locks.pop(old_id, None)
+
+    async def _stream_chat(self, send, session, session_id, message):
+        """Server-Sent Events: đẩy từng đoạn text ngay khi model sinh ra"""
+        bot = session.bot
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def _produce():
+            try:
+                for chunk in bot.send_message_stream(message):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]})
+        producer = asyncio.ensure_future(self.ai.run(_produce))
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            await send({'type': 'http.response.body', 'body': f"data: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n".encode('utf-8'), 'more_body': True})
+        await producer
+        await self._save_session(session_id, session)   # Lưu trước 'done': follow-up có thể tới worker khác
+        final = json.dumps({'session_id': session_id, 'metrics': bot.last_metrics}, ensure_ascii=False)
+        await send({'type': 'http.response.body', 'body': f"event: done\ndata: {final}\n\n".encode('utf-8')})
+
+    async def history(self, scope, receive, send):
+        from database_utils import get_history_page
+        query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        try:
+            limit = min(HISTORY_PAGE_MAX, max(1, int(query.get('limit', 10))))
+            before = int(query['before']) if query.get('before') else None
+            ingredient_id = int(query['ingredient_id']) if query.get('ingredient_id') else None
+        except ValueError:
+            raise HTTPError(400, "limit / before / ingredient_id phải là số")
+        rows, next_cursor = await self.db.run(lambda: get_history_page(
+            limit, before_scan_id=before, risk_level=query.get('risk_level') or None, ingredient_id=ingredient_id))
+        await send_json(send, 200, {'items': [dict(r) for r in rows], 'next_cursor': next_cursor})
+
+    async def search(self, scope, receive, send):
+        from database_utils import SEARCH_LIMIT, search_ingredients
+        query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        try:
+            limit = min(SEARCH_LIMIT_MAX, max(1, int(query.get('limit', SEARCH_LIMIT))))
+        except ValueError:
+            raise HTTPError(400, "limit phải là số")
+        rows = await self.db.run(search_ingredients, query.get('q', ''), limit)
+        await send_json(send, 200, {'items': [dict(r) for r in rows]})
+
+    async def metrics(self, scope, receive, send):
+        await send_response(send, 200, export_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+
+
+def create_app_from_env():
+    backend = os.environ.get(BACKEND_ENV, 'gemini')
+    return AnalysisAPI(backend=backend, api_key=os.environ.get('GOOGLE_API_KEY'),
+                       model_name=os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash'))
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+async def app(scope, receive, send):
+    """Điểm vào ASGI (uvicorn api_server:app). Mỗi process tự tạo AnalysisAPI riêng."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app_from_env()
+    await _app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="API phân tích mỹ phẩm (ASGI)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--backend', choices=['gemini', 'stub'], default=None)
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("❌ Cần cài uvicorn: pip install uvicorn")
+    if args.backend:
+        os.environ[BACKEND_ENV] = args.backend   # Worker process đọc lại qua create_app_from_env()
+    uvicorn.run('api_server:app', host=args.host, port=args.port, workers=args.workers)
@@ -1,16 +1,22 @@
+import hashlib
+import time
 import streamlit as st
-from database_utils import get_connection, get_ingredient_details, save_scan_result, get_recent_history
-from services import SkinAnalyzer
+from database_utils import SEARCH_LIMIT, get_history_page, save_scan_result, search_ingredients
+from knowledge_base import get_knowledge_base
+from resource_cache import cache_stats, get_analyzer, get_best_model_name, get_catalog
+from answer_cache import get_answer_cache
 from chat_service import AIChatbot
-from PIL import Image
-import google.generativeai as genai
-import pandas as pd
-import plotly.express as px
+from scan_pipeline import ScanPipeline
+from vision_service import GeminiVisionBackend
+from perf_metrics import export_json, export_prometheus, is_enabled, last_trace, observe, span, start_trace, timed
+# pandas / plotly chỉ cần khi đã có kết quả quét -> nạp trong build_scan_view() để trang hiện ra nhanh hơn
 
 # =====================================================
 # 1. CẤU HÌNH & STYLE
 # =====================================================
 st.set_page_config(page_title="Aesthetic AI Pro", page_icon="✨", layout="wide")
+rerun_started = time.perf_counter()
+start_trace()   # Ghi lại các span của lần rerun này cho panel hiệu năng (khi bật AESTHETIC_PERF=1)
 
 if 'detected_ingredients' not in st.session_state:
     st.session_state.detected_ingredients = []
@@ -20,6 +26,8 @@ if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'chatbot_instance' not in st.session_state:
     st.session_state.chatbot_instance = None
+if 'scan_view' not in st.session_state:
+    st.session_state.scan_view = None   # Kết quả phân tích + biểu đồ của lần quét hiện tại (memo)
 
 # CSS TÙY CHỈNH (QUAN TRỌNG CHO GIAO DIỆN ĐẸP)
 st.markdown("""
@@ -75,22 +83,34 @@ with st.sidebar:
     skin_code = skin_type.split(" ")[0]
     
     user_profile = {"skin_type": skin_code, "is_pregnant": is_pregnant}
-    analyzer = SkinAnalyzer(user_profile)
+    analyzer = get_analyzer(skin_code, is_pregnant)   # Dùng chung giữa các lần rerun
     
     st.info(f"Đang phân tích cho da: **{skin_code}**")
     if is_pregnant: st.warning("⚠️ Chế độ thai kỳ: BẬT")
 
     st.markdown("---")
     st.header("🕒 Lịch sử quét")
-    history = get_recent_history(5)
+    risk_filters = {"Tất cả": None, "🟢 An toàn": "SAFE", "⚠️ Cần lưu ý": "WARNING", "🔴 Rủi ro": "DANGER"}
+    risk_filter = st.selectbox("Lọc theo kết quả:", list(risk_filters.keys()), key="history_filter", label_visibility="collapsed")
+    if st.session_state.get('history_filter_used') != risk_filter:
+        st.session_state.history_cursors = [None]   # Đổi bộ lọc thì quay về trang đầu
+        st.session_state.history_filter_used = risk_filter
+    history, next_cursor = get_history_page(5, before_scan_id=st.session_state.history_cursors[-1], risk_level=risk_filters[risk_filter])
     if history:
         for item in history:
-            icon = "🟢" if "An toàn" in item['risk_summary'] else "🔴" if "Rủi ro" in item['risk_summary'] else "⚠️"
+            icon = {"SAFE": "🟢", "DANGER": "🔴"}.get(item['risk_level'], "⚠️")
             with st.expander(f"{icon} {item['scan_date'][5:16]}"):
-                st.caption(f"{item['risk_summary']}")
+                st.caption(f"{item['risk_summary']} · {item['ingredient_count']} thành phần")
                 st.code(item['ingredients_detected'][:40]+"...")
     else:
         st.caption("Chưa có dữ liệu.")
+    c_prev, c_next = st.columns(2)
+    if len(st.session_state.history_cursors) > 1 and c_prev.button("◀ Mới hơn", use_container_width=True):
+        st.session_state.history_cursors.pop()
+        st.rerun()
+    if next_cursor and c_next.button("Cũ hơn ▶", use_container_width=True):
+        st.session_state.history_cursors.append(next_cursor)
+        st.rerun()
 
     st.markdown("---")
     st.header("⚙️ Cấu hình AI")
@@ -111,14 +131,8 @@ with st.sidebar:
 
     if active_key:
         try:
-            genai.configure(api_key=active_key)
-            try:
-                all_models = [m.name for m in genai.list_models()]
-                if 'models/gemini-2.5-flash' in all_models: best_model_name = 'gemini-2.5-flash'
-                elif 'models/gemini-1.5-flash' in all_models: best_model_name = 'gemini-1.5-flash'
-                else: best_model_name = 'gemini-pro'
-            except: pass
-            
+            # configure + list_models chỉ chạy lần đầu cho mỗi key (cache TTL), không phải mỗi lần rerun
+            best_model_name = get_best_model_name(active_key)
             is_ai_ready = True
             if st.session_state.chatbot_instance is None:
                 st.session_state.chatbot_instance = AIChatbot(active_key, best_model_name)
@@ -127,32 +141,80 @@ with st.sidebar:
     if is_ai_ready: st.caption(f"Engine: `{best_model_name}`")
     else: st.warning("Vui lòng nhập Key.")
 
+    with st.expander("📊 Cache tài nguyên"):
+        for name, stats in cache_stats().items():
+            st.caption(f"{name}: {stats['hits']} hit / {stats['misses']} miss ({stats['hit_rate']:.0%})")
+        answers = get_answer_cache().stats()
+        st.caption(f"Câu trả lời AI: {answers['memory_hits'] + answers['db_hits']} hit / {answers['misses']} miss ({answers['hit_rate']:.0%})")
+
 # =====================================================
 # 3. HELPER FUNCTIONS
 # =====================================================
-def get_all_ingredients():
-    conn = get_connection()
-    if not conn: return []
-    cursor = conn.cursor()
-    cursor.execute("SELECT ingredient_id, inci_name FROM Ingredients ORDER BY inci_name")
-    data = cursor.fetchall()
-    conn.close()
-    return data
-
-def analyze_image_with_gemini(image_file, model_name):
-    try:
-        model = genai.GenerativeModel(model_name)
-        img = Image.open(image_file)
-        prompt = """
-        Extract chemical ingredient names from skincare label.
-        Standardize to INCI format.
-        Return ONLY comma-separated list. No text.
-        """
-        with st.spinner('✨ AI đang đọc dữ liệu...'):
-            response = model.generate_content([prompt, img])
-        text = response.text.strip()
-        return [x.strip() for x in text.split(',')] if text else []
-    except: return []
+@timed('app.analyze_image')
+def analyze_image_with_gemini(image_file, model_name, analyzer, profile_str):
+    """
+    OCR (cache + deadline + retry) rồi chấm điểm; phiên chat được khởi tạo song song và chưa chắc
+    đã xong khi hàm trả về (xem scan_pipeline). Trả về ScanResult, lỗi nằm trong scan.error.
+    """
+    pipeline = ScanPipeline(GeminiVisionBackend(model_name), analyzer, st.session_state.chatbot_instance)
+    with st.spinner('✨ AI đang đọc dữ liệu...'), span('scan.pipeline'):
+        scan = pipeline.run(image_file.getvalue(), profile_str)
+    st.session_state.last_scan_metrics = scan.ocr_metrics
+    return scan
+
+def scan_view_key(detected, skin_code, is_pregnant, kb_version):
+    """Khóa memo: chỉ đổi khi danh sách chất, hồ sơ da hoặc dữ liệu DB thay đổi"""
+    digest = hashlib.sha1("\n".join(detected).encode('utf-8')).hexdigest()
+    return (digest, skin_code, bool(is_pregnant), kb_version)
+
+def ingredient_picker(label, key, default_pos=0):
+    """
+    Ô gõ tìm + selectbox chỉ chứa top-k kết quả tìm kiếm FTS5 (không đẩy cả bảng Ingredients xuống trình duyệt).
+    Chưa gõ gì thì gợi ý SEARCH_LIMIT chất đầu danh sách. Trả về (ingredient_id, tên) hoặc (None, None).
+    """
+    query = st.text_input(label, key=f"{key}_q", placeholder="Gõ tên chất, VD: retin, vitamin c...")
+    if query.strip():
+        options = {row['ingredient_id']: row['inci_name'] for row in search_ingredients(query)}
+    else:
+        options = dict(ingredients_list[default_pos:default_pos + SEARCH_LIMIT])
+    if not options:
+        st.caption("Không tìm thấy hoạt chất phù hợp.")
+        return None, None
+    picked = st.selectbox(label, list(options), format_func=options.get, key=key, label_visibility="collapsed")
+    return picked, options[picked]
+
+@timed('app.build_scan_view')
+def build_scan_view(detected, analyzer, kb, label=None):
+    """Phân tích nhãn + dựng DataFrame/biểu đồ 1 lần cho mỗi lần quét (label: kết quả pipeline đã chấm sẵn)"""
+    import pandas as pd
+    import plotly.express as px
+
+    if label is None:
+        label = analyzer.analyze_label(detected)
+    analysis_data = label['rows']
+    known = len([d for d in analysis_data if d["Đánh giá"] != "Không xác định"])
+    view = {'label': label, 'total': len(detected), 'known': known,
+            'df': pd.DataFrame(analysis_data), 'fig_safe': None, 'fig_cat': None}
+
+    if known > 0:
+        df_known = view['df'][view['df']["Đánh giá"] != "Không xác định"]
+        fig_safe = px.pie(df_known, names='Đánh giá', color='Đánh giá', 
+                          color_discrete_map={"An toàn":"#4CAF50", "Cảnh báo":"#FFC107", "Nguy cơ":"#F44336"},
+                          hole=0.5)
+        fig_safe.update_layout(showlegend=True, margin=dict(t=0, b=0, l=0, r=0), height=220, legend=dict(orientation="h", y=-0.1))
+        top_cats = df_known['Chức năng'].value_counts().nlargest(5)
+        df_cat = df_known[df_known['Chức năng'].isin(top_cats.index)]
+        fig_cat = px.bar(df_cat, y='Chức năng', x='Tên chất', orientation='h', color='Chức năng', color_discrete_sequence=px.colors.qualitative.Pastel)
+        fig_cat.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=220, xaxis=dict(showgrid=False, showticklabels=False), yaxis=dict(title=None))
+        view['fig_safe'], view['fig_cat'] = fig_safe, fig_cat
+
+    # Xung đột giữa các thành phần ngay trong sản phẩm (1 lượt tra cứu)
+    view['internal_conflicts'] = [
+        (kb.get(id_a).inci_name, kb.get(id_b).inci_name, t, l, a)
+        for id_a, id_b, t, l, a in analyzer.find_interactions(label['product_ids'])
+        if t in ('CONFLICT', 'CAUTION')
+    ]
+    return view
 
 # =====================================================
 # 4. MAIN UI
@@ -161,9 +223,11 @@ st.title("✨ Trợ lý Da liễu AI")
 st.caption("Phân tích thành phần mỹ phẩm chuẩn y khoa & cá nhân hóa")
 st.markdown("---")
 
-ingredients_list = get_all_ingredients()
-id_to_name = {item['ingredient_id']: item['inci_name'] for item in ingredients_list}
-name_to_id = {item['inci_name'].lower(): item['ingredient_id'] for item in ingredients_list}
+# Danh sách hoạt chất dựng từ kho tri thức trong RAM, chỉ dựng lại khi DB thay đổi
+catalog = get_catalog()
+ingredients_list = catalog.ingredients if catalog else []
+id_to_name = catalog.id_to_name if catalog else {}
+name_to_id = catalog.name_to_id if catalog else {}
 
 if not ingredients_list:
     st.error("⚠️ Database trống! Vui lòng chạy `data_importer_full.py`.")
@@ -174,10 +238,10 @@ tab1, tab2 = st.tabs(["🔍 **Tra cứu Nhanh**", "📊 **Phân tích Hình ản
 # --- TAB 1 (Giữ nguyên logic, tinh chỉnh UI) ---
 with tab1:
     c1, c2 = st.columns(2)
-    with c1: i_a = st.selectbox("🧪 Hoạt chất 1:", list(id_to_name.keys()), format_func=lambda x:id_to_name[x], key="ma")
-    with c2: i_b = st.selectbox("🧪 Hoạt chất 2:", list(id_to_name.keys()), format_func=lambda x:id_to_name[x], index=1, key="mb")
+    with c1: i_a, name_a = ingredient_picker("🧪 Hoạt chất 1:", key="ma")
+    with c2: i_b, name_b = ingredient_picker("🧪 Hoạt chất 2:", key="mb", default_pos=1)
     
-    if st.button("Kiểm tra tương tác", use_container_width=True, type="primary"):
+    if st.button("Kiểm tra tương tác", use_container_width=True, type="primary", disabled=i_a is None or i_b is None):
         with st.container(border=True):
             st.markdown("### 📋 Kết quả phân tích")
             inter = analyzer.check_interaction(i_a, i_b)
@@ -193,12 +257,12 @@ with tab1:
             st.divider()
             c_ra, c_rb = st.columns(2)
             with c_ra: 
-                st.caption(f"Đánh giá: {id_to_name[i_a]}")
+                st.caption(f"Đánh giá: {name_a}")
                 if risk_a == 'DANGER': st.error(m_a)
                 elif risk_a == 'WARNING': st.warning(m_a)
                 else: st.success(m_a)
             with c_rb:
-                st.caption(f"Đánh giá: {id_to_name[i_b]}")
+                st.caption(f"Đánh giá: {name_b}")
                 if risk_b == 'DANGER': st.error(m_b)
                 elif risk_b == 'WARNING': st.warning(m_b)
                 else: st.success(m_b)
@@ -215,63 +279,53 @@ with tab2:
             if uploaded_file:
                 st.image(uploaded_file, caption="Ảnh sản phẩm", use_container_width=True)
                 if st.button("🚀 Quét ngay", type="primary", use_container_width=True):
-                    detected = analyze_image_with_gemini(uploaded_file, best_model_name)
-                    if detected:
+                    st.session_state.last_scan_metrics = None
+                    profile_str = f"Da {skin_type}, Bầu: {is_pregnant}"
+                    scan = analyze_image_with_gemini(uploaded_file, best_model_name, analyzer, profile_str)
+                    if scan.ok:
+                        detected = scan.detected
                         st.session_state.detected_ingredients = detected
                         st.session_state.scan_done = True
+                        st.session_state.pending_scan = scan   # Điểm đã có; chat có thể vẫn đang khởi tạo
                         if st.session_state.chatbot_instance:
-                            profile_str = f"Da {skin_type}, Bầu: {is_pregnant}"
-                            st.session_state.chatbot_instance.start_new_session(detected, profile_str)
                             st.session_state.chat_history = [{"role": "assistant", "content": f"Tôi đã phân tích xong **{len(detected)}** thành phần. Dưới đây là báo cáo chi tiết cho bạn."}]
                     else:
-                        st.error("Không đọc được chữ.")
+                        st.error(f"❌ {scan.error.user_message}")
+                        if scan.error.kind != 'empty':
+                            st.caption(f"Chi tiết: {scan.error.message} · đã thử {scan.error.attempts} lần")
+                scan_metrics = st.session_state.get('last_scan_metrics')
+                if scan_metrics and scan_metrics.get('bytes_saved', 0) > 0:
+                    st.caption(f"🗜️ Ảnh gửi AI: {scan_metrics['original_bytes'] // 1024} KB → {scan_metrics['output_bytes'] // 1024} KB "
+                               f"· OCR {scan_metrics['ocr_ms'] / 1000:.1f}s")
 
         with col_res:
             if st.session_state.scan_done:
-                # 1. XỬ LÝ DỮ LIỆU
-                analysis_data = []
-                safe_count = 0
-                risk_count = 0
-                warning_count = 0
-                risk_summary_text = "An toàn"
-                
-                for name in st.session_state.detected_ingredients:
-                    found = False
-                    for db_name, db_id in name_to_id.items():
-                        if db_name in name.lower():
-                            details = get_ingredient_details(db_id) 
-                            if details:
-                                # Logic đánh giá rủi ro
-                                user_risk, _ = analyzer.check_safety_for_user(db_id)
-                                status = "Nguy cơ" if user_risk == 'DANGER' else ("Cảnh báo" if user_risk == 'WARNING' else "An toàn")
-                                
-                                if status == "An toàn": safe_count += 1
-                                elif status == "Cảnh báo": warning_count += 1
-                                else: risk_count += 1
-                                
-                                analysis_data.append({
-                                    "Tên chất": details['inci_name'],
-                                    "Chức năng": details['function_category'],
-                                    "Đánh giá": status,
-                                    "Gây mụn": details['comedogenic_rating']
-                                })
-                                found = True
-                            break
-                    if not found:
-                        analysis_data.append({"Tên chất": name, "Chức năng": "Chưa rõ", "Đánh giá": "Không xác định", "Gây mụn": "-"})
-
-                # Xác định kết quả tổng quan để lưu
-                if risk_count > 0: risk_summary_text = "Rủi ro cao 🔴"
-                elif warning_count > 0: risk_summary_text = "Cần lưu ý ⚠️"
-                
-                # Lưu vào Lịch sử (Chỉ lưu 1 lần)
-                if 'last_saved_scan' not in st.session_state or st.session_state.last_saved_scan != st.session_state.detected_ingredients:
-                    save_scan_result(st.session_state.detected_ingredients, risk_summary_text)
-                    st.session_state.last_saved_scan = st.session_state.detected_ingredients
+                # 1. XỬ LÝ DỮ LIỆU (chỉ chạy lại khi danh sách chất / hồ sơ / DB đổi; chat hay đổi selectbox thì dùng memo)
+                kb = get_knowledge_base()
+                view_key = scan_view_key(st.session_state.detected_ingredients, skin_code, is_pregnant, kb.version)
+                view = st.session_state.scan_view
+                if view is None or view['key'] != view_key:
+                    pending = st.session_state.get('pending_scan')
+                    # Chỉ dùng lại điểm của pipeline nếu chấm đúng nhãn này, đúng hồ sơ hiện tại và đúng phiên bản DB
+                    fresh = (pending is not None and pending.label is not None
+                             and pending.detected == st.session_state.detected_ingredients
+                             and pending.scored_for == view_key[1:])
+                    view = build_scan_view(st.session_state.detected_ingredients, analyzer, kb, label=pending.label if fresh else None)
+                    view['key'] = view_key
+                    st.session_state.scan_view = view
+
+                    # Lưu vào Lịch sử (Chỉ lưu 1 lần)
+                    if 'last_saved_scan' not in st.session_state or st.session_state.last_saved_scan != st.session_state.detected_ingredients:
+                        save_scan_result(st.session_state.detected_ingredients, view['label']['risk_summary'], ingredient_ids=view['label']['ingredient_ids'])
+                        st.session_state.last_saved_scan = st.session_state.detected_ingredients
+
+                analysis_data = view['label']['rows']
+                risk_count = view['label']['risk_count']
+                warning_count = view['label']['warning_count']
 
                 # 2. HIỂN THỊ METRICS
-                total = len(st.session_state.detected_ingredients)
-                known = len([d for d in analysis_data if d["Đánh giá"] != "Không xác định"])
+                total = view['total']
+                known = view['known']
                 
                 with st.container(border=True):
                     m1, m2, m3 = st.columns(3)
@@ -285,29 +339,25 @@ with tab2:
 
                 # 3. BIỂU ĐỒ TRỰC QUAN
                 if known > 0:
-                    df = pd.DataFrame(analysis_data)
-                    df_known = df[df["Đánh giá"] != "Không xác định"]
-                    
-                    c_chart1, c_chart2 = st.columns([1, 1])
-                    with c_chart1:
-                        st.caption("📊 **Tỷ lệ An toàn**")
-                        fig_safe = px.pie(df_known, names='Đánh giá', color='Đánh giá', 
-                                          color_discrete_map={"An toàn":"#4CAF50", "Cảnh báo":"#FFC107", "Nguy cơ":"#F44336"},
-                                          hole=0.5)
-                        fig_safe.update_layout(showlegend=True, margin=dict(t=0, b=0, l=0, r=0), height=220, legend=dict(orientation="h", y=-0.1))
-                        st.plotly_chart(fig_safe, use_container_width=True, config={'displayModeBar': False})
-
-                    with c_chart2:
-                        st.caption("🧬 **Nhóm chức năng**")
-                        top_cats = df_known['Chức năng'].value_counts().nlargest(5)
-                        df_cat = df_known[df_known['Chức năng'].isin(top_cats.index)]
-                        fig_cat = px.bar(df_cat, y='Chức năng', x='Tên chất', orientation='h', color='Chức năng', color_discrete_sequence=px.colors.qualitative.Pastel)
-                        fig_cat.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=220, xaxis=dict(showgrid=False, showticklabels=False), yaxis=dict(title=None))
-                        st.plotly_chart(fig_cat, use_container_width=True, config={'displayModeBar': False})
+                    with span('app.render_charts'):
+                        c_chart1, c_chart2 = st.columns([1, 1])
+                        with c_chart1:
+                            st.caption("📊 **Tỷ lệ An toàn**")
+                            st.plotly_chart(view['fig_safe'], use_container_width=True, config={'displayModeBar': False})
+
+                        with c_chart2:
+                            st.caption("🧬 **Nhóm chức năng**")
+                            st.plotly_chart(view['fig_cat'], use_container_width=True, config={'displayModeBar': False})
                 
                 # 4. BẢNG CHI TIẾT
                 with st.expander("🔍 Xem chi tiết từng thành phần"):
-                    st.dataframe(pd.DataFrame(analysis_data), use_container_width=True, hide_index=True)
+                    st.dataframe(view['df'], use_container_width=True, hide_index=True)
+
+                internal_conflicts = view['internal_conflicts']
+                if internal_conflicts:
+                    with st.expander(f"⚠️ {len(internal_conflicts)} cặp tương tác trong chính sản phẩm"):
+                        for name_a, name_b, t, l, a in internal_conflicts:
+                            st.markdown(f"- **{name_a}** + **{name_b}** — {t} ({l}): _{a}_")
 
                 st.divider()
                 
@@ -339,20 +389,51 @@ with tab2:
                 
                 # 6. CHATBOT
                 st.subheader("💬 Trợ lý Bác sĩ AI")
+                # Kết quả phía trên đã hiện; giờ mới chờ phiên chat khởi tạo song song (có giới hạn thời gian)
+                chat_ready = True
+                pending = st.session_state.get('pending_scan')
+                if pending is not None and pending.chat_future is not None:
+                    if pending.chat_future.done():
+                        chat_ready = pending.wait_chat(0)
+                    else:
+                        with st.spinner("💬 Đang khởi tạo trợ lý AI..."):
+                            chat_ready = pending.wait_chat()
+                    if not chat_ready:
+                        chat_error = pending.errors['chat']
+                        st.warning(f"💬 Trợ lý AI chưa sẵn sàng: {chat_error.user_message}")
                 chat_container = st.container(height=300, border=True)
                 for msg in st.session_state.chat_history:
                     with chat_container.chat_message(msg["role"]):
                         st.markdown(msg["content"])
                 
-                if prompt := st.chat_input("Hỏi chi tiết về sản phẩm này..."):
+                if prompt := st.chat_input("Hỏi chi tiết về sản phẩm này...", disabled=not chat_ready):
                     st.session_state.chat_history.append({"role": "user", "content": prompt})
                     with chat_container.chat_message("user"): st.markdown(prompt)
                     with chat_container.chat_message("assistant"):
-                        with st.spinner("Thinking..."):
-                            response = st.session_state.chatbot_instance.send_message(prompt)
-                            st.markdown(response)
+                        # Hiển thị dần từng đoạn ngay khi AI trả về
+                        response = st.write_stream(st.session_state.chatbot_instance.send_message_stream(prompt))
+                        if (st.session_state.chatbot_instance.last_metrics or {}).get('cached'):
+                            st.caption("⚡ Câu trả lời có sẵn (câu hỏi này đã được hỏi cho cùng sản phẩm & hồ sơ)")
                     st.session_state.chat_history.append({"role": "assistant", "content": response})
 
             else:
                 st.info("👈 Tải ảnh lên để bắt đầu phân tích.")
                 st.caption("Hỗ trợ định dạng: JPG, PNG. Dung lượng tối đa 200MB.")
+
+# =====================================================
+# 5. PANEL HIỆU NĂNG (CHỈ HIỆN KHI AESTHETIC_PERF=1)
+# =====================================================
+if is_enabled():
+    observe('app.rerun', (time.perf_counter() - rerun_started) * 1000)
+    with st.sidebar:
+        st.markdown("---")
+        with st.expander("⏱️ Hiệu năng lần chạy này"):
+            trace = last_trace()
+            if trace:
+                for name, ms, depth in trace:
+                    st.caption(f"{'· ' * depth}`{name}` — {ms:.1f} ms")
+            else:
+                st.caption("Chưa có số liệu.")
+            c_json, c_prom = st.columns(2)
+            c_json.download_button("JSON", export_json(), file_name="perf_metrics.json", use_container_width=True)
+            c_prom.download_button("Prometheus", export_prometheus(), file_name="perf_metrics.prom", use_container_width=True)
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from database_utils import insert_scan_results, make_scan_row
+from ocr_cache import get_ocr_cache
+from resource_cache import ensure_genai_configured
+from scan_pipeline import call_with_retry
+from services import SkinAnalyzer
+from vision_service import GeminiVisionBackend, StubVisionBackend, analyze_label_image
+
+# =====================================================
+# QUÉT HÀNG LOẠT ẢNH NHÃN (KHÔNG CẦN GIAO DIỆN)
+# =====================================================
+# python batch_scan.py ./catalog_images --out results.jsonl --workers 8 --rate 5
+# python batch_scan.py manifest.csv --backend stub          (đo throughput offline)
+#
+# File --out vừa là kết quả vừa là checkpoint: chạy lại sẽ bỏ qua các ảnh đã có trong đó.
+# Dòng checkpoint của 1 lô chỉ được ghi SAU KHI lô lịch sử tương ứng đã vào DB: dừng giữa chừng
+# (hay ghi DB lỗi) thì các ảnh đó bị quét lại, không bao giờ bị đánh dấu xong mà thiếu lịch sử.
+# Mỗi lần OCR dùng chung deadline + retry với pipeline (scan_pipeline.call_with_retry): lời gọi treo
+# không giữ worker mãi, lỗi 429/503 được thử lại thay vì làm hỏng cả ảnh.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+HISTORY_BATCH = 200
+
+
+class HistoryWriteError(RuntimeError):
+    """Không ghi được lô lịch sử vào DB -> dừng chạy (checkpoint của lô đó không được ghi)"""
+
+
+class RateLimiter:
+    """Token bucket: tối đa `rate` request/giây, cho phép dồn `burst` request"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+
+def iter_images(source):
+    """
+    Liệt kê ảnh cần quét. source có thể là:
+    - Thư mục (quét đệ quy theo đuôi file ảnh)
+    - Manifest .txt (mỗi dòng 1 đường dẫn) hoặc .csv (cột 'path', tùy chọn 'product_name')
+    Trả về (đường dẫn, tên sản phẩm).
+    """
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for fname in sorted(files):
+                if fname.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, fname)
+                    yield path, os.path.splitext(fname)[0]
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8', newline='') as f:
+        if source.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                path = row['path'] if os.path.isabs(row['path']) else os.path.join(base, row['path'])
+                yield path, row.get('product_name') or os.path.splitext(os.path.basename(path))[0]
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    path = line if os.path.isabs(line) else os.path.join(base, line)
+                    yield path, os.path.splitext(os.path.basename(path))[0]
+
+
+def load_checkpoint(out_path):
+    """Các ảnh đã xử lý xong ở lần chạy trước"""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Dòng cuối bị cắt dở khi lần trước dừng đột ngột
+            if record.get('status') == 'ok':
+                done.add(record['file'])
+    return done
+
+
+def make_backend(args):
+    if args.backend == 'stub':
+        return StubVisionBackend(latency_ms=args.stub_latency_ms)
+    api_key = args.api_key or os.environ.get('GOOGLE_API_KEY')
+    if not api_key:
+        raise SystemExit("❌ Cần --api-key hoặc biến môi trường GOOGLE_API_KEY cho backend gemini.")
+    ensure_genai_configured(api_key)
+    return GeminiVisionBackend(args.model)
+
+
+def scan_one(path, product_name, backend, analyzer, limiter, args):
+    """OCR + phân tích 1 ảnh. Chạy trong thread pool."""
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+
+    def _attempt(data):
+        limiter.acquire()   # Mỗi lần thử (kể cả retry) là 1 request -> đều phải qua giới hạn tốc độ
+        return analyze_label_image(data, backend, preprocess=not args.no_preprocess)
+
+    def _ocr(data):
+        detected, _ = call_with_retry('ocr', _attempt, data)   # Ném StageError khi hết deadline / lỗi cố định
+        return detected
+
+    if args.no_cache:
+        detected = _ocr(image_bytes)
+    else:
+        detected = get_ocr_cache().get_or_compute(image_bytes, backend.model_name, _ocr)
+
+    label = analyzer.analyze_label(detected) if detected else None
+    return {
+        'file': path,
+        'product_name': product_name,
+        'status': 'ok' if detected else 'empty',
+        'ingredients': detected,
+        'ingredient_ids': label['ingredient_ids'] if label else [],
+        'risk_summary': label['risk_summary'] if label else None,
+        'risk_count': label['risk_count'] if label else 0,
+        'warning_count': label['warning_count'] if label else 0,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def run_batch(args):
+    backend = make_backend(args)
+    analyzer = SkinAnalyzer({'skin_type': args.skin_type, 'is_pregnant': args.pregnant})
+    limiter = RateLimiter(args.rate, burst=args.workers)
+    done = load_checkpoint(args.out)
+    todo = ((p, n) for p, n in iter_images(args.source) if p not in done)
+
+    stats = {'ok': 0, 'empty': 0, 'error': 0, 'skipped': len(done)}
+    history_rows = []
+    pending_lines = []   # Dòng checkpoint chờ lô lịch sử của chúng được ghi xong
+    failed = []
+    started = time.perf_counter()
+    max_inflight = args.workers * 4   # Không nạp cả catalog vào hàng đợi cùng lúc
+
+    with open(args.out, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        inflight = {}
+
+        def _commit():
+            """Ghi lịch sử trước, checkpoint sau: mọi dòng đã có trong file out đều đã có lịch sử"""
+            if history_rows and not insert_scan_results(history_rows):
+                failed.append(len(history_rows))
+                raise HistoryWriteError(f"Không ghi được {len(history_rows)} dòng lịch sử vào DB")
+            history_rows.clear()
+            out.writelines(pending_lines)
+            out.flush()
+            pending_lines.clear()
+
+        def _collect(futures):
+            for fut in futures:
+                path = inflight.pop(fut)
+                try:
+                    record = fut.result()
+                except Exception as e:
+                    record = {'file': path, 'status': 'error', 'error': str(e),
+                              'error_kind': getattr(e, 'kind', 'fatal')}
+                stats[record['status']] += 1
+                pending_lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+                if record['status'] == 'ok' and not args.no_history:
+                    history_rows.append(make_scan_row(record['ingredients'], record['risk_summary'],
+                                                      record['ingredient_ids'], record['product_name']))
+            if args.no_history or len(history_rows) >= HISTORY_BATCH:
+                _commit()
+
+        try:
+            for path, product_name in todo:
+                if len(inflight) >= max_inflight:
+                    finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    _collect(finished)
+                fut = pool.submit(scan_one, path, product_name, backend, analyzer, limiter, args)
+                inflight[fut] = path
+
+            while inflight:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                _collect(finished)
+        finally:
+            if not failed:   # Kể cả khi bị ngắt giữa chừng: lưu nốt phần đã xong
+                _commit()
+
+    elapsed = time.perf_counter() - started
+    processed = stats['ok'] + stats['empty'] + stats['error']
+    stats['elapsed_s'] = round(elapsed, 2)
+    stats['images_per_s'] = round(processed / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Quét hàng loạt ảnh nhãn mỹ phẩm")
+    parser.add_argument('source', help="Thư mục ảnh hoặc manifest (.txt / .csv)")
+    parser.add_argument('--out', default='batch_results.jsonl', help="File kết quả JSONL (kiêm checkpoint)")
+    parser.add_argument('--backend', choices=['gemini', 'stub'], default='gemini')
+    parser.add_argument('--model', default='gemini-1.5-flash')
+    parser.add_argument('--api-key', default=None)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help="Số request OCR tối đa mỗi giây (0 = không giới hạn)")
+    parser.add_argument('--skin-type', default='Normal', choices=['Normal', 'Oily', 'Dry', 'Sensitive', 'Acne-Prone'])
+    parser.add_argument('--pregnant', action='store_true')
+    parser.add_argument('--no-preprocess', action='store_true')
+    parser.add_argument('--no-cache', action='store_true', help="Bỏ qua cache OCR (khi đo throughput)")
+    parser.add_argument('--no-history', action='store_true', help="Không ghi Scan_History")
+    parser.add_argument('--stub-latency-ms', type=float, default=300)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"🚀 Bắt đầu quét hàng loạt: {args.source} ({args.workers} luồng, backend={args.backend})")
+    try:
+        result = run_batch(args)
+    except HistoryWriteError as e:
+        print(f"❌ {e}. Đã dừng; chạy lại để quét tiếp từ checkpoint.")
+        raise SystemExit(1)
+    print(f"🎉 Hoàn tất: {json.dumps(result, ensure_ascii=False)}")
@@ -0,0 +1,7 @@
+# =====================================================
+# BỘ ĐO HIỆU NĂNG (BENCHMARK)
+# =====================================================
+# Chạy từ thư mục gốc của repo:
+#   python -m benchmarks.generate_db bench.db --preset large     (50k chất / 500k tương tác / 1M lịch sử)
+#   python -m benchmarks.run_benchmarks bench.db --out results.json
+#   python -m benchmarks.run_benchmarks bench.db --baseline results.json   (so với commit trước)
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from database_utils import DB_NAME, PRAGMAS, run_migrations
+
+# =====================================================
+# SINH DATABASE GIẢ LẬP CỠ LỚN (CÙNG SCHEMA VỚI Aesthetic_DB.db)
+# =====================================================
+# Schema gốc + các chất thật được chép từ DB mẫu, phần còn lại sinh ngẫu nhiên có seed
+# cố định -> cùng tham số luôn ra cùng 1 DB (so sánh được giữa các commit).
+PRESETS = {
+    'small': {'ingredients': 2_000, 'interactions': 10_000, 'history': 20_000},
+    'medium': {'ingredients': 10_000, 'interactions': 100_000, 'history': 200_000},
+    'large': {'ingredients': 50_000, 'interactions': 500_000, 'history': 1_000_000},
+}
+BASE_TABLES = ('Skin_Concerns', 'Ingredients', 'Ingredient_Interactions', 'Protocols')
+CHUNK = 20_000
+
+# Từ vựng ghép tên kiểu INCI: "<tiền tố> <gốc> <hậu tố>"
+_PREFIXES = ['', '', '', 'PEG-40', 'PPG-3', 'Sodium', 'Potassium', 'Hydrolyzed', 'Hydrogenated',
+             'Disodium', 'Ethylhexyl', 'Cetyl', 'Lauryl', 'Glyceryl', 'Methyl']
+_ROOTS = ['Camellia Sinensis', 'Centella Asiatica', 'Oryza Sativa', 'Glycyrrhiza Glabra', 'Rosa Canina',
+          'Aloe Barbadensis', 'Vitis Vinifera', 'Citrus Limon', 'Panax Ginseng', 'Butyrospermum Parkii',
+          'Simmondsia Chinensis', 'Olea Europaea', 'Prunus Amygdalus', 'Argania Spinosa', 'Curcuma Longa',
+          'Hyaluronate', 'Ascorbyl', 'Tocopheryl', 'Retinyl', 'Palmitoyl', 'Acetyl', 'Caprylyl', 'Stearate',
+          'Dimethicone', 'Polysorbate', 'Ceramide', 'Lactobacillus', 'Saccharomyces', 'Bifida', 'Galactomyces']
+_SUFFIXES = ['Extract', 'Leaf Extract', 'Root Extract', 'Seed Oil', 'Oil', 'Butter', 'Ferment',
+             'Ferment Filtrate', 'Water', 'Powder', 'Acid', 'Ester', 'Glucoside', 'Peptide', 'Crosspolymer']
+_TYPES = [('CONFLICT', 'HIGH'), ('CONFLICT', 'MEDIUM'), ('CAUTION', 'MEDIUM'), ('CAUTION', 'LOW'), ('SYNERGY', 'LOW')]
+_RISKS = [('An toàn tuyệt đối 🟢', 'SAFE', 70), ('Cần lưu ý ⚠️', 'WARNING', 22), ('Rủi ro cao 🔴', 'DANGER', 8)]
+
+
+def seed_db_path():
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), DB_NAME)
+
+
+def synthetic_names(rng, taken):
+    """Sinh vô hạn tên chất duy nhất (không trùng `taken`, so sánh không phân biệt hoa thường)"""
+    serial = 0
+    while True:
+        name = " ".join(p for p in (rng.choice(_PREFIXES), rng.choice(_ROOTS), rng.choice(_SUFFIXES)) if p)
+        if name.lower() in taken:
+            serial += 1
+            name = f"{name} {serial}"
+            if name.lower() in taken:
+                continue
+        taken.add(name.lower())
+        yield name
+
+
+def copy_seed(conn, seed_path):
+    """Chép schema gốc + dữ liệu thật (Skin_Concerns, Ingredients, Ingredient_Interactions) từ DB mẫu"""
+    seed = sqlite3.connect(f"file:{seed_path}?mode=ro", uri=True)
+    try:
+        for table in BASE_TABLES:
+            row = seed.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+            if row:
+                conn.execute(row[0])
+        conn.execute("ATTACH DATABASE ? AS seed", (f"file:{seed_path}?mode=ro",))
+        for table in BASE_TABLES:
+            conn.execute(f"INSERT INTO main.{table} SELECT * FROM seed.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE seed")
+    finally:
+        seed.close()
+
+
+def fill_ingredients(conn, rng, target):
+    cursor = conn.cursor()
+    cursor.execute("SELECT inci_name, function_category FROM Ingredients")
+    existing = cursor.fetchall()
+    taken = {name.lower() for name, _ in existing}
+    categories = sorted({cat for _, cat in existing if cat}) or ['Active']
+    names = synthetic_names(rng, taken)
+
+    missing = target - len(existing)
+    while missing > 0:
+        batch = []
+        for _ in range(min(CHUNK, missing)):
+            name = next(names)
+            safety = min(10, max(1, int(rng.expovariate(0.45)) + 1))
+            batch.append((name, name.split(' ')[0], rng.choice(categories), safety, rng.choice([0, 0, 0, 1, 2, 3, 4, 5]),
+                          f"Cơ chế giả lập cho {name}.", 0 if safety >= 7 and rng.random() < 0.3 else 1))
+        cursor.executemany("""
+            INSERT INTO Ingredients (inci_name, common_names, function_category, safety_rating,
+                                     comedogenic_rating, mechanism_of_action, pregnancy_safe)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, batch)
+        conn.commit()
+        missing -= len(batch)
+
+
+def fill_interactions(conn, rng, target):
+    cursor = conn.cursor()
+    ids = [row[0] for row in cursor.execute("SELECT ingredient_id FROM Ingredients")]
+    if len(ids) < 2:
+        return
+    # Giống thực tế: một số ít hoạt chất (retinoid, acid...) chiếm phần lớn các luật
+    hubs = rng.sample(ids, max(2, len(ids) // 50))
+    count = cursor.execute("SELECT COUNT(*) FROM Ingredient_Interactions").fetchone()[0]
+    max_pairs = len(ids) * (len(ids) - 1) // 2
+    target = min(target, max_pairs)
+    while count < target:
+        batch = []
+        for _ in range(min(CHUNK, target - count)):
+            a = rng.choice(hubs) if rng.random() < 0.6 else rng.choice(ids)
+            b = rng.choice(ids)
+            if a == b:
+                continue
+            itype, level = rng.choice(_TYPES)
+            batch.append((min(a, b), max(a, b), itype, level, "Lời khuyên giả lập.", "synthetic"))
+        cursor.executemany("""
+            INSERT INTO Ingredient_Interactions
+            (ingredient_a_id, ingredient_b_id, interaction_type, severity_level, advice_vn, scientific_ref)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ingredient_a_id, ingredient_b_id) DO NOTHING
+        """, batch)
+        conn.commit()
+        count += cursor.rowcount
+
+
+def fill_history(conn, rng, target, days=365):
+    cursor = conn.cursor()
+    rows = cursor.execute("SELECT ingredient_id, inci_name FROM Ingredients").fetchall()
+    weights = [r[2] for r in _RISKS]
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=days) / max(1, target)
+    scan_id = (cursor.execute("SELECT MAX(scan_id) FROM Scan_History").fetchone()[0] or 0)
+
+    done = 0
+    while done < target:
+        scans, links = [], []
+        for _ in range(min(CHUNK, target - done)):
+            scan_id += 1
+            picked = rng.sample(rows, rng.randint(8, 30))
+            names = [name for _, name in picked]
+            # ~10% tên OCR đọc sai -> không nhận diện được
+            link_ids = [ing_id if rng.random() > 0.1 else None for ing_id, _ in picked]
+            summary, level, _ = rng.choices(_RISKS, weights)[0]
+            scan_date = (start + step * (done + len(scans))).strftime('%Y-%m-%d %H:%M:%S')
+            scans.append((scan_id, f"Sản phẩm #{scan_id}", ", ".join(names), summary, scan_date, level))
+            links.extend((scan_id, pos, name, ing_id) for pos, (name, ing_id) in enumerate(zip(names, link_ids)))
+        cursor.executemany("""
+            INSERT INTO Scan_History (scan_id, product_name, ingredients_detected, risk_summary, scan_date, risk_level)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, scans)
+        cursor.executemany("""
+            INSERT INTO Scan_History_Ingredients (scan_id, position, ingredient_name, ingredient_id)
+            VALUES (?, ?, ?, ?)
+        """, links)
+        conn.commit()
+        done += len(scans)
+
+
+def generate_database(path, ingredients, interactions, history, seed=42, seed_path=None, verbose=True):
+    """Tạo mới file DB tại `path`. Trả về thống kê (số dòng, thời gian sinh, dung lượng)."""
+    started = time.perf_counter()
+    for suffix in ('', '-wal', '-shm', '.kb'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        copy_seed(conn, seed_path or seed_db_path())
+        run_migrations(conn)   # Scan_History, Safety_Verdicts, OCR_Cache, index tương tác...
+
+        steps = [('ingredients', fill_ingredients, ingredients),
+                 ('interactions', fill_interactions, interactions),
+                 ('history', fill_history, history)]
+        for label, fill, target in steps:
+            step_start = time.perf_counter()
+            fill(conn, rng, target)
+            if verbose:
+                print(f"   ✅ {label}: {target} ({time.perf_counter() - step_start:.1f}s)")
+        conn.execute("ANALYZE")
+        conn.commit()
+
+        stats = {
+            'path': os.path.abspath(path),
+            'seed': seed,
+            'ingredients': conn.execute("SELECT COUNT(*) FROM Ingredients").fetchone()[0],
+            'interactions': conn.execute("SELECT COUNT(*) FROM Ingredient_Interactions").fetchone()[0],
+            'history': conn.execute("SELECT COUNT(*) FROM Scan_History").fetchone()[0],
+        }
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    stats['size_mb'] = round(os.path.getsize(path) / 1024 / 1024, 1)
+    stats['elapsed_s'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh Aesthetic_DB giả lập cho benchmark")
+    parser.add_argument('out', help="Đường dẫn file DB sẽ tạo (ghi đè nếu đã có)")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--ingredients', type=int, default=None)
+    parser.add_argument('--interactions', type=int, default=None)
+    parser.add_argument('--history', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--seed-db', default=None, help="DB mẫu để chép schema + dữ liệu thật (mặc định Aesthetic_DB.db)")
+    args = parser.parse_args()
+
+    sizes = dict(PRESETS[args.preset])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    print(f"🏗️ Đang sinh {args.out}: {sizes}")
+    result = generate_database(args.out, seed=args.seed, seed_path=args.seed_db, **sizes)
+    print(f"🎉 Hoàn tất: {json.dumps(result, ensure_ascii=False)}")
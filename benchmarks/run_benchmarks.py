@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# =====================================================
+# CHẠY BENCHMARK CÁC ĐƯỜNG NÓNG, XUẤT JSON
+# =====================================================
+# python -m benchmarks.run_benchmarks bench.db --out results.json
+# python -m benchmarks.run_benchmarks bench.db --only check_interaction,analyze_label
+# python -m benchmarks.run_benchmarks bench.db --baseline old.json --threshold 15
+#
+# DB được chọn qua biến môi trường AESTHETIC_DB_PATH (đặt trước khi import code của app),
+# nên mọi hàm được đo đúng như khi app chạy thật. Dữ liệu đầu vào sinh từ seed cố định.
+DEFAULT_OPS = 2000
+PROFILES = [(skin, preg) for skin in ('Normal', 'Oily', 'Dry', 'Sensitive', 'Acne-Prone') for preg in (False, True)]
+
+
+def measure(fn, inputs, warmup=50):
+    """Gọi fn(x) cho từng x, đo riêng từng lần. Trả về thống kê (micro giây)."""
+    for x in inputs[:warmup]:
+        fn(x)
+    samples = []
+    started = time.perf_counter()
+    for x in inputs:
+        t0 = time.perf_counter_ns()
+        fn(x)
+        samples.append((time.perf_counter_ns() - t0) / 1000.0)
+    total = time.perf_counter() - started
+    samples.sort()
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+    return {
+        'ops': len(samples),
+        'total_s': round(total, 4),
+        'ops_per_s': round(len(samples) / total, 1) if total > 0 else 0.0,
+        'mean_us': round(sum(samples) / len(samples), 2),
+        'p50_us': pct(0.50),
+        'p95_us': pct(0.95),
+        'p99_us': pct(0.99),
+        'max_us': round(samples[-1], 2),
+    }
+
+
+def throughput(rows, elapsed):
+    return {'rows': rows, 'total_s': round(elapsed, 4), 'rows_per_s': round(rows / elapsed, 1) if elapsed > 0 else 0.0}
+
+
+# --- DỮ LIỆU ĐẦU VÀO ---
+
+class BenchContext:
+    def __init__(self, ops, seed):
+        from knowledge_base import get_knowledge_base
+        self.ops = ops
+        self.rng = random.Random(seed)
+        self.kb = get_knowledge_base(force_check=True)
+        self.ids = [rec.ingredient_id for rec in self.kb]
+        self.names = [rec.inci_name for rec in self.kb]
+
+    def random_ids(self, n=None):
+        return [self.rng.choice(self.ids) for _ in range(n or self.ops)]
+
+    def random_pairs(self, n=None):
+        from interaction_graph import get_interaction_graph
+        known = list(get_interaction_graph().pairs)
+        pairs = []
+        for _ in range(n or self.ops):
+            if known and self.rng.random() < 0.5:
+                a, b = self.rng.choice(known)          # Cặp có luật
+            else:
+                a, b = self.rng.choice(self.ids), self.rng.choice(self.ids)
+            pairs.append((b, a) if self.rng.random() < 0.5 else (a, b))   # Cả 2 chiều
+        return pairs
+
+    def random_labels(self, n, size=(15, 35)):
+        """Nhãn OCR giả lập: tên đúng, sai hoa thường, lỗi chính tả và tên không có trong DB"""
+        labels = []
+        for _ in range(n):
+            label = []
+            for name in self.rng.sample(self.names, self.rng.randint(*size)):
+                roll = self.rng.random()
+                if roll < 0.15:
+                    name = name.upper()
+                elif roll < 0.25 and len(name) > 6:
+                    i = self.rng.randrange(1, len(name) - 1)
+                    name = name[:i] + name[i + 1:]     # Mất 1 ký tự
+                elif roll < 0.30:
+                    name = f"Unknown Compound {self.rng.randrange(10 ** 6)}"
+                label.append(name)
+            labels.append(label)
+        return labels
+
+
+# --- CÁC BENCHMARK ---
+
+def bench_get_ingredient_details(ctx):
+    from database_utils import get_ingredient_details
+    return measure(get_ingredient_details, ctx.random_ids())
+
+
+def bench_kb_get_details(ctx):
+    return measure(ctx.kb.get_details, ctx.random_ids())
+
+
+def bench_check_safety_for_user(ctx):
+    from services import SkinAnalyzer
+    analyzers = [SkinAnalyzer({'skin_type': s, 'is_pregnant': p}) for s, p in PROFILES]
+    inputs = [(ctx.rng.choice(analyzers), i) for i in ctx.random_ids()]
+    return measure(lambda x: x[0].check_safety_for_user(x[1]), inputs)
+
+
+def bench_check_interaction(ctx):
+    from services import SkinAnalyzer
+    analyzer = SkinAnalyzer({'skin_type': 'Normal', 'is_pregnant': False})
+    return measure(lambda pair: analyzer.check_interaction(*pair), ctx.random_pairs())
+
+
+def bench_analyze_label(ctx):
+    """Vòng lặp tab2: khớp tên OCR + chấm điểm + đếm rủi ro cho cả nhãn"""
+    from services import SkinAnalyzer
+    analyzer = SkinAnalyzer({'skin_type': 'Sensitive', 'is_pregnant': True})
+    return measure(analyzer.analyze_label, ctx.random_labels(max(50, ctx.ops // 10)), warmup=5)
+
+
+def bench_save_scan_result(ctx):
+    """Ghi lịch sử qua HistoryWriter (bất đồng bộ) rồi flush: đo cả độ trễ gọi và throughput thật"""
+    from database_utils import save_scan_result
+    from history_writer import get_history_writer
+    labels = ctx.random_labels(max(100, ctx.ops // 2), size=(8, 20))
+    result = measure(lambda names: save_scan_result(names, 'Cần lưu ý ⚠️'), labels, warmup=0)
+    t0 = time.perf_counter()
+    get_history_writer().flush()
+    result['flush_s'] = round(time.perf_counter() - t0, 4)
+    result['end_to_end_rows_per_s'] = round(len(labels) / (result['total_s'] + result['flush_s']), 1)
+    return result
+
+
+def bench_get_recent_history(ctx):
+    from database_utils import get_recent_history
+    return measure(lambda _: get_recent_history(10), list(range(max(100, ctx.ops // 4))))
+
+
+def bench_get_history_page(ctx):
+    from database_utils import get_history_page
+    inputs = [(ctx.rng.choice([None, 'SAFE', 'WARNING', 'DANGER']), ctx.rng.choice([None] + ctx.ids[:50]))
+              for _ in range(max(100, ctx.ops // 4))]
+    return measure(lambda x: get_history_page(10, risk_level=x[0], ingredient_id=x[1]), inputs)
+
+
+def bench_search_ingredients(ctx):
+    """Typeahead tab1: tiền tố 2..8 ký tự của tên thật, như người dùng đang gõ dở"""
+    from database_utils import search_ingredients
+    inputs = []
+    for name in ctx.rng.sample(ctx.names, min(len(ctx.names), max(100, ctx.ops // 4))):
+        inputs.append(name[:ctx.rng.randint(2, 8)])
+    return measure(lambda q: search_ingredients(q, 10), inputs)
+
+
+def bench_importers(ctx):
+    """Nạp hoạt chất + luật tương tác vào 1 bản DB tạm (không đụng DB đang đo)"""
+    from benchmarks.generate_db import copy_seed, seed_db_path
+    from bulk_importer import bulk_load_interactions, bulk_upsert_ingredients
+    from database_utils import PRAGMAS, run_migrations
+
+    n = max(1000, ctx.ops * 5)
+    records = [{'inci_name': f"Bench Import {i}", 'function_category': 'Emollient',
+                'safety_rating': 1 + i % 9, 'comedogenic_rating': i % 5} for i in range(n)]
+    rules = [{'a': f"Bench Import {ctx.rng.randrange(n)}", 'b': f"Bench Import {ctx.rng.randrange(n)}",
+              'type': 'CAUTION', 'level': 'LOW', 'advice': 'bench'} for _ in range(n * 2)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'import_bench.db'))
+        try:
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            copy_seed(conn, seed_db_path())
+            run_migrations(conn)
+            first = bulk_upsert_ingredients(records, conn=conn)
+            again = bulk_upsert_ingredients(records, conn=conn)
+            loaded = bulk_load_interactions(rules, conn=conn)
+        finally:
+            conn.close()
+    return {
+        'ingredients_new': throughput(first['processed'], first['elapsed_s']),
+        'ingredients_unchanged': throughput(again['processed'], again['elapsed_s']),
+        'interactions': throughput(loaded['processed'], loaded['elapsed_s']),
+    }
+
+
+BENCHMARKS = {
+    'get_ingredient_details': bench_get_ingredient_details,
+    'kb_get_details': bench_kb_get_details,
+    'check_safety_for_user': bench_check_safety_for_user,
+    'check_interaction': bench_check_interaction,
+    'analyze_label': bench_analyze_label,
+    'save_scan_result': bench_save_scan_result,
+    'get_recent_history': bench_get_recent_history,
+    'get_history_page': bench_get_history_page,
+    'search_ingredients': bench_search_ingredients,
+    'importers': bench_importers,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(db_path, only=None, ops=DEFAULT_OPS, seed=1):
+    from database_utils import DB_PATH_ENV, get_connection
+    # Phải đặt trước mọi get_connection() để pool / kho tri thức trỏ đúng DB benchmark
+    os.environ[DB_PATH_ENV] = os.path.abspath(db_path)
+
+    conn = get_connection()
+    db_info = {
+        'path': os.path.abspath(db_path),
+        'ingredients': conn.execute("SELECT COUNT(*) FROM Ingredients").fetchone()[0],
+        'interactions': conn.execute("SELECT COUNT(*) FROM Ingredient_Interactions").fetchone()[0],
+        'history': conn.execute("SELECT COUNT(*) FROM Scan_History").fetchone()[0],
+    }
+    conn.close()
+
+    setup_start = time.perf_counter()
+    ctx = BenchContext(ops, seed)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'db': db_info,
+        'setup_s': round(time.perf_counter() - setup_start, 3),   # Nạp kho tri thức lần đầu
+        'results': {},
+    }
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        t0 = time.perf_counter()
+        report['results'][name] = bench(ctx)
+        print(f"   ⏱️ {name}: {time.perf_counter() - t0:.2f}s")
+    return report
+
+
+def _flatten(results, prefix=''):
+    """{'a': {'p50_us': 1}} -> {'a.p50_us': 1} để so sánh từng chỉ số"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(report, baseline, threshold_pct):
+    """Các chỉ số xấu đi quá threshold_pct %: *_us / *_s tăng, *_per_s giảm"""
+    new, old = _flatten(report['results']), _flatten(baseline.get('results', {}))
+    regressions = []
+    for key, value in new.items():
+        before = old.get(key)
+        if not before:
+            continue
+        if key.endswith('_per_s'):
+            worse = value < before * (1 - threshold_pct / 100.0)
+        elif key.endswith(('p50_us', 'p95_us', 'mean_us')):
+            worse = value > before * (1 + threshold_pct / 100.0)
+        else:
+            continue
+        if worse:
+            regressions.append((key, before, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark các đường nóng của Aesthetic AI")
+    parser.add_argument('db', help="File DB (sinh bằng benchmarks.generate_db)")
+    parser.add_argument('--out', default=None, help="Ghi kết quả JSON ra file")
+    parser.add_argument('--only', default=None, help="Danh sách benchmark, cách nhau dấu phẩy: " + ",".join(BENCHMARKS))
+    parser.add_argument('--ops', type=int, default=DEFAULT_OPS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=None, help="File JSON kết quả cũ để so sánh")
+    parser.add_argument('--threshold', type=float, default=20.0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"❌ Không tìm thấy {args.db}. Sinh bằng: python -m benchmarks.generate_db {args.db}")
+    only = set(args.only.split(',')) if args.only else None
+    print(f"🚀 Benchmark trên {args.db}")
+    report = run(args.db, only=only, ops=args.ops, seed=args.seed)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"💾 Đã ghi {args.out}")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for key, before, after in regressions:
+            print(f"⚠️ {key}: {before} -> {after}")
+        if regressions:
+            sys.exit(1)
+        print("✅ Không có hồi quy hiệu năng.")
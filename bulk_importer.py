@@ -0,0 +1,258 @@
+import argparse
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from database_utils import get_connection
+from resource_cache import invalidate_resources
+
+# =====================================================
+# NẠP HÀNG LOẠT HOẠT CHẤT TỪ FILE CSV / JSONL (STREAMING)
+# =====================================================
+# python bulk_importer.py cosing.csv
+# python bulk_importer.py ingredients.jsonl --chunk-size 10000
+# python bulk_importer.py rules.csv --interactions
+#
+# - Đọc file theo từng khối (không nạp cả file vào RAM).
+# - Mỗi khối = 1 executemany UPSERT trong 1 transaction:
+#   ON CONFLICT(inci_name) DO UPDATE giữ nguyên ingredient_id (không xóa/chèn lại như
+#   INSERT OR REPLACE nên khóa ngoại của Ingredient_Interactions không bị gãy).
+# - Chỉ ghi khi dữ liệu thật sự khác -> nạp lại cùng 1 file gần như không tốn gì
+#   và last_updated chỉ đổi ở các dòng bị sửa.
+# - bulk_load_interactions: nạp luật tương tác theo cặp chuẩn (a < b), bỏ trùng bằng unique index.
+# - Có dòng nào được ghi thì gọi invalidate_resources(): kho tri thức / đồ thị / catalog trong
+#   process này nạp lại ngay ở lần dùng kế tiếp thay vì chờ tới lần kiểm tra phiên bản định kỳ.
+CHUNK_SIZE = 5000
+
+IMPORT_FIELDS = (
+    'inci_name', 'common_names', 'function_category', 'safety_rating', 'comedogenic_rating',
+    'optimal_ph_min', 'optimal_ph_max', 'mechanism_of_action', 'side_effects', 'pregnancy_safe',
+)
+
+# Tên cột chấp nhận trong file nguồn (không phân biệt hoa thường) -> cột trong DB
+FIELD_ALIASES = {
+    'inci': 'inci_name', 'inci name': 'inci_name', 'name': 'inci_name',
+    'common': 'common_names', 'common name': 'common_names',
+    'cat': 'function_category', 'function': 'function_category', 'category': 'function_category',
+    'safe': 'safety_rating', 'safety': 'safety_rating',
+    'com': 'comedogenic_rating', 'comedogenic': 'comedogenic_rating',
+    'ph_min': 'optimal_ph_min', 'ph_max': 'optimal_ph_max',
+    'mech': 'mechanism_of_action', 'mechanism': 'mechanism_of_action', 'description': 'mechanism_of_action',
+    'side': 'side_effects',
+    'pregnancy': 'pregnancy_safe',
+}
+
+_CONVERTERS = {
+    'safety_rating': int,
+    'comedogenic_rating': int,
+    'optimal_ph_min': float,
+    'optimal_ph_max': float,
+    'pregnancy_safe': lambda v: int(v) if not isinstance(v, str) else int(v.strip().lower() in ('1', 'true', 'yes', 'có')),
+}
+
+# Cột để trống trong file = giữ nguyên giá trị đang có trong DB
+_UPDATE_FIELDS = IMPORT_FIELDS[1:]
+UPSERT_SQL = f"""
+    INSERT INTO Ingredients ({', '.join(IMPORT_FIELDS)})
+    VALUES ({', '.join('?' for _ in IMPORT_FIELDS)})
+    ON CONFLICT(inci_name) DO UPDATE SET
+        {', '.join(f'{f} = COALESCE(excluded.{f}, {f})' for f in _UPDATE_FIELDS)},
+        last_updated = strftime('%Y-%m-%d %H:%M:%f', 'now')
+    WHERE {' OR '.join(f'(excluded.{f} IS NOT NULL AND excluded.{f} IS NOT Ingredients.{f})' for f in _UPDATE_FIELDS)}
+"""
+
+
+def normalize_record(raw):
+    """dict từ file nguồn -> tuple theo IMPORT_FIELDS. None nếu thiếu inci_name."""
+    values = dict.fromkeys(IMPORT_FIELDS)
+    for key, value in raw.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        field = key if key in values else FIELD_ALIASES.get(key)
+        if field is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value == '':
+                continue
+        if value is None:
+            continue
+        converter = _CONVERTERS.get(field)
+        if converter:
+            try:
+                value = converter(value)
+            except (TypeError, ValueError):
+                continue
+        values[field] = value
+    if not values['inci_name']:
+        return None
+    return tuple(values[f] for f in IMPORT_FIELDS)
+
+
+def iter_source(path):
+    """Đọc lần lượt từng bản ghi (dict) từ file .csv hoặc .jsonl"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_upsert_ingredients(records, conn=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Upsert các bản ghi (iterable dict) vào Ingredients.
+    Trả về báo cáo: processed, new, changed, unchanged, skipped, elapsed_s, rows_per_s.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+        if not conn:
+            return None
+
+    report = {'processed': 0, 'new': 0, 'changed': 0, 'unchanged': 0, 'skipped': 0}
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        for chunk in _chunks(records, chunk_size):
+            rows = []
+            for raw in chunk:
+                row = normalize_record(raw)
+                if row is None:
+                    report['skipped'] += 1
+                else:
+                    rows.append(row)
+            if not rows:
+                continue
+
+            cursor.execute("SELECT COUNT(*) FROM Ingredients")
+            before = cursor.fetchone()[0]
+            cursor.executemany(UPSERT_SQL, rows)
+            written = cursor.rowcount          # Chèn mới + cập nhật thật sự (bỏ qua dòng không đổi)
+            cursor.execute("SELECT COUNT(*) FROM Ingredients")
+            new = cursor.fetchone()[0] - before
+            conn.commit()
+
+            report['processed'] += len(rows)
+            report['new'] += new
+            report['changed'] += written - new
+            report['unchanged'] += len(rows) - written
+            if progress:
+                progress(report)
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Lỗi nạp dữ liệu: {e}")
+        report['error'] = str(e)
+    finally:
+        if own_conn:
+            conn.close()
+        if report['new'] or report['changed']:
+            invalidate_resources()
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_s'] = round(elapsed, 3)
+    report['rows_per_s'] = round(report['processed'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
+
+
+INTERACTION_INSERT_SQL = """
+    INSERT INTO Ingredient_Interactions
+    (ingredient_a_id, ingredient_b_id, interaction_type, severity_level, advice_vn, scientific_ref)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(ingredient_a_id, ingredient_b_id) DO NOTHING
+"""
+
+
+def bulk_load_interactions(rules, conn=None, chunk_size=CHUNK_SIZE):
+    """
+    Nạp luật tương tác (iterable dict: a, b, type, level, advice, ref - a/b là tên chất).
+    Tên -> ID tra 1 lần trong RAM; cặp được đưa về dạng chuẩn (id nhỏ, id lớn) nên
+    trùng lặp ở bất kỳ chiều nào đều bị unique index bỏ qua (ON CONFLICT DO NOTHING),
+    không cần SELECT kiểm tra từng luật.
+    Trả về báo cáo: processed, inserted, duplicates, missing (list cặp tên thiếu), rows_per_s.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+        if not conn:
+            return None
+
+    report = {'processed': 0, 'inserted': 0, 'duplicates': 0, 'missing': []}
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT ingredient_id, inci_name FROM Ingredients")
+        name_to_id = {row[1].strip().lower(): row[0] for row in cursor.fetchall()}
+
+        for chunk in _chunks(rules, chunk_size):
+            rows = []
+            for item in chunk:
+                id_a = name_to_id.get(str(item['a']).strip().lower())
+                id_b = name_to_id.get(str(item['b']).strip().lower())
+                if not id_a or not id_b or id_a == id_b:
+                    report['missing'].append((item['a'], item['b']))
+                    continue
+                if id_a > id_b:
+                    id_a, id_b = id_b, id_a
+                rows.append((id_a, id_b, item.get('type'), item.get('level'), item.get('advice'), item.get('ref')))
+            if rows:
+                cursor.executemany(INTERACTION_INSERT_SQL, rows)
+                report['inserted'] += cursor.rowcount
+                report['duplicates'] += len(rows) - cursor.rowcount
+                report['processed'] += len(rows)
+                conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Lỗi nạp luật tương tác: {e}")
+        report['error'] = str(e)
+    finally:
+        if own_conn:
+            conn.close()
+        if report['inserted']:
+            invalidate_resources()
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_s'] = round(elapsed, 3)
+    report['rows_per_s'] = round(report['processed'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
+
+
+def import_file(path, chunk_size=CHUNK_SIZE, verbose=True):
+    def _progress(r):
+        print(f"   ... {r['processed']} dòng (mới {r['new']}, sửa {r['changed']}, giữ nguyên {r['unchanged']})")
+
+    return bulk_upsert_ingredients(iter_source(path), chunk_size=chunk_size,
+                                   progress=_progress if verbose else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nạp hàng loạt hoạt chất từ CSV / JSONL")
+    parser.add_argument('source', help="File .csv (có dòng tiêu đề) hoặc .jsonl")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--interactions', action='store_true',
+                        help="File nguồn là luật tương tác (cột a, b, type, level, advice, ref)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        raise SystemExit(f"❌ Không tìm thấy file: {args.source}")
+    print(f"🚀 Đang nạp {args.source} ...")
+    if args.interactions:
+        result = bulk_load_interactions(iter_source(args.source), chunk_size=args.chunk_size)
+        result['missing'] = len(result['missing'])
+    else:
+        result = import_file(args.source, chunk_size=args.chunk_size)
+    print(f"🎉 Hoàn tất: {json.dumps(result, ensure_ascii=False)}")
@@ -0,0 +1,220 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from database_utils import get_connection
+from safety_rules import PREGNANCY_STATES, SKIN_TYPES, evaluate_safety
+
+# =====================================================
+# CHẤM ĐIỂM CẢ CATALOG SẢN PHẨM CHO MỌI HỒ SƠ DA (ĐA TIẾN TRÌNH)
+# =====================================================
+# python catalog_scoring.py catalog.csv --workers 8
+# python catalog_scoring.py catalog.jsonl --fuzzy --shard-size 1000
+#
+# Catalog: CSV có cột product_id (tùy chọn), product_name, ingredients ("A, B, C")
+#          hoặc JSONL {"product_id", "product_name", "ingredients": [...] | "A, B, C"}.
+#
+# 1. Process chính dựng 1 bảng chấm điểm gọn: matcher tên -> ID + mã kết luận của mỗi
+#    hoạt chất cho cả 10 hồ sơ (tính từ bảng verdict, không chạm DB theo từng chất).
+# 2. Chia catalog thành từng shard, chấm song song trên process pool. Với 'fork' các worker
+#    dùng chung bảng này ở chế độ chỉ đọc (copy-on-write, không pickle lại).
+# 3. Chỉ process chính ghi DB: mỗi shard = 1 executemany vào Catalog_Scores.
+SHARD_SIZE = 500
+PROFILES = [(skin, preg) for skin in SKIN_TYPES for preg in PREGNANCY_STATES]
+RISK_CODES = ('SAFE', 'WARNING', 'DANGER')
+MAX_FLAGGED = 10
+
+
+class ScoringTable:
+    """Dữ liệu chỉ đọc mà worker cần: matcher, (tùy chọn) fuzzy index, mã kết luận theo hồ sơ"""
+
+    def __init__(self, matcher, verdict_codes, kb_version, fuzzy=None):
+        self.matcher = matcher
+        self.verdict_codes = verdict_codes   # ingredient_id -> bytes(len(PROFILES)), mỗi byte = chỉ số RISK_CODES
+        self.kb_version = kb_version
+        self.fuzzy = fuzzy
+
+
+def build_scoring_table(use_fuzzy=False):
+    from fuzzy_index import get_fuzzy_index
+    from ingredient_matcher import get_matcher
+    from knowledge_base import get_knowledge_base
+    from verdict_table import get_verdict_table
+
+    kb = get_knowledge_base(force_check=True)
+    verdicts = get_verdict_table()
+    codes = {}
+    for rec in kb:
+        row = bytearray(len(PROFILES))
+        for i, (skin, preg) in enumerate(PROFILES):
+            found = verdicts.lookup(rec.ingredient_id, skin, preg) if verdicts else None
+            risk = found[0] if found else evaluate_safety(kb.get_details(rec.ingredient_id), skin, preg)[0]
+            row[i] = RISK_CODES.index(risk) if risk in RISK_CODES else 0
+        codes[rec.ingredient_id] = bytes(row)
+    return ScoringTable(get_matcher(), codes, "|".join(map(str, kb.version)), get_fuzzy_index() if use_fuzzy else None)
+
+
+def score_product(table, names):
+    """
+    1 sản phẩm -> list (risk_level, safe, warning, danger, unknown, flagged_ids) theo thứ tự PROFILES.
+    Tên không nhận diện được tính là unknown (không làm đổi mức rủi ro).
+    """
+    ids = table.matcher.match_names(names)
+    if table.fuzzy is not None:
+        for i, (name, ing_id) in enumerate(zip(names, ids)):
+            if not ing_id:
+                guess = table.fuzzy.resolve(name)
+                if guess and not guess.is_low_confidence:
+                    ids[i] = guess.ingredient_id
+
+    codes = table.verdict_codes
+    known = [(i, codes[i]) for i in dict.fromkeys(ids) if i in codes]   # Bỏ trùng, giữ thứ tự
+    unknown = sum(1 for i in ids if i not in codes)
+
+    results = []
+    for p in range(len(PROFILES)):
+        counts = [0, 0, 0]
+        flagged = []
+        for ing_id, code in known:
+            level = code[p]
+            counts[level] += 1
+            if level and len(flagged) < MAX_FLAGGED:
+                flagged.append(str(ing_id))
+        risk = 'DANGER' if counts[2] else 'WARNING' if counts[1] else 'SAFE'
+        results.append((risk, counts[0], counts[1], counts[2], unknown, ",".join(flagged)))
+    return results
+
+
+# --- WORKER ---
+_table = None
+
+
+def _init_worker(table, use_fuzzy):
+    """fork: nhận thẳng bảng của process cha. spawn: table=None -> tự dựng lại 1 lần / worker."""
+    global _table
+    _table = table if table is not None else build_scoring_table(use_fuzzy)
+
+
+def score_shard(products, table=None):
+    """products: list (product_key, names). Trả về list dòng cho Catalog_Scores."""
+    table = table or _table
+    out = []
+    for key, names in products:
+        for (skin, preg), (risk, safe, warn, danger, unknown, flagged) in zip(PROFILES, score_product(table, names)):
+            out.append((key, skin, int(preg), risk, safe, warn, danger, unknown, flagged, table.kb_version))
+    return out
+
+
+# --- ĐỌC CATALOG ---
+
+def _split_names(value):
+    if isinstance(value, list):
+        return [str(x).strip() for x in value if str(x).strip()]
+    return [x.strip() for x in str(value or '').split(',') if x.strip()]
+
+
+def iter_catalog(path):
+    """Trả về (product_key, product_name, list tên chất)"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for index, record in enumerate(records, 1):
+            key = str(record.get('product_id') or record.get('product_name') or index)
+            yield key, record.get('product_name'), _split_names(record.get('ingredients'))
+
+
+def _shards(catalog, size):
+    shard = []
+    for item in catalog:
+        shard.append(item)
+        if len(shard) >= size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+# --- GHI KẾT QUẢ ---
+
+def write_results(conn, products, score_rows):
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO Catalog_Products (product_key, product_name, ingredients) VALUES (?, ?, ?)",
+                       [(key, name, ", ".join(names)) for key, name, names in products])
+    cursor.executemany("""
+        INSERT OR REPLACE INTO Catalog_Scores
+        (product_key, skin_type, is_pregnant, risk_level, safe_count, warning_count, danger_count,
+         unknown_count, flagged_ids, kb_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, score_rows)
+    conn.commit()
+
+
+def score_catalog(catalog, workers=None, shard_size=SHARD_SIZE, use_fuzzy=False, write=True):
+    """
+    Chấm điểm cả catalog (iterable (key, name, names)). workers=0: chạy tuần tự trong process hiện tại.
+    Trả về báo cáo: products, rows, workers, prepare_s, elapsed_s, products_per_s.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    started = time.perf_counter()
+    table = build_scoring_table(use_fuzzy)
+    prepare_s = time.perf_counter() - started
+
+    conn = get_connection() if write else None
+    report = {'products': 0, 'rows': 0, 'workers': workers, 'profiles': len(PROFILES)}
+    score_started = time.perf_counter()
+
+    def _collect(shard, rows):
+        if write:
+            write_results(conn, shard, rows)
+        report['products'] += len(shard)
+        report['rows'] += len(rows)
+
+    try:
+        if workers == 0:
+            for shard in _shards(catalog, shard_size):
+                _collect(shard, score_shard([(k, names) for k, _, names in shard], table))
+        else:
+            # FuzzyIndex giữ lock nên không pickle được -> chỉ truyền bảng khi fork (không cần pickle)
+            can_fork = 'fork' in multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context('fork' if can_fork else 'spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                     initargs=(table if can_fork else None, use_fuzzy)) as pool:
+                inflight = {}
+                for shard in _shards(catalog, shard_size):
+                    if len(inflight) >= workers * 2:   # Không đọc trước cả catalog vào RAM
+                        finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            _collect(inflight.pop(fut), fut.result())
+                    inflight[pool.submit(score_shard, [(k, names) for k, _, names in shard])] = shard
+                for fut in list(inflight):
+                    _collect(inflight.pop(fut), fut.result())
+    finally:
+        if conn is not None:
+            conn.close()
+
+    elapsed = time.perf_counter() - score_started
+    report['prepare_s'] = round(prepare_s, 3)
+    report['elapsed_s'] = round(elapsed, 3)
+    report['products_per_s'] = round(report['products'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chấm điểm catalog sản phẩm cho mọi hồ sơ da")
+    parser.add_argument('catalog', help="File .csv hoặc .jsonl")
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định = số CPU, 0 = tuần tự)")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--fuzzy', action='store_true', help="Tra gần đúng tên không khớp (chậm hơn)")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ chấm điểm, không ghi DB (đo throughput)")
+    args = parser.parse_args()
+
+    print(f"🚀 Chấm điểm {args.catalog} cho {len(PROFILES)} hồ sơ da...")
+    result = score_catalog(iter_catalog(args.catalog), workers=args.workers, shard_size=args.shard_size,
+                           use_fuzzy=args.fuzzy, write=not args.dry_run)
+    print(f"🎉 Hoàn tất: {json.dumps(result, ensure_ascii=False)}")
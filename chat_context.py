@@ -0,0 +1,124 @@
+import math
+
+# =====================================================
+# QUẢN LÝ NGỮ CẢNH CHAT THEO NGÂN SÁCH TOKEN
+# =====================================================
+# Mỗi lượt gửi đi chỉ gồm: system prompt + tóm tắt các lượt cũ + vài lượt gần nhất.
+# Lượt cũ bị "nén" thành 1 dòng tóm tắt, nên kích thước prompt không tăng theo độ dài hội thoại.
+TOKEN_BUDGET = 2000        # Tổng token tối đa cho phần lịch sử gửi kèm mỗi tin nhắn
+SUMMARY_BUDGET = 300       # Token tối đa cho phần tóm tắt
+MIN_RECENT_TURNS = 2       # Luôn giữ ít nhất N lượt gần nhất (bị cắt bớt nếu riêng chúng đã vượt ngân sách)
+FIXED_SHARE = 0.5          # System prompt + lời chào chiếm tối đa ngần này phần ngân sách
+CHARS_PER_TOKEN = 3        # Ước lượng thô cho tiếng Việt có dấu (thiên về an toàn)
+
+
+def estimate_tokens(text):
+    """Ước lượng số token (không cần gọi API count_tokens)"""
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+def _shorten(text, limit):
+    text = " ".join(str(text).replace("**", "").split())
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…" if limit > 0 else ""
+
+
+class ChatContextManager:
+    def __init__(self, system_prompt, greeting, budget=TOKEN_BUDGET,
+                 summary_budget=SUMMARY_BUDGET, min_recent_turns=MIN_RECENT_TURNS):
+        self.system_prompt = system_prompt
+        self.greeting = greeting
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.min_recent_turns = min_recent_turns
+        self.turns = []            # list (câu hỏi, câu trả lời) nguyên văn
+        self.summary_lines = []    # các lượt cũ đã nén
+        self.compacted_turns = 0
+        self._fit_fixed()
+
+    def add_turn(self, user_text, model_text):
+        self.turns.append((user_text, model_text))
+        self._compact()
+
+    def add_turns(self, turns):
+        for user_text, model_text in turns:
+            self.add_turn(user_text, model_text)
+
+    def restore(self, turns, summary_lines):
+        """Nạp lại trạng thái đã lưu (VD: phiên chat được dựng lại ở worker process khác)"""
+        self.turns = [tuple(t) for t in turns]
+        self.summary_lines = list(summary_lines)
+        self._compact()
+
+    def _fixed_tokens(self):
+        return estimate_tokens(self.system_prompt) + estimate_tokens(self.greeting)
+
+    def _summary_tokens(self):
+        return sum(estimate_tokens(line) for line in self.summary_lines)
+
+    def _turn_tokens(self):
+        return sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns)
+
+    def history_tokens(self):
+        return self._fixed_tokens() + self._summary_tokens() + self._turn_tokens()
+
+    def _compact(self):
+        """Dồn lượt cũ nhất vào tóm tắt cho đến khi vừa ngân sách"""
+        while self.history_tokens() > self.budget and len(self.turns) > self.min_recent_turns:
+            question, answer = self.turns.pop(0)
+            self.summary_lines.append(f"- Hỏi: {_shorten(question, 80)} → Đã trả lời: {_shorten(answer, 120)}")
+            self.compacted_turns += 1
+        while self._summary_tokens() > self.summary_budget and self.summary_lines:
+            self.summary_lines.pop(0)
+        # Các lượt phải giữ vẫn quá dài (VD: vài câu trả lời hàng nghìn ký tự) -> bỏ tóm tắt rồi cắt bớt chúng
+        while self.history_tokens() > self.budget and self.summary_lines:
+            self.summary_lines.pop(0)
+        if self.history_tokens() > self.budget:
+            self._fit_turns()
+
+    def _fit_fixed(self):
+        """
+        System prompt quá dài so với ngân sách -> cắt đuôi, chừa chỗ cho các lượt hỏi đáp.
+        Người gọi đặt phần dài và ít quan trọng nhất (tóm tắt nhãn) ở cuối prompt để chỉ phần đó bị cắt.
+        """
+        limit = int(self.budget * FIXED_SHARE) - estimate_tokens(self.greeting)
+        if estimate_tokens(self.system_prompt) > limit:
+            chars = max(0, limit * CHARS_PER_TOKEN)
+            self.system_prompt = self.system_prompt[:chars - 1] + "…" if chars > 0 else ""
+
+    def _fit_turns(self):
+        """
+        Cắt các lượt còn giữ cho vừa phần ngân sách còn lại. Chia đều theo kiểu "rót nước":
+        câu ngắn (thường là câu hỏi) giữ nguyên, phần dư nhường cho câu trả lời dài.
+        """
+        texts = [text for turn in self.turns for text in turn]
+        # Trừ 1 token / đoạn cho phần làm tròn lên của estimate_tokens
+        remaining = max(0, self.budget - self._fixed_tokens() - self._summary_tokens() - len(texts)) * CHARS_PER_TOKEN
+        sizes = sorted(len(text) for text in texts)
+        cap = sizes[-1]
+        for i, size in enumerate(sizes):
+            share = remaining // (len(sizes) - i)
+            if size > share:
+                cap = share
+                break
+            remaining -= size
+        self.turns = [tuple(text if len(text) <= cap else _shorten(text, cap) for text in turn) for turn in self.turns]
+
+    def build_history(self):
+        """Lịch sử (định dạng Gemini) gửi kèm tin nhắn kế tiếp"""
+        prompt = self.system_prompt
+        if self.summary_lines:
+            prompt += "\n\nTÓM TẮT CÁC CÂU ĐÃ TRAO ĐỔI TRƯỚC ĐÓ:\n" + "\n".join(self.summary_lines)
+        history = [
+            {"role": "user", "parts": [prompt]},
+            {"role": "model", "parts": [self.greeting]},
+        ]
+        for question, answer in self.turns:
+            history.append({"role": "user", "parts": [question]})
+            history.append({"role": "model", "parts": [answer]})
+        return history
+
+    def prompt_tokens(self, next_message=''):
+        """Ước lượng tổng token của lần gửi kế tiếp"""
+        return self.history_tokens() + estimate_tokens(next_message)
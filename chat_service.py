@@ -1,5 +1,49 @@
-import google.generativeai as genai
-import streamlit as st
+import threading
+import time
+from collections import deque
+
+from answer_cache import data_version, get_answer_cache, ingredients_hash
+from chat_context import ChatContextManager, TOKEN_BUDGET
+from perf_metrics import observe
+from resource_cache import ensure_genai_configured
+
+METRICS_HISTORY = 50  # Số tin nhắn gần nhất giữ lại số liệu thời gian
+
+
+class _StubChunk:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _StubChatSession:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, message, stream=False):
+        self.history.append({"role": "user", "parts": [message]})
+        words = (self.model.reply or f"(stub) Đã nhận câu hỏi: {message}").split(' ')
+        self.history.append({"role": "model", "parts": [" ".join(words)]})
+
+        def _chunks():
+            for i, word in enumerate(words):
+                if self.model.latency_ms:
+                    time.sleep(self.model.latency_ms / 1000.0 / len(words))
+                yield _StubChunk(word if i == 0 else ' ' + word)
+        return _chunks()
+
+
+class StubChatModel:
+    """Model giả lập (không gọi mạng) có cùng giao diện start_chat() với Gemini: dùng cho API/test offline"""
+
+    def __init__(self, reply=None, latency_ms=200):
+        self.reply = reply
+        self.latency_ms = latency_ms
+
+    def start_chat(self, history=None):
+        return _StubChatSession(self, history)
 
 class AIChatbot:
     """
@@ -7,57 +51,161 @@ class AIChatbot:
     Nhiệm vụ: Nhớ ngữ cảnh (Context) về sản phẩm và Hồ sơ người dùng.
     """
     
-    def __init__(self, api_key, model_name='gemini-1.5-flash'):
-        if api_key:
-            genai.configure(api_key=api_key)
+    def __init__(self, api_key, model_name='gemini-1.5-flash', model=None, token_budget=TOKEN_BUDGET, answer_cache=None):
+        # model: truyền sẵn đối tượng có start_chat() (VD: model giả lập trong test) thay cho Gemini thật
+        # answer_cache: None = cache dùng chung của process, False = tắt
+        self.chat_session = None
+        self.context = None
+        self.answer_cache = get_answer_cache() if answer_cache is None else answer_cache
+        self.cache_scope = None   # (hash bộ thành phần, hồ sơ) của phiên hiện tại
+        # Mỗi lần bắt đầu khởi tạo phiên mới tăng 1; phiên dựng cho lượt cũ hơn sẽ bị bỏ (xem adopt_session)
+        self.session_generation = 0
+        self._session_lock = threading.Lock()
+        # Model giả lập có tên riêng trong khóa cache -> không lẫn câu trả lời với Gemini thật
+        self.model_name = model_name if model is None else getattr(model, 'model_name', type(model).__name__)
+        self.token_budget = token_budget
+        self.last_metrics = None
+        self.metrics = deque(maxlen=METRICS_HISTORY)
+        if model is not None:
+            self.model = model
+        elif api_key:
+            import google.generativeai as genai   # Nạp khi cần (SDK nặng, làm chậm khởi động)
+            ensure_genai_configured(api_key)
             self.model = genai.GenerativeModel(model_name)
-            self.chat_session = None
         else:
             self.model = None
 
-    def start_new_session(self, ingredients_list, skin_profile):
+    def start_new_session(self, ingredients_list, skin_profile, digest=None):
         """
         Khởi tạo phiên chat với kỹ thuật 'Context Injection'.
-        Truyền toàn bộ dữ liệu thành phần và hồ sơ da vào não AI trước.
+        Truyền dữ liệu thành phần và hồ sơ da vào não AI trước.
+        digest: bản tóm tắt đã chấm điểm sẵn (SkinAnalyzer.summarize_for_chat) thay cho danh sách thô.
+        """
+        session = self.build_session(ingredients_list, skin_profile, digest)
+        if session is None: return
+        self.adopt_session(session, self.begin_session())
+        return self.chat_session
+
+    def begin_session(self):
+        """Bắt đầu 1 lượt khởi tạo phiên mới: phiên dựng cho các lượt trước đó sẽ không được nhận nữa"""
+        with self._session_lock:
+            self.session_generation += 1
+            return self.session_generation
+
+    def adopt_session(self, session, generation):
+        """Dùng phiên đã dựng nếu nó vẫn thuộc lượt khởi tạo mới nhất. Trả về False nếu đã bị thay."""
+        with self._session_lock:
+            if generation != self.session_generation:
+                return False
+            self.context, self.cache_scope, self.chat_session = session
+            return True
+
+    def build_session(self, ingredients_list, skin_profile, digest=None):
+        """
+        Dựng phiên mới (context, cache_scope, chat_session) mà KHÔNG đụng vào phiên đang dùng
+        -> gọi lại khi retry an toàn, kể cả khi lần gọi trước bị bỏ lại vẫn đang chạy.
         """
         if not self.model: return
         
+        product_info = digest or f"Sản phẩm chứa: {', '.join(ingredients_list)}."
+
         # --- BÍ MẬT CÔNG NGHỆ: SYSTEM PROMPT ---
-        # Đây là nơi chúng ta dạy AI cách cư xử
-        context_prompt = f"""
-        Bạn là một Bác sĩ Da liễu AI chuyên nghiệp (Dermatologist AI).
-        
-        DỮ LIỆU ĐẦU VÀO:
-        1. Sản phẩm khách hàng đang cầm trên tay chứa: {', '.join(ingredients_list)}.
-        2. HỒ SƠ KHÁCH HÀNG (QUAN TRỌNG): {skin_profile}.
-        
-        NGUYÊN TẮC TƯ VẤN:
-        1. ƯU TIÊN SỐ 1: Kiểm tra an toàn cho đối tượng nhạy cảm (Bà bầu/Cho con bú). Nếu sản phẩm chứa Retinol, BHA, Hydroquinone... phải cảnh báo ngay lập tức.
-        2. CÁ NHÂN HÓA: 
-           - Nếu da Dầu: Cảnh báo các chất gây bít tắc (Comedogenic) như Dầu dừa, Shea Butter.
-           - Nếu da Khô: Khen ngợi các chất cấp ẩm (HA, Glycerin).
-           - Nếu da Nhạy cảm: Cảnh báo hương liệu (Fragrance), cồn khô.
-        3. PHONG CÁCH: Trả lời ngắn gọn, khoa học, đồng cảm. Không lan man.
-        
-        Hãy bắt đầu bằng việc chào khách hàng và nhận xét ngắn gọn về độ phù hợp của sản phẩm này với hồ sơ của họ.
+        # Đây là nơi chúng ta dạy AI cách cư xử.
+        # Dữ liệu sản phẩm đặt CUỐI: nhãn quá dài thì ChatContextManager cắt đuôi prompt,
+        # chỉ mất bớt danh sách chất chứ không mất hồ sơ khách hàng / nguyên tắc an toàn.
+        context_prompt = f"""Bạn là một Bác sĩ Da liễu AI chuyên nghiệp (Dermatologist AI).
+HỒ SƠ KHÁCH HÀNG (QUAN TRỌNG): {skin_profile}.
+NGUYÊN TẮC TƯ VẤN:
+1. ƯU TIÊN SỐ 1: An toàn cho Bà bầu/Cho con bú. Có Retinol, BHA, Hydroquinone... phải cảnh báo ngay.
+2. CÁ NHÂN HÓA: Da Dầu -> cảnh báo chất gây bít tắc (Dầu dừa, Shea Butter). Da Khô -> khen chất cấp ẩm (HA, Glycerin). Da Nhạy cảm -> cảnh báo hương liệu, cồn khô.
+3. PHONG CÁCH: Trả lời ngắn gọn, khoa học, đồng cảm. Không lan man.
+SẢN PHẨM KHÁCH HÀNG ĐANG CẦM: {product_info}"""
+        greeting = f"Chào bạn! Dựa trên hồ sơ {skin_profile}, tôi đã phân tích bảng thành phần. Bạn cần tôi tư vấn chi tiết điểm nào không?"
+
+        # Lịch sử chat được quản lý theo ngân sách token (không phình theo độ dài hội thoại)
+        context = ChatContextManager(context_prompt, greeting, budget=self.token_budget)
+        cache_scope = (ingredients_hash(ingredients_list, data_version(digest)), skin_profile)
+        return context, cache_scope, self.model.start_chat(history=context.build_history())
+
+    def _cache_lookup(self, user_message):
+        if not self.answer_cache or self.cache_scope is None:
+            return None
+        return self.answer_cache.get(*self.cache_scope, user_message, self.model_name)
+
+    def _answer_from_cache(self, user_message, answer, start):
         """
-        
-        # Khởi tạo lịch sử chat
-        history = [
-            {"role": "user", "parts": [context_prompt]},
-            {"role": "model", "parts": [f"Chào bạn! Dựa trên hồ sơ {skin_profile}, tôi đã phân tích bảng thành phần. Bạn cần tôi tư vấn chi tiết điểm nào không?"]}
-        ]
-        
-        self.chat_session = self.model.start_chat(history=history)
-        return self.chat_session
+        Trả lời bằng bản đã cache (không gọi model). Lượt này vẫn được ghi vào ngữ cảnh như lượt thật,
+        nên lần gọi model kế tiếp (dựng lại phiên từ context) thấy đủ lịch sử hội thoại.
+        """
+        if self.context is not None:
+            self.context.add_turn(user_message, answer)
+        elapsed = round((time.perf_counter() - start) * 1000, 2)
+        self.last_metrics = {'ttft_ms': elapsed, 'total_ms': elapsed, 'chars': len(answer),
+                             'prompt_tokens': 0, 'error': None, 'cached': True}
+        self.metrics.append(self.last_metrics)
+        observe('chat.cache_hit', elapsed)
 
-    def send_message(self, user_message):
-        """Gửi tin nhắn và nhận phản hồi"""
+    def send_message_stream(self, user_message):
+        """
+        Gửi tin nhắn và trả về từng đoạn text ngay khi model sinh ra (generator).
+        Ghi lại thời gian tới token đầu (ttft_ms) và tổng thời gian vào self.last_metrics.
+        """
         if not self.chat_session:
-            return "⚠️ Lỗi: Phiên chat chưa được khởi tạo. Hãy quét ảnh trước."
-        
+            yield "⚠️ Lỗi: Phiên chat chưa được khởi tạo. Hãy quét ảnh trước."
+            return
+
+        start = time.perf_counter()
+        # Cache chỉ áp dụng cho câu hỏi ĐẦU TIÊN của phiên (cả tra lẫn lưu): câu hỏi giữa hội thoại
+        # ("Tại sao?") phụ thuộc lịch sử riêng của phiên nên luôn phải hỏi model
+        cacheable = self.context is not None and not self.context.turns and not self.context.summary_lines
+        cached = self._cache_lookup(user_message) if cacheable else None
+        if cached is not None:
+            self._answer_from_cache(user_message, cached, start)
+            yield cached
+            return
+
+        first_chunk_at = None
+        parts = []
+        error = None
+        prompt_tokens = None
+        completed = False   # Người xem dừng stream giữa chừng thì không lưu câu trả lời dở vào cache
         try:
-            response = self.chat_session.send_message(user_message)
-            return response.text
+            if self.context is not None:
+                # Dựng lại phiên từ cửa sổ ngữ cảnh đã cắt gọn (start_chat chạy local, không gọi mạng)
+                prompt_tokens = self.context.prompt_tokens(user_message)
+                self.chat_session = self.model.start_chat(history=self.context.build_history())
+            response = self.chat_session.send_message(user_message, stream=True)
+            for chunk in response:
+                text = chunk.text
+                if not text:
+                    continue
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                parts.append(text)
+                yield text
+            completed = True
         except Exception as e:
-            return f"⚠️ Lỗi kết nối AI: {str(e)}"
+            error = str(e)
+            yield f"⚠️ Lỗi kết nối AI: {error}"
+        finally:
+            end = time.perf_counter()
+            if error is None and parts and self.context is not None:
+                self.context.add_turn(user_message, "".join(parts))
+                if completed and cacheable and self.answer_cache and self.cache_scope is not None:
+                    self.answer_cache.put(*self.cache_scope, user_message, self.model_name, "".join(parts))
+            self.last_metrics = {
+                'ttft_ms': round((first_chunk_at - start) * 1000, 2) if first_chunk_at else None,
+                'total_ms': round((end - start) * 1000, 2),
+                'chars': sum(len(p) for p in parts),
+                'prompt_tokens': prompt_tokens,
+                'error': error,
+                'cached': False,
+            }
+            self.metrics.append(self.last_metrics)
+            observe('chat.send_message', self.last_metrics['total_ms'])
+            if self.last_metrics['ttft_ms'] is not None:
+                observe('chat.ttft', self.last_metrics['ttft_ms'])
+
+    def send_message(self, user_message):
+        """Gửi tin nhắn và nhận phản hồi (đầy đủ, không streaming)"""
+        return "".join(self.send_message_stream(user_message))
@@ -1,4 +1,5 @@
-from database_utils import get_connection, get_ingredient_id
+from bulk_importer import bulk_load_interactions, bulk_upsert_ingredients
+from database_utils import get_connection
 import sqlite3
 
 # ==============================================================================
@@ -65,49 +66,18 @@ NEW_INTERACTIONS = [
 
 def run_import():
     conn = get_connection()
-    cursor = conn.cursor()
     print(f"🚀 Đang nạp {len(COMPREHENSIVE_DATA)} chất phổ biến vào Database...")
-    
-    count_new = 0
-    count_update = 0
-    
-    for item in COMPREHENSIVE_DATA:
-        try:
-            # Dùng INSERT OR REPLACE để cập nhật nếu đã có
-            sql = """
-            INSERT OR REPLACE INTO Ingredients 
-            (ingredient_id, inci_name, common_names, function_category, safety_rating, comedogenic_rating, mechanism_of_action)
-            VALUES (
-                (SELECT ingredient_id FROM Ingredients WHERE inci_name = ?),
-                ?, ?, ?, ?, ?, ?
-            )
-            """
-            # Tham số đầu tiên (SELECT...) dùng để giữ nguyên ID cũ nếu đã có, hoặc tạo mới nếu chưa
-            cursor.execute(sql, (
-                item["inci"], 
-                item["inci"], item["common"], item["cat"], item["safe"], item.get("com", 0), item["mech"]
-            ))
-            count_new += 1
-        except Exception as e:
-            print(f"❌ Lỗi {item['inci']}: {e}")
 
-    conn.commit()
-    print(f"✅ Đã xử lý {count_new} hoạt chất.")
+    # UPSERT hàng loạt: giữ nguyên ingredient_id, chỉ ghi (và cập nhật last_updated) khi dữ liệu đổi
+    report = bulk_upsert_ingredients(COMPREHENSIVE_DATA, conn=conn)
+    print(f"✅ Đã xử lý {report['processed']} hoạt chất: mới {report['new']}, cập nhật {report['changed']}, "
+          f"giữ nguyên {report['unchanged']} ({report['rows_per_s']} dòng/giây).")
     
     print("\n🔗 Đang nạp luật tương tác bổ sung...")
-    for item in NEW_INTERACTIONS:
-        id_a = get_ingredient_id(cursor, item['a'])
-        id_b = get_ingredient_id(cursor, item['b'])
-        if id_a and id_b:
-            try:
-                # Kiểm tra trùng trước khi thêm
-                cursor.execute("SELECT 1 FROM Ingredient_Interactions WHERE ingredient_a_id=? AND ingredient_b_id=?", (id_a, id_b))
-                if not cursor.fetchone():
-                    sql = """INSERT INTO Ingredient_Interactions (ingredient_a_id, ingredient_b_id, interaction_type, severity_level, advice_vn)
-                             VALUES (?, ?, ?, ?, ?)"""
-                    cursor.execute(sql, (id_a, id_b, item['type'], item['level'], item['advice']))
-                    print(f"   + Đã nối: {item['a']} <-> {item['b']}")
-            except: pass
+    rules = bulk_load_interactions(NEW_INTERACTIONS, conn=conn)
+    print(f"   + Đã nối {rules['inserted']} luật mới ({rules['duplicates']} đã có).")
+    for name_a, name_b in rules['missing']:
+        print(f"   ⚠️ Thiếu dữ liệu gốc cho cặp: {name_a} - {name_b}")
 
     conn.commit()
     conn.close()
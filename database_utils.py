@@ -1,41 +1,388 @@
+import json
 import sqlite3
 import os
-from datetime import datetime
+import time
+import queue
+import re
+import threading
+from datetime import datetime, timezone
+
+from perf_metrics import timed
 
 # CẤU HÌNH CHUNG
 DB_NAME = 'Aesthetic_DB.db'
+DB_PATH_ENV = 'AESTHETIC_DB_PATH'  # Ghi đè đường dẫn DB (benchmark, DB thử nghiệm...)
+POOL_SIZE = 8  # Số kết nối rảnh tối đa giữ lại cho mỗi file DB
+
+# Áp dụng cho mỗi kết nối mới
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",        # Đọc không chặn ghi, nhiều process dùng chung an toàn
+    "PRAGMA synchronous = NORMAL",      # Đủ an toàn với WAL, ít fsync hơn
+    "PRAGMA mmap_size = 268435456",     # 256MB
+    "PRAGMA cache_size = -32000",       # ~32MB page cache
+    "PRAGMA busy_timeout = 5000",       # Chờ tối đa 5s thay vì báo 'database is locked'
+]
+
+# --- CƠ CHẾ MIGRATION THEO PHIÊN BẢN (PRAGMA user_version) ---
+# Mỗi migration là (version, mô tả, list câu lệnh). Chỉ thêm vào cuối, không sửa bản cũ.
+MIGRATIONS = [
+    (1, "Tạo bảng Lịch sử quét", [
+        """
+        CREATE TABLE IF NOT EXISTS Scan_History (
+            scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_name TEXT DEFAULT 'Sản phẩm chưa đặt tên',
+            ingredients_detected TEXT,  -- Lưu danh sách chất cách nhau dấu phẩy
+            risk_summary TEXT,          -- Lưu kết quả 'An toàn' hay 'Rủi ro'
+            scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Bảng kết luận an toàn tính sẵn theo hồ sơ da", [
+        """
+        CREATE TABLE IF NOT EXISTS Safety_Verdicts (
+            ingredient_id INTEGER NOT NULL,
+            skin_type TEXT NOT NULL,
+            is_pregnant INTEGER NOT NULL,
+            risk_level TEXT NOT NULL,
+            message TEXT NOT NULL,
+            ingredient_updated TEXT,     -- last_updated của hoạt chất lúc tính
+            rules_version INTEGER NOT NULL,
+            PRIMARY KEY (ingredient_id, skin_type, is_pregnant)
+        )
+        """,
+    ]),
+    (3, "Chuẩn hóa lịch sử quét: bảng liên kết scan-hoạt chất + index", [
+        "ALTER TABLE Scan_History ADD COLUMN risk_level TEXT",   # 'SAFE' | 'WARNING' | 'DANGER'
+        """
+        UPDATE Scan_History SET risk_level = CASE
+            WHEN risk_summary LIKE 'Rủi ro%' THEN 'DANGER'
+            WHEN risk_summary LIKE 'Cần lưu ý%' THEN 'WARNING'
+            ELSE 'SAFE' END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Scan_History_Ingredients (
+            scan_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,      -- Thứ tự trên nhãn
+            ingredient_name TEXT NOT NULL,  -- Tên gốc do OCR trả về
+            ingredient_id INTEGER,          -- NULL nếu không nhận diện được
+            PRIMARY KEY (scan_id, position),
+            FOREIGN KEY (scan_id) REFERENCES Scan_History(scan_id) ON DELETE CASCADE,
+            FOREIGN KEY (ingredient_id) REFERENCES Ingredients(ingredient_id)
+        ) WITHOUT ROWID
+        """,
+        # Tách chuỗi "A, B, C" cũ thành từng dòng liên kết
+        """
+        INSERT INTO Scan_History_Ingredients (scan_id, position, ingredient_name, ingredient_id)
+        WITH RECURSIVE split(scan_id, position, name, rest) AS (
+            SELECT scan_id, -1, '', ingredients_detected || ', '
+            FROM Scan_History WHERE ingredients_detected IS NOT NULL AND ingredients_detected != ''
+            UNION ALL
+            SELECT scan_id, position + 1,
+                   trim(substr(rest, 1, instr(rest, ', ') - 1)),
+                   substr(rest, instr(rest, ', ') + 2)
+            FROM split WHERE rest != ''
+        )
+        SELECT s.scan_id, s.position, s.name,
+               (SELECT i.ingredient_id FROM Ingredients i WHERE i.inci_name = s.name COLLATE NOCASE)
+        FROM split s WHERE s.position >= 0 AND s.name != ''
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scan_history_date ON Scan_History(scan_date)",
+        "CREATE INDEX IF NOT EXISTS idx_scan_history_risk ON Scan_History(risk_level, scan_id)",
+        "CREATE INDEX IF NOT EXISTS idx_scan_ingredients_ingredient ON Scan_History_Ingredients(ingredient_id, scan_id)",
+    ]),
+    (4, "Cache kết quả OCR theo nội dung ảnh", [
+        """
+        CREATE TABLE IF NOT EXISTS OCR_Cache (
+            content_hash TEXT NOT NULL,     -- SHA-256 của bytes ảnh
+            model_name TEXT NOT NULL,
+            phash TEXT,                     -- Hash cảm quan (dHash 64 bit) để bắt ảnh nén lại
+            ingredients TEXT NOT NULL,      -- JSON list tên chất
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, model_name)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash ON OCR_Cache(phash, model_name)",
+    ]),
+    (5, "Chuẩn hóa cặp tương tác (a < b), bỏ trùng 2 chiều + index", [
+        # Giữ quy tắc cũ nhất cho mỗi cặp (giống cách đồ thị tương tác đang chọn)
+        """
+        DELETE FROM Ingredient_Interactions
+        WHERE interaction_id NOT IN (
+            SELECT MIN(interaction_id) FROM Ingredient_Interactions
+            GROUP BY MIN(ingredient_a_id, ingredient_b_id), MAX(ingredient_a_id, ingredient_b_id)
+        )
+        """,
+        """
+        UPDATE Ingredient_Interactions
+        SET ingredient_a_id = ingredient_b_id, ingredient_b_id = ingredient_a_id
+        WHERE ingredient_a_id > ingredient_b_id
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_interactions_pair ON Ingredient_Interactions(ingredient_a_id, ingredient_b_id)",
+        "CREATE INDEX IF NOT EXISTS idx_interactions_b ON Ingredient_Interactions(ingredient_b_id, ingredient_a_id)",
+        # Code ghi trực tiếp (không qua bulk_load_interactions) vẫn được đưa về dạng chuẩn:
+        # đảo chiều nếu a > b, bỏ luôn nếu chiều ngược lại đã có
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_interactions_canonical
+        AFTER INSERT ON Ingredient_Interactions
+        WHEN NEW.ingredient_a_id > NEW.ingredient_b_id
+        BEGIN
+            UPDATE OR IGNORE Ingredient_Interactions
+            SET ingredient_a_id = NEW.ingredient_b_id, ingredient_b_id = NEW.ingredient_a_id
+            WHERE interaction_id = NEW.interaction_id;
+            DELETE FROM Ingredient_Interactions
+            WHERE interaction_id = NEW.interaction_id AND ingredient_a_id > ingredient_b_id;
+        END
+        """,
+    ]),
+    (6, "Bảng chấm điểm catalog sản phẩm theo từng hồ sơ da", [
+        """
+        CREATE TABLE IF NOT EXISTS Catalog_Products (
+            product_key TEXT PRIMARY KEY,   -- Mã sản phẩm trong file catalog
+            product_name TEXT,
+            ingredients TEXT                -- "A, B, C" như trên nhãn
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Catalog_Scores (
+            product_key TEXT NOT NULL,
+            skin_type TEXT NOT NULL,
+            is_pregnant INTEGER NOT NULL,
+            risk_level TEXT NOT NULL,       -- 'SAFE' | 'WARNING' | 'DANGER'
+            safe_count INTEGER NOT NULL,
+            warning_count INTEGER NOT NULL,
+            danger_count INTEGER NOT NULL,
+            unknown_count INTEGER NOT NULL,
+            flagged_ids TEXT,               -- ID các chất DANGER/WARNING, cách nhau dấu phẩy
+            kb_version TEXT,                -- Phiên bản kho tri thức lúc chấm
+            PRIMARY KEY (product_key, skin_type, is_pregnant)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_catalog_scores_profile ON Catalog_Scores(skin_type, is_pregnant, risk_level)",
+    ]),
+    (7, "Chỉ mục tìm kiếm toàn văn (FTS5) cho bảng Ingredients", [
+        # external content: chỉ lưu index, nội dung đọc lại từ Ingredients theo rowid = ingredient_id.
+        # remove_diacritics 2: gõ "hyaluronic" hay "tinh dau" đều khớp; prefix '2 3': "re*" tra thẳng index.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS Ingredients_FTS USING fts5(
+            inci_name, common_names, function_category, mechanism_of_action,
+            content='Ingredients', content_rowid='ingredient_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        "INSERT INTO Ingredients_FTS(Ingredients_FTS) VALUES ('rebuild')",
+        # Tra tiền tố tên theo thứ tự ABC (và cả get_ingredient_id: '= ? COLLATE NOCASE') đi thẳng trên index
+        "CREATE INDEX IF NOT EXISTS idx_ingredients_name_nocase ON Ingredients(inci_name COLLATE NOCASE)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_fts_insert AFTER INSERT ON Ingredients BEGIN
+            INSERT INTO Ingredients_FTS (rowid, inci_name, common_names, function_category, mechanism_of_action)
+            VALUES (NEW.ingredient_id, NEW.inci_name, NEW.common_names, NEW.function_category, NEW.mechanism_of_action);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_fts_delete AFTER DELETE ON Ingredients BEGIN
+            INSERT INTO Ingredients_FTS (Ingredients_FTS, rowid, inci_name, common_names, function_category, mechanism_of_action)
+            VALUES ('delete', OLD.ingredient_id, OLD.inci_name, OLD.common_names, OLD.function_category, OLD.mechanism_of_action);
+        END
+        """,
+        # Chỉ cập nhật index khi cột được index đổi (import lại thường chỉ đổi last_updated / rating)
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_fts_update
+        AFTER UPDATE OF inci_name, common_names, function_category, mechanism_of_action ON Ingredients BEGIN
+            INSERT INTO Ingredients_FTS (Ingredients_FTS, rowid, inci_name, common_names, function_category, mechanism_of_action)
+            VALUES ('delete', OLD.ingredient_id, OLD.inci_name, OLD.common_names, OLD.function_category, OLD.mechanism_of_action);
+            INSERT INTO Ingredients_FTS (rowid, inci_name, common_names, function_category, mechanism_of_action)
+            VALUES (NEW.ingredient_id, NEW.inci_name, NEW.common_names, NEW.function_category, NEW.mechanism_of_action);
+        END
+        """,
+    ]),
+    (8, "Cache câu trả lời chatbot theo (sản phẩm, hồ sơ, câu hỏi)", [
+        """
+        CREATE TABLE IF NOT EXISTS Chat_Answer_Cache (
+            cache_key TEXT PRIMARY KEY,     -- SHA-256 của (bộ thành phần, hồ sơ, câu hỏi chuẩn hóa, model)
+            ingredients_hash TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            question TEXT NOT NULL,         -- Câu hỏi đã chuẩn hóa
+            model_name TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL,       -- Unix time, dùng cho TTL
+            last_used_at REAL NOT NULL,     -- Dùng cho LRU khi bảng vượt giới hạn
+            hit_count INTEGER DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON Chat_Answer_Cache(last_used_at)",
+    ]),
+    (9, "Lưu phiên chat của API để worker process nào cũng dựng lại được", [
+        """
+        CREATE TABLE IF NOT EXISTS Chat_Sessions (
+            session_id TEXT PRIMARY KEY,
+            ingredients TEXT NOT NULL,          -- JSON list tên chất
+            skin_type TEXT NOT NULL,
+            is_pregnant INTEGER NOT NULL,
+            turns TEXT NOT NULL DEFAULT '[]',   -- JSON list [câu hỏi, câu trả lời] còn giữ nguyên văn
+            summary_lines TEXT NOT NULL DEFAULT '[]',
+            updated_at REAL NOT NULL            -- Unix time, phiên quá CHAT_SESSION_TTL bị xóa
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON Chat_Sessions(updated_at)",
+    ]),
+    (10, "Bộ đếm thay đổi cho bảng tương tác (cache đồ thị thấy cả lệnh UPDATE)", [
+        """
+        CREATE TABLE IF NOT EXISTS Data_Versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0   -- Tăng 1 sau mỗi dòng được thêm / sửa / xóa
+        )
+        """,
+        "INSERT OR IGNORE INTO Data_Versions (table_name, version) VALUES ('Ingredient_Interactions', 0)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_interactions_version_insert AFTER INSERT ON Ingredient_Interactions BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredient_Interactions';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_interactions_version_update AFTER UPDATE ON Ingredient_Interactions BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredient_Interactions';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_interactions_version_delete AFTER DELETE ON Ingredient_Interactions BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredient_Interactions';
+        END
+        """,
+    ]),
+    (11, "Bộ đếm thay đổi cho bảng Ingredients (kho tri thức thấy cả lệnh UPDATE không đổi last_updated)", [
+        "INSERT OR IGNORE INTO Data_Versions (table_name, version) VALUES ('Ingredients', 0)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_version_insert AFTER INSERT ON Ingredients BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredients';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_version_update AFTER UPDATE ON Ingredients BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredients';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_version_delete AFTER DELETE ON Ingredients BEGIN
+            UPDATE Data_Versions SET version = version + 1 WHERE table_name = 'Ingredients';
+        END
+        """,
+    ]),
+]
+
+RISK_LEVELS = ['SAFE', 'WARNING', 'DANGER']
+
+# Tìm kiếm hoạt chất (FTS5): trọng số bm25 theo cột inci_name, common_names, function_category, mechanism_of_action
+SEARCH_WEIGHTS = (10.0, 5.0, 2.0, 0.5)
+SEARCH_RANK = f"bm25({', '.join(map(str, SEARCH_WEIGHTS))})"   # Gán cho cột rank của FTS5 trong từng truy vấn
+SEARCH_LIMIT = 20
+CHAT_SESSION_TTL = 24 * 3600   # Phiên chat không hoạt động quá 1 ngày thì bỏ
+_SEARCH_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_pools = {}               # (pid, db_path) -> LifoQueue các kết nối rảnh
+_migrated = set()         # (pid, db_path) đã chạy migration trong process này
+_pool_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Kết nối dùng lại được. Code cũ vẫn gọi conn.close() như bình thường:
+    thay vì đóng thật, kết nối được rollback phần chưa commit rồi trả về pool.
+    """
+
+    def close(self):
+        if getattr(self, '_released', False):
+            return
+        self._released = True
+        try:
+            if self.in_transaction:
+                self.rollback()
+            self.row_factory = sqlite3.Row
+            self._pool.put_nowait(self)
+        except (queue.Full, sqlite3.Error):
+            self.close_for_real()
+
+    def close_for_real(self):
+        self._released = True
+        super().close()
+
 
 def get_db_path():
-    """Tự động tìm đường dẫn file DB dù chạy ở đâu"""
+    """
+    Tự động tìm đường dẫn file DB dù chạy ở đâu.
+    Biến môi trường AESTHETIC_DB_PATH (nếu có) trỏ sang DB khác, VD: DB sinh cho benchmark.
+    """
+    override = os.environ.get(DB_PATH_ENV)
+    if override:
+        return os.path.abspath(override)
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(current_dir, DB_NAME)
 
+def _new_connection(db_path):
+    conn = sqlite3.connect(db_path, factory=PooledConnection, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def run_migrations(conn):
+    """Chạy các migration chưa áp dụng. An toàn khi nhiều process cùng khởi động."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version}")
+            print(f"🛠️ Migration {version}: {description}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+@timed('db.get_connection')
 def get_connection():
-    """Tạo kết nối đến Database và tự động khởi tạo bảng Lịch sử nếu chưa có"""
+    """Lấy kết nối từ pool (migration chỉ chạy 1 lần cho mỗi process)"""
     try:
         db_path = get_db_path()
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        
-        # --- CƠ CHẾ MIGRATION TỰ ĐỘNG ---
-        # Tạo bảng History nếu chưa tồn tại (Không ảnh hưởng bảng cũ)
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS Scan_History (
-                scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_name TEXT DEFAULT 'Sản phẩm chưa đặt tên',
-                ingredients_detected TEXT,  -- Lưu danh sách chất cách nhau dấu phẩy
-                risk_summary TEXT,          -- Lưu kết quả 'An toàn' hay 'Rủi ro'
-                scan_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        
+        key = (os.getpid(), db_path)
+        with _pool_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = queue.LifoQueue(maxsize=POOL_SIZE)
+
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = _new_connection(db_path)
+            conn._pool = pool
+
+        if key not in _migrated:
+            with _pool_lock:
+                if key not in _migrated:
+                    run_migrations(conn)
+                    _migrated.add(key)
+
+        conn._released = False
         return conn
     except Exception as e:
         print(f"❌ Lỗi kết nối Database (Fatal Error): {e}")
         return None
 
+def close_all_connections():
+    """Đóng hẳn mọi kết nối rảnh trong pool (dùng khi tắt ứng dụng / trong test)"""
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close_for_real()
+            except queue.Empty:
+                break
+
+@timed('db.get_ingredient_id')
 def get_ingredient_id(cursor, name):
     """Hàm tiện ích: Tìm ID từ Tên chất"""
     try:
@@ -49,6 +396,7 @@ def get_ingredient_id(cursor, name):
         print(f"⚠️ Lỗi khi tìm ID cho {name}: {e}")
         return None
 
+@timed('db.get_ingredient_details')
 def get_ingredient_details(id):
     """Lấy chi tiết hoạt chất"""
     conn = get_connection()
@@ -67,25 +415,114 @@ def get_ingredient_details(id):
     if row: return dict(row)
     return None
 
+def build_search_query(text):
+    """
+    Chuỗi người dùng gõ -> biểu thức MATCH của FTS5: mọi từ đều phải có, từ nào cũng tra theo tiền tố.
+    VD: 'hyalu acid' -> '"hyalu"* "acid"*'. Ký tự đặc biệt của FTS5 bị bỏ nên không lỗi cú pháp.
+    """
+    return " ".join(f'"{t}"*' for t in _SEARCH_TOKEN.findall(str(text or '')))
+
+@timed('db.search_ingredients')
+def search_ingredients(text, limit=SEARCH_LIMIT):
+    """
+    Tìm hoạt chất theo tiền tố (typeahead): trả về tối đa `limit` dòng (ingredient_id, inci_name, function_category).
+    Lượt 1: tên BẮT ĐẦU bằng chuỗi gõ, theo ABC (range scan trên idx_ingredients_name_nocase, không phụ thuộc cỡ bảng).
+    Chỉ khi chưa đủ `limit` mới chạy lượt 2: FTS5 trên mọi cột (từ bất kỳ trong tên, tên thường gọi, nhóm, cơ chế), xếp theo bm25.
+    """
+    prefix = " ".join(str(text or '').split())
+    match = build_search_query(prefix)
+    if not match: return []
+    conn = get_connection()
+    if not conn: return []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ingredient_id, inci_name, function_category FROM Ingredients
+            WHERE inci_name >= ? COLLATE NOCASE AND inci_name < ? COLLATE NOCASE
+            ORDER BY inci_name COLLATE NOCASE
+            LIMIT ?
+        """, (prefix, prefix + '\uffff', limit))
+        results = cursor.fetchall()
+        if len(results) < limit:
+            seen = {row['ingredient_id'] for row in results}
+            # ORDER BY rank + LIMIT: FTS5 tự lấy top-N theo bm25 có trọng số (rank MATCH ...), không
+            # sắp cả tập khớp; chỉ join lấy tên cho đúng các dòng được chọn
+            cursor.execute("""
+                SELECT i.ingredient_id, i.inci_name, i.function_category
+                FROM (SELECT rowid AS id, rank FROM Ingredients_FTS
+                      WHERE Ingredients_FTS MATCH ? AND rank MATCH ?
+                      ORDER BY rank LIMIT ?) f
+                JOIN Ingredients i ON i.ingredient_id = f.id
+                ORDER BY f.rank
+            """, (match, SEARCH_RANK, limit + len(seen)))
+            results += [row for row in cursor.fetchall() if row['ingredient_id'] not in seen][:limit - len(results)]
+        return results
+    except Exception as e:
+        print(f"⚠️ Lỗi tìm kiếm hoạt chất '{text}': {e}")
+        return []
+    finally:
+        conn.close()
+
 # --- CÁC HÀM MỚI CHO LỊCH SỬ ---
 
-def save_scan_result(ingredients_list, risk_status):
-    """Lưu kết quả quét vào lịch sử"""
+def risk_level_from_summary(risk_status):
+    """'Rủi ro cao 🔴' -> 'DANGER', 'Cần lưu ý ⚠️' -> 'WARNING', còn lại 'SAFE'"""
+    if risk_status.startswith('Rủi ro'): return 'DANGER'
+    if risk_status.startswith('Cần lưu ý'): return 'WARNING'
+    return 'SAFE'
+
+def make_scan_row(ingredients_list, risk_status, ingredient_ids=None, product_name=None):
+    """
+    Chuẩn bị 1 dòng lịch sử. Thời điểm quét được chốt ngay lúc gọi (UTC, giống CURRENT_TIMESTAMP).
+    ingredient_ids: list ID đã nhận diện, cùng thứ tự với ingredients_list (None nếu chưa rõ)
+    """
+    # Chuyển list thành chuỗi "A, B, C" để lưu vào 1 ô (giữ cho code cũ đọc được)
+    ing_str = ", ".join(ingredients_list)
+    scan_date = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    ids = list(ingredient_ids) if ingredient_ids is not None else [None] * len(ingredients_list)
+    links = [(pos, name, ing_id) for pos, (name, ing_id) in enumerate(zip(ingredients_list, ids))]
+    return (ing_str, risk_status, scan_date, risk_level_from_summary(risk_status), product_name, links)
+
+@timed('db.insert_scan_results')
+def insert_scan_results(rows):
+    """Ghi nhiều dòng lịch sử trong 1 transaction. rows: list kết quả của make_scan_row()"""
+    if not rows: return True
     conn = get_connection()
-    if not conn: return
+    if not conn: return False
     try:
         cursor = conn.cursor()
-        # Chuyển list thành chuỗi "A, B, C" để lưu vào 1 ô
-        ing_str = ", ".join(ingredients_list)
-        
-        sql = """INSERT INTO Scan_History (ingredients_detected, risk_summary) VALUES (?, ?)"""
-        cursor.execute(sql, (ing_str, risk_status))
+        sql = """INSERT INTO Scan_History (ingredients_detected, risk_summary, scan_date, risk_level, product_name)
+                 VALUES (?, ?, ?, ?, COALESCE(?, 'Sản phẩm chưa đặt tên'))"""
+        link_rows = []
+        for ing_str, risk_status, scan_date, risk_level, product_name, links in rows:
+            cursor.execute(sql, (ing_str, risk_status, scan_date, risk_level, product_name))
+            scan_id = cursor.lastrowid
+            link_rows.extend((scan_id, pos, name, ing_id) for pos, name, ing_id in links)
+        cursor.executemany("""
+            INSERT INTO Scan_History_Ingredients (scan_id, position, ingredient_name, ingredient_id)
+            VALUES (?, ?, ?, ?)
+        """, link_rows)
         conn.commit()
+        return True
     except Exception as e:
         print(f"Lỗi lưu lịch sử: {e}")
+        return False
     finally:
         conn.close()
 
+@timed('db.save_scan_result')
+def save_scan_result(ingredients_list, risk_status, wait=False, ingredient_ids=None):
+    """
+    Lưu kết quả quét vào lịch sử (ghi trễ theo lô, không chặn UI).
+    wait=True: chờ đến khi dòng này thực sự đã xuống DB.
+    """
+    from history_writer import get_history_writer
+    writer = get_history_writer()
+    writer.submit(make_scan_row(ingredients_list, risk_status, ingredient_ids))
+    if wait:
+        writer.flush()
+
+@timed('db.get_recent_history')
 def get_recent_history(limit=10):
     """Lấy danh sách 10 lần quét gần nhất"""
     conn = get_connection()
@@ -98,3 +535,126 @@ def get_recent_history(limit=10):
         return []
     finally:
         conn.close()
+
+@timed('db.get_history_page')
+def get_history_page(limit=10, before_scan_id=None, date_from=None, date_to=None, risk_level=None, ingredient_id=None):
+    """
+    Phân trang lịch sử theo keyset (không dùng OFFSET): mỗi trang chỉ đọc đúng `limit` dòng qua index.
+    - before_scan_id: con trỏ trang trước (lấy từ kết quả lần gọi trước)
+    - date_from / date_to: 'YYYY-MM-DD[ HH:MM:SS]' (UTC), date_to không bao gồm.
+      Khi lọc theo ngày, trang được sắp theo (scan_date, scan_id) giảm dần.
+    - risk_level: 'SAFE' | 'WARNING' | 'DANGER'
+    - ingredient_id: chỉ lấy các lần quét có chứa hoạt chất này
+    Trả về: (list dòng, con trỏ trang kế tiếp hoặc None nếu hết)
+    """
+    conn = get_connection()
+    if not conn: return [], None
+    try:
+        cursor = conn.cursor()
+        # Lọc thẳng trên scan_date (không suy ra khoảng scan_id: nhiều process ghi lô thì scan_id
+        # không tăng cùng scan_date). scan_id là rowid nên idx_scan_history_date chính là
+        # index (scan_date, scan_id): khoảng ngày + con trỏ keyset đều là 1 lần seek trên nó.
+        where, params = [], []
+        if date_from:
+            where.append("h.scan_date >= ?"); params.append(date_from)
+        if date_to:
+            where.append("h.scan_date < ?"); params.append(date_to)
+        if risk_level:
+            where.append("h.risk_level = ?"); params.append(risk_level)
+
+        select = """SELECT h.*, (SELECT COUNT(*) FROM Scan_History_Ingredients c WHERE c.scan_id = h.scan_id) AS ingredient_count"""
+        if ingredient_id is not None:
+            # Đi theo idx_scan_ingredients_ingredient (ingredient_id, scan_id)
+            where.insert(0, "l.ingredient_id = ?"); params.insert(0, ingredient_id)
+            if before_scan_id is not None:
+                where.append("l.scan_id < ?"); params.append(before_scan_id)
+            sql = f"""{select}
+                FROM Scan_History_Ingredients l JOIN Scan_History h ON h.scan_id = l.scan_id
+                WHERE {' AND '.join(where)}
+                GROUP BY l.scan_id ORDER BY l.scan_id DESC LIMIT ?"""
+        else:
+            order = "h.scan_id DESC"
+            if date_from or date_to:
+                order = "h.scan_date DESC, h.scan_id DESC"
+                if before_scan_id is not None:
+                    where.append("(h.scan_date, h.scan_id) < ((SELECT scan_date FROM Scan_History WHERE scan_id = ?), ?)")
+                    params += [before_scan_id, before_scan_id]
+            elif before_scan_id is not None:
+                where.append("h.scan_id < ?"); params.append(before_scan_id)
+            sql = f"""{select} FROM Scan_History h
+                {('WHERE ' + ' AND '.join(where)) if where else ''}
+                ORDER BY {order} LIMIT ?"""
+        cursor.execute(sql, params + [limit])
+        rows = cursor.fetchall()
+        next_cursor = rows[-1]['scan_id'] if len(rows) == limit else None
+        return rows, next_cursor
+    except Exception as e:
+        print(f"Lỗi đọc lịch sử: {e}")
+        return [], None
+    finally:
+        conn.close()
+
+@timed('db.get_scan_ingredients')
+def get_scan_ingredients(scan_id):
+    """Danh sách hoạt chất (tên gốc + ID nhận diện) của 1 lần quét"""
+    conn = get_connection()
+    if not conn: return []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT position, ingredient_name, ingredient_id FROM Scan_History_Ingredients
+            WHERE scan_id = ? ORDER BY position
+        """, (scan_id,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+# --- PHIÊN CHAT CỦA API (DÙNG CHUNG GIỮA CÁC WORKER PROCESS) ---
+
+@timed('db.save_chat_session')
+def save_chat_session(session_id, ingredients, skin_type, is_pregnant, turns, summary_lines):
+    """Ghi (hoặc cập nhật) phiên chat; đồng thời xóa các phiên đã quá hạn"""
+    conn = get_connection()
+    if not conn: return False
+    try:
+        now = time.time()
+        conn.execute("""
+            INSERT OR REPLACE INTO Chat_Sessions
+            (session_id, ingredients, skin_type, is_pregnant, turns, summary_lines, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (session_id, json.dumps(list(ingredients), ensure_ascii=False), skin_type, int(bool(is_pregnant)),
+              json.dumps([list(t) for t in turns], ensure_ascii=False),
+              json.dumps(list(summary_lines), ensure_ascii=False), now))
+        conn.execute("DELETE FROM Chat_Sessions WHERE updated_at < ?", (now - CHAT_SESSION_TTL,))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"⚠️ Lỗi lưu phiên chat: {e}")
+        return False
+    finally:
+        conn.close()
+
+@timed('db.load_chat_session')
+def load_chat_session(session_id):
+    """dict (ingredients, skin_type, is_pregnant, turns, summary_lines) hoặc None nếu không có / đã hết hạn"""
+    conn = get_connection()
+    if not conn: return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM Chat_Sessions WHERE session_id = ? AND updated_at >= ?",
+                       (session_id, time.time() - CHAT_SESSION_TTL))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'ingredients': json.loads(row['ingredients']),
+            'skin_type': row['skin_type'],
+            'is_pregnant': bool(row['is_pregnant']),
+            'turns': [tuple(t) for t in json.loads(row['turns'])],
+            'summary_lines': json.loads(row['summary_lines']),
+        }
+    except Exception as e:
+        print(f"⚠️ Lỗi đọc phiên chat: {e}")
+        return None
+    finally:
+        conn.close()
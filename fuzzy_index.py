@@ -0,0 +1,177 @@
+import threading
+from collections import Counter
+
+from cache_utils import LRUCache
+from ingredient_matcher import tokenize, iter_patterns, PRIORITY_INCI
+from knowledge_base import get_knowledge_base
+
+# =====================================================
+# TRA CỨU GẦN ĐÚNG (CHỊU LỖI OCR): "Niacinamde" -> Niacinamide
+# =====================================================
+# Chỉ mục đảo theo trigram ký tự + kiểm tra khoảng cách Levenshtein có chặn trên.
+# Theo bổ đề q-gram, chuỗi cách query <= k lỗi phải chung ít nhất |G| - 3k trigram
+# nên phần lớn ứng viên bị loại trước khi phải tính khoảng cách.
+
+GRAM = 3
+CACHE_SIZE = 4096
+LOW_CONFIDENCE = 0.85   # Dưới ngưỡng này UI nên gắn cờ "cần kiểm tra lại"
+
+
+def normalize_token(text):
+    return " ".join(tok for tok, _, _ in tokenize(text))
+
+
+def grams_of(text):
+    padded = f"^{text}$"
+    return {padded[i:i + GRAM] for i in range(len(padded) - GRAM + 1)}
+
+
+def max_distance_for(length):
+    """Số lỗi OCR cho phép theo độ dài (tên quá ngắn thì chỉ chấp nhận khớp chính xác)"""
+    if length <= 4:
+        return 0
+    if length <= 8:
+        return 1
+    if length <= 15:
+        return 2
+    return 3
+
+
+def bounded_levenshtein(a, b, limit):
+    """Khoảng cách Levenshtein, trả về limit + 1 ngay khi chắc chắn vượt ngưỡng"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for j, cb in enumerate(b, 1):
+        current = [j] + [0] * len(a)
+        row_min = j
+        for i, ca in enumerate(a, 1):
+            cost = 0 if ca == cb else 1
+            current[i] = min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + cost)
+            if current[i] < row_min:
+                row_min = current[i]
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyResult:
+    """Kết quả tra cứu gần đúng, kèm độ tin cậy 0..1"""
+    __slots__ = ('ingredient_id', 'name', 'distance', 'confidence')
+
+    def __init__(self, ingredient_id, name, distance, confidence):
+        self.ingredient_id = ingredient_id
+        self.name = name
+        self.distance = distance
+        self.confidence = confidence
+
+    @property
+    def is_low_confidence(self):
+        return self.confidence < LOW_CONFIDENCE
+
+    def __repr__(self):
+        return f"FuzzyResult({self.name!r}, id={self.ingredient_id}, conf={self.confidence:.2f})"
+
+
+class FuzzyIndex:
+    """Chỉ mục trigram trên inci_name + common_names"""
+
+    _MISSING = object()
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self._names = []         # list (tên chuẩn hóa, ingredient_id, priority)
+        self._postings = {}      # trigram -> list chỉ số trong self._names
+        self._seen = {}          # tên chuẩn hóa -> chỉ số (tránh trùng)
+        self.cache = LRUCache(cache_size)
+        self.version = None
+
+    @classmethod
+    def from_knowledge_base(cls, kb, cache_size=CACHE_SIZE):
+        index = cls(cache_size)
+        for name, ingredient_id, priority in iter_patterns(kb):
+            index.add(name, ingredient_id, priority)
+        index.version = kb.version
+        return index
+
+    def add(self, name, ingredient_id, priority=PRIORITY_INCI):
+        norm = normalize_token(name)
+        if not norm or norm in self._seen:
+            return
+        idx = len(self._names)
+        self._seen[norm] = idx
+        self._names.append((norm, ingredient_id, priority))
+        for g in grams_of(norm):
+            self._postings.setdefault(g, []).append(idx)
+        self.cache.clear()
+
+    def _candidates(self, query, k):
+        grams = grams_of(query)
+        need = len(grams) - GRAM * k
+        if need > 0:
+            # Lọc theo số trigram chung (bổ đề q-gram) trước khi tính Levenshtein
+            counts = Counter()
+            for g in grams:
+                counts.update(self._postings.get(g, ()))
+            return [idx for idx, c in counts.items() if c >= need]
+        # Query quá ngắn: chỉ cần (GRAM * k + 1) trigram hiếm nhất để không bỏ sót ứng viên
+        rare = sorted(grams, key=lambda g: len(self._postings.get(g, ())))[:GRAM * k + 1]
+        candidates = set()
+        for g in rare:
+            candidates.update(self._postings.get(g, ()))
+        return candidates
+
+    def resolve(self, token, max_distance=None):
+        """Tìm hoạt chất gần nhất với token OCR. Trả về FuzzyResult hoặc None."""
+        query = normalize_token(token)
+        if not query:
+            return None
+        cached = self.cache.get((query, max_distance), self._MISSING)
+        if cached is not self._MISSING:
+            return cached
+
+        result = None
+        exact = self._seen.get(query)
+        if exact is not None:
+            norm, ing_id, _ = self._names[exact]
+            result = FuzzyResult(ing_id, norm, 0, 1.0)
+        else:
+            k = max_distance_for(len(query)) if max_distance is None else max_distance
+            if k > 0:
+                best = None
+                for idx in self._candidates(query, k):
+                    norm, ing_id, priority = self._names[idx]
+                    limit = best[0] if best and best[0] < k else k
+                    dist = bounded_levenshtein(query, norm, limit)
+                    if dist > limit:
+                        continue
+                    key = (dist, -priority, abs(len(norm) - len(query)))
+                    if best is None or key < best[:3]:
+                        best = (dist, -priority, abs(len(norm) - len(query)), ing_id, norm)
+                if best:
+                    dist, _, _, ing_id, norm = best
+                    confidence = 1.0 - dist / max(len(query), len(norm))
+                    result = FuzzyResult(ing_id, norm, dist, confidence)
+
+        self.cache.put((query, max_distance), result)
+        return result
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS (cache sống qua nhiều lần quét) ---
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_fuzzy_index():
+    global _index
+    kb = get_knowledge_base()
+    if kb is None:
+        return _index
+    if _index is not None and _index.version == kb.version:
+        return _index
+    with _index_lock:
+        if _index is None or _index.version != kb.version:
+            _index = FuzzyIndex.from_knowledge_base(kb)
+        return _index
@@ -0,0 +1,115 @@
+import atexit
+import queue
+import threading
+import time
+
+from database_utils import insert_scan_results
+
+# =====================================================
+# GHI TRỄ LỊCH SỬ QUÉT THEO LÔ (WRITE-BEHIND)
+# =====================================================
+# UI chỉ đẩy dòng vào hàng đợi rồi đi tiếp. Một luồng nền gom tối đa BATCH_SIZE dòng
+# hoặc chờ tối đa FLUSH_INTERVAL_MS rồi ghi cả lô trong 1 transaction (1 lần fsync).
+BATCH_SIZE = 100
+FLUSH_INTERVAL_MS = 200
+MAX_QUEUE = 10000
+
+
+class HistoryWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval_ms=FLUSH_INTERVAL_MS,
+                 max_queue=MAX_QUEUE, insert_fn=insert_scan_results):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._insert = insert_fn
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def submit(self, row):
+        """Đưa 1 dòng vào hàng đợi. Không bao giờ chặn: hàng đợi đầy thì bỏ dòng và báo lỗi."""
+        if self._stopped.is_set():
+            self._insert([row])
+            return
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            print("⚠️ Hàng đợi lịch sử đầy, bỏ qua 1 bản ghi.")
+
+    def flush(self, timeout=None):
+        """Chờ mọi dòng đã submit được ghi xong (dùng trong test / khi tắt)"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self, timeout=5.0):
+        """Ghi nốt phần còn lại rồi dừng luồng nền"""
+        if self._stopped.is_set():
+            return
+        self.flush(timeout)
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                if self._insert(batch):
+                    self.written += len(batch)
+                    self.batches += 1
+                else:
+                    self.dropped += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Lỗi lưu lịch sử: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+        }
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = HistoryWriter()
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,134 @@
+import io
+import time
+
+from PIL import Image, ImageFilter, ImageOps
+
+# =====================================================
+# TIỀN XỬ LÝ ẢNH TRƯỚC KHI GỬI OCR
+# =====================================================
+# Ảnh điện thoại 12MP+ (vài MB) được thu nhỏ, chuyển xám, tăng tương phản và nén lại
+# trước khi upload. Chữ trên nhãn vẫn đọc được rõ ở cạnh dài ~1600px.
+MAX_EDGE = 1600           # Cạnh dài tối đa (px)
+MAX_BYTES = 600_000       # Dung lượng tối đa sau khi nén lại
+JPEG_QUALITY = 85
+MIN_JPEG_QUALITY = 50
+LABEL_MIN_AREA = 0.2      # Vùng nhãn phải chiếm >= 20% ảnh thì mới crop
+
+
+class PreprocessResult:
+    """Ảnh đã xử lý + số liệu đo đạc"""
+    __slots__ = ('data', 'image', 'original_bytes', 'original_size', 'output_size', 'elapsed_ms', 'cropped')
+
+    def __init__(self, data, image, original_bytes, original_size, output_size, elapsed_ms, cropped=False):
+        self.data = data
+        self.image = image
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.output_size = output_size
+        self.elapsed_ms = elapsed_ms
+        self.cropped = cropped
+
+    @property
+    def output_bytes(self):
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - self.output_bytes
+
+    def as_dict(self):
+        return {
+            'original_bytes': self.original_bytes,
+            'output_bytes': self.output_bytes,
+            'bytes_saved': self.bytes_saved,
+            'original_size': self.original_size,
+            'output_size': self.output_size,
+            'cropped': self.cropped,
+            'preprocess_ms': round(self.elapsed_ms, 2),
+        }
+
+
+def find_label_region(img, margin=0.03):
+    """
+    Ước lượng vùng có chữ (nhiều cạnh) trên ảnh xám: tìm cạnh, lọc nhiễu, lấy bounding box.
+    Trả về (left, top, right, bottom) hoặc None nếu không chắc chắn.
+    """
+    small = img.copy()
+    small.thumbnail((400, 400))
+    edges = small.filter(ImageFilter.FIND_EDGES).point(lambda p: 255 if p > 60 else 0)
+    edges = edges.filter(ImageFilter.MaxFilter(5))
+    bbox = edges.getbbox()
+    if not bbox:
+        return None
+
+    sx = img.width / small.width
+    sy = img.height / small.height
+    left, top, right, bottom = bbox
+    pad_x, pad_y = img.width * margin, img.height * margin
+    box = (
+        max(0, int(left * sx - pad_x)), max(0, int(top * sy - pad_y)),
+        min(img.width, int(right * sx + pad_x)), min(img.height, int(bottom * sy + pad_y)),
+    )
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area < LABEL_MIN_AREA * img.width * img.height or area >= 0.98 * img.width * img.height:
+        return None
+    return box
+
+
+def _encode_jpeg(img, max_bytes):
+    """Nén JPEG, giảm dần chất lượng rồi kích thước cho tới khi <= max_bytes"""
+    quality = JPEG_QUALITY
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=quality, optimize=True)
+        data = buf.getvalue()
+        if len(data) <= max_bytes:
+            return data, img
+        if quality > MIN_JPEG_QUALITY:
+            quality = max(MIN_JPEG_QUALITY, quality - 10)
+        elif min(img.size) > 400:
+            img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.LANCZOS)
+        else:
+            return data, img
+
+
+def preprocess_image(image_bytes, max_edge=MAX_EDGE, grayscale=True, autocontrast=True,
+                     crop_label=False, max_bytes=MAX_BYTES):
+    """
+    Chuẩn hóa ảnh nhãn trước khi OCR:
+    xoay theo EXIF -> (crop vùng nhãn) -> thu nhỏ -> (xám + tăng tương phản) -> nén JPEG <= max_bytes.
+    """
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(image_bytes))
+    original_size = img.size
+    if img.format == 'JPEG' and not crop_label:
+        # Giải mã thẳng ở độ phân giải thấp (DCT scaling) thay vì giải mã full rồi mới thu nhỏ
+        img.draft('L' if grayscale else 'RGB', (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+
+    if grayscale:
+        img = img.convert('L')
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    cropped = False
+    if crop_label:
+        box = find_label_region(img if img.mode == 'L' else img.convert('L'))
+        if box:
+            img = img.crop(box)
+            cropped = True
+
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    if autocontrast:
+        img = ImageOps.autocontrast(img, cutoff=1)
+
+    data, img = _encode_jpeg(img, max_bytes)
+    # Ảnh gốc đã nhỏ và gọn hơn thì giữ nguyên (tránh nén lại làm mờ chữ vô ích)
+    if len(data) >= len(image_bytes) and not cropped and max(original_size) <= max_edge:
+        data = image_bytes
+        img = Image.open(io.BytesIO(image_bytes))
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return PreprocessResult(data, img, len(image_bytes), original_size, img.size, elapsed_ms, cropped)
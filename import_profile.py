@@ -0,0 +1,128 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# =====================================================
+# ĐO THỜI GIAN IMPORT (THEO DÕI TỐC ĐỘ KHỞI ĐỘNG)
+# =====================================================
+# python import_profile.py                              (các module mặc định)
+# python import_profile.py app chat_service --top 20
+# python import_profile.py --json import_profile.json   (lưu lại làm mốc)
+# python import_profile.py --baseline import_profile.json --threshold 20
+#     -> exit code 1 nếu module nào chậm hơn mốc quá 20%
+#
+# Mỗi module được import trong 1 process Python mới với `-X importtime`,
+# nên số đo là thời gian khởi động lạnh thật sự (không bị cache sys.modules).
+DEFAULT_TARGETS = ['chat_service', 'services', 'data_importer_comprehensive', 'interaction_manager']
+
+
+def parse_importtime(stderr):
+    """Các dòng 'import time: self | cumulative | name' -> list dict (đơn vị micro giây)"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # Dòng tiêu đề
+        name = parts[2].rstrip()
+        entries.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip())) // 2,
+            'self_us': int(parts[0]),
+            'cumulative_us': int(parts[1]),
+        })
+    return entries
+
+
+def profile_module(module, python=sys.executable):
+    """Import module trong process mới, trả về (tổng micro giây, list entries)"""
+    proc = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        last_line = (proc.stderr.strip().splitlines() or ['?'])[-1]
+        raise RuntimeError(f"Không import được {module}: {last_line}")
+    entries = parse_importtime(proc.stderr)
+    # Chỉ giữ cây import của module đích (bỏ site/encodings... lúc khởi động interpreter).
+    # importtime in module con trước, module cha (depth 0) ở cuối nhánh.
+    end = max((i for i, e in enumerate(entries) if e['module'] == module and e['depth'] == 0), default=None)
+    if end is None:
+        return sum(e['self_us'] for e in entries), entries
+    start = end
+    while start > 0 and entries[start - 1]['depth'] > 0:
+        start -= 1
+    return entries[end]['cumulative_us'], entries[start:end + 1]
+
+
+def summarize(entries, top=10):
+    """Gộp self time theo package gốc (vd: 'plotly.express' -> 'plotly'), sắp giảm dần"""
+    by_package = {}
+    for e in entries:
+        package = e['module'].split('.')[0]
+        by_package[package] = by_package.get(package, 0) + e['self_us']
+    ranked = sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)
+    return [{'package': p, 'self_ms': round(us / 1000, 2)} for p, us in ranked[:top]]
+
+
+def build_report(targets, repeat=3, top=10):
+    """Chạy mỗi module `repeat` lần, giữ lần nhanh nhất (ít nhiễu nhất)"""
+    report = {'python': sys.version.split()[0], 'modules': {}}
+    for module in targets:
+        best = None
+        for _ in range(repeat):
+            try:
+                total, entries = profile_module(module)
+            except RuntimeError as e:
+                best = {'error': str(e)}
+                break
+            if best is None or total < best['total_ms'] * 1000:
+                best = {'total_ms': round(total / 1000, 2), 'packages': summarize(entries, top)}
+        report['modules'][module] = best
+    return report
+
+
+def compare(report, baseline, threshold_pct):
+    """Danh sách (module, mốc ms, hiện tại ms) chậm hơn mốc quá threshold_pct %"""
+    regressions = []
+    for module, result in report['modules'].items():
+        old = baseline.get('modules', {}).get(module)
+        if not old or 'total_ms' not in old or 'total_ms' not in result:
+            continue
+        if result['total_ms'] > old['total_ms'] * (1 + threshold_pct / 100.0):
+            regressions.append((module, old['total_ms'], result['total_ms']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Báo cáo thời gian import theo từng module")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_TARGETS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help="Số package tốn thời gian nhất hiển thị cho mỗi module")
+    parser.add_argument('--json', default=None, help="Ghi báo cáo ra file JSON")
+    parser.add_argument('--baseline', default=None, help="File JSON mốc để so sánh")
+    parser.add_argument('--threshold', type=float, default=20.0, help="Ngưỡng chậm đi (%%) bị coi là hồi quy")
+    args = parser.parse_args()
+
+    report = build_report(args.modules, repeat=args.repeat, top=args.top)
+    for module, result in report['modules'].items():
+        if 'error' in result:
+            print(f"❌ {module}: {result['error']}")
+            continue
+        print(f"📦 {module}: {result['total_ms']} ms")
+        for item in result['packages']:
+            print(f"   {item['self_ms']:>8.2f} ms  {item['package']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Đã ghi {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for module, old_ms, new_ms in regressions:
+            print(f"⚠️ {module} chậm đi: {old_ms} ms -> {new_ms} ms")
+        if regressions:
+            sys.exit(1)
+        print("✅ Không có hồi quy thời gian import.")
@@ -0,0 +1,214 @@
+import bisect
+import re
+import threading
+
+from knowledge_base import get_knowledge_base
+
+# =====================================================
+# BỘ KHỚP ĐA MẪU (AHO–CORASICK THEO TỪ) CHO NHÃN MỸ PHẨM
+# =====================================================
+# Automaton được dựng trên chuỗi "từ" (token) thay vì từng ký tự:
+#   - Ranh giới từ được đảm bảo tự nhiên ("Glycerin" không khớp trong "Ethylhexylglycerin").
+#   - Khác biệt dấu câu do OCR ("PEG 100 Stearate" vs "PEG-100 Stearate") không ảnh hưởng.
+#   - Số node ~ số từ khác nhau, đủ nhẹ cho từ điển cỡ CosIng (hàng chục nghìn chất).
+
+TOKEN_RE = re.compile(r"\w+")
+
+PRIORITY_INCI = 2
+PRIORITY_ALIAS = 1
+
+
+def tokenize(text):
+    """Tách chuỗi thành list (token, vị trí bắt đầu, vị trí kết thúc)"""
+    return [(m.group().casefold(), m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+
+
+def iter_patterns(kb):
+    """
+    Sinh (tên, ingredient_id, priority) từ inci_name và common_names.
+    Tên INCI luôn thắng alias. Alias trỏ tới nhiều chất khác nhau (VD: "Cồn béo") bị bỏ qua.
+    """
+    alias_owner = {}
+    for rec in kb:
+        yield rec.inci_name, rec.ingredient_id, PRIORITY_INCI
+        for alias in (rec.common_names or '').split(','):
+            key = tuple(tok for tok, _, _ in tokenize(alias))
+            if key:
+                alias_owner.setdefault(key, set()).add(rec.ingredient_id)
+    for rec in kb:
+        for alias in (rec.common_names or '').split(','):
+            key = tuple(tok for tok, _, _ in tokenize(alias))
+            if key and len(alias_owner[key]) == 1:
+                yield alias.strip(), rec.ingredient_id, PRIORITY_ALIAS
+
+
+class Match:
+    """Một kết quả khớp trên nhãn"""
+    __slots__ = ('start', 'end', 'ingredient_id', 'text', 'pattern')
+
+    def __init__(self, start, end, ingredient_id, text, pattern):
+        self.start = start
+        self.end = end
+        self.ingredient_id = ingredient_id
+        self.text = text
+        self.pattern = pattern
+
+    def __repr__(self):
+        return f"Match({self.text!r} -> {self.ingredient_id}, {self.start}:{self.end})"
+
+
+class IngredientMatcher:
+    """Automaton Aho–Corasick dựng 1 lần từ inci_name + common_names"""
+
+    def __init__(self):
+        self._goto = {}          # (node, token) -> node con
+        self._fail = [0]
+        self._depth = [0]
+        self._output = [None]    # node -> (ingredient_id, pattern, priority) nếu là điểm kết thúc
+        self._dict_link = [0]    # node -> node kết thúc gần nhất theo chuỗi fail
+        self._built = False
+        self.version = None
+
+    @classmethod
+    def from_knowledge_base(cls, kb):
+        matcher = cls()
+        for pattern, ingredient_id, priority in iter_patterns(kb):
+            matcher.add(pattern, ingredient_id, priority)
+        matcher.build()
+        matcher.version = kb.version
+        return matcher
+
+    def add(self, pattern, ingredient_id, priority=PRIORITY_INCI):
+        tokens = [tok for tok, _, _ in tokenize(pattern)]
+        if not tokens:
+            return
+        node = 0
+        for tok in tokens:
+            child = self._goto.get((node, tok))
+            if child is None:
+                child = len(self._fail)
+                self._goto[(node, tok)] = child
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._output.append(None)
+                self._dict_link.append(0)
+            node = child
+        current = self._output[node]
+        if current is None or priority > current[2]:
+            self._output[node] = (ingredient_id, pattern, priority)
+        self._built = False
+
+    def build(self):
+        """Tính fail link và dictionary link theo BFS"""
+        children = {}
+        for (parent, tok), child in self._goto.items():
+            children.setdefault(parent, []).append((tok, child))
+
+        queue = []
+        for tok, child in children.get(0, []):
+            self._fail[child] = 0
+            self._dict_link[child] = 0
+            queue.append(child)
+
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for tok, child in children.get(node, []):
+                f = self._fail[node]
+                while f and (f, tok) not in self._goto:
+                    f = self._fail[f]
+                target = self._goto.get((f, tok), 0)
+                self._fail[child] = target if target != child else 0
+                fail = self._fail[child]
+                self._dict_link[child] = fail if self._output[fail] is not None else self._dict_link[fail]
+                queue.append(child)
+        self._built = True
+
+    def _scan(self, text, segments=None):
+        """
+        Duyệt 1 lượt, trả về mọi ứng viên (start, end, số token, output).
+        segments: vị trí bắt đầu của từng đoạn độc lập (match không được vắt qua 2 đoạn).
+        """
+        if not self._built:
+            self.build()
+        tokens = tokenize(text)
+        candidates = []
+        node = 0
+        seg = 0
+        for i, (tok, start, end) in enumerate(tokens):
+            if segments:
+                while seg + 1 < len(segments) and start >= segments[seg + 1]:
+                    seg += 1
+                    node = 0
+            while node and (node, tok) not in self._goto:
+                node = self._fail[node]
+            node = self._goto.get((node, tok), 0)
+
+            hit = node if self._output[node] is not None else self._dict_link[node]
+            while hit:
+                depth = self._depth[hit]
+                candidates.append((tokens[i - depth + 1][1], end, depth, self._output[hit]))
+                hit = self._dict_link[hit]
+        return candidates
+
+    def find_all(self, text, segments=None):
+        """Các kết quả khớp dài nhất, không chồng lấn, theo thứ tự xuất hiện"""
+        candidates = self._scan(text, segments)
+        # Ưu tiên match dài hơn (nhiều token), rồi tên INCI, rồi vị trí sớm hơn
+        candidates.sort(key=lambda c: (-c[2], -c[3][2], c[0]))
+
+        starts, ends, chosen = [], [], []
+        for start, end, _, (ing_id, pattern, _) in candidates:
+            pos = bisect.bisect_left(starts, start)
+            if pos > 0 and ends[pos - 1] > start:
+                continue
+            if pos < len(starts) and starts[pos] < end:
+                continue
+            starts.insert(pos, start)
+            ends.insert(pos, end)
+            chosen.insert(pos, Match(start, end, ing_id, text[start:end], pattern))
+        return chosen
+
+    def match_names(self, names):
+        """
+        Khớp cả danh sách tên do OCR trả về trong 1 lượt quét.
+        Trả về list ingredient_id (hoặc None) tương ứng từng tên: match dài nhất trong tên đó.
+        """
+        offsets = []
+        pos = 0
+        for name in names:
+            offsets.append(pos)
+            pos += len(name) + 1
+        label = "\n".join(names)
+
+        results = [None] * len(names)
+        best_len = [0] * len(names)
+        for m in self.find_all(label, offsets):
+            idx = bisect.bisect_right(offsets, m.start) - 1
+            if m.end - m.start > best_len[idx]:
+                best_len[idx] = m.end - m.start
+                results[idx] = m.ingredient_id
+        return results
+
+    def match_name(self, name):
+        return self.match_names([name])[0]
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Trả về matcher khớp với phiên bản kho tri thức hiện tại (dựng lại khi DB đổi)"""
+    global _matcher
+    kb = get_knowledge_base()
+    if kb is None:
+        return _matcher
+    if _matcher is not None and _matcher.version == kb.version:
+        return _matcher
+    with _matcher_lock:
+        if _matcher is None or _matcher.version != kb.version:
+            _matcher = IngredientMatcher.from_knowledge_base(kb)
+        return _matcher
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from database_utils import get_connection
+
+# =====================================================
+# ĐỒ THỊ TƯƠNG TÁC TRONG BỘ NHỚ (Ingredient_Interactions)
+# =====================================================
+GRAPH_CHECK_INTERVAL = 5.0  # Số giây giữa 2 lần kiểm tra bảng tương tác có đổi không
+
+
+def pair_key(id_a, id_b):
+    """Khóa chuẩn cho 1 cặp: (id nhỏ, id lớn) -> tra cứu không phụ thuộc thứ tự"""
+    return (id_a, id_b) if id_a <= id_b else (id_b, id_a)
+
+
+class InteractionGraph:
+    """Map cặp (min, max) -> (interaction_type, severity_level, advice_vn) + danh sách kề"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.pairs = {}
+        self.adjacency = {}
+        for id_a, id_b, itype, level, advice in rows:
+            if id_a is None or id_b is None or id_a == id_b:
+                continue
+            key = pair_key(id_a, id_b)
+            # Giữ quy tắc đầu tiên nếu DB cũ còn bản ghi trùng 2 chiều
+            if key in self.pairs:
+                continue
+            self.pairs[key] = (itype, level, advice)
+            self.adjacency.setdefault(id_a, set()).add(id_b)
+            self.adjacency.setdefault(id_b, set()).add(id_a)
+
+    @classmethod
+    def from_connection(cls, conn, version=None):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ingredient_a_id, ingredient_b_id, interaction_type, severity_level, advice_vn
+            FROM Ingredient_Interactions
+            ORDER BY interaction_id
+        """)
+        rows = [tuple(row) for row in cursor.fetchall()]
+        if version is None:
+            version = get_interactions_version(conn)
+        return cls(rows, version)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def get(self, id_a, id_b):
+        """Tương tác giữa 2 chất (không phân biệt thứ tự) hoặc None"""
+        return self.pairs.get(pair_key(id_a, id_b))
+
+    def find_pairs(self, ingredient_ids):
+        """
+        Mọi cặp có tương tác trong một tập hoạt chất (VD: toàn bộ nhãn 1 sản phẩm).
+        Trả về list (id_a, id_b, interaction_type, severity_level, advice_vn) với id_a < id_b.
+        """
+        ids = {i for i in ingredient_ids if i is not None}
+        found = []
+        for id_a in sorted(ids):
+            for id_b in self.adjacency.get(id_a, ()):
+                if id_b > id_a and id_b in ids:
+                    found.append((id_a, id_b) + self.pairs[(id_a, id_b)])
+        found.sort()
+        return found
+
+
+def get_interactions_version(conn):
+    """(số dòng, ID lớn nhất, bộ đếm thay đổi do trigger tăng) -> đổi cả khi chỉ UPDATE nội dung cặp"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*), MAX(interaction_id),
+               (SELECT version FROM Data_Versions WHERE table_name = 'Ingredient_Interactions')
+        FROM Ingredient_Interactions
+    """)
+    return tuple(cursor.fetchone())
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_graph = None
+_graph_checked_at = 0.0
+_graph_lock = threading.Lock()
+
+
+def get_interaction_graph(force_check=False):
+    """Trả về đồ thị tương tác dùng chung, nạp lại khi bảng Ingredient_Interactions thay đổi"""
+    global _graph, _graph_checked_at
+    if _graph is not None and not force_check and time.monotonic() - _graph_checked_at < GRAPH_CHECK_INTERVAL:
+        return _graph
+
+    with _graph_lock:
+        if _graph is not None and not force_check and time.monotonic() - _graph_checked_at < GRAPH_CHECK_INTERVAL:
+            return _graph
+        conn = get_connection()
+        if not conn:
+            return _graph
+        try:
+            version = get_interactions_version(conn)
+            if _graph is None or _graph.version != version:
+                _graph = InteractionGraph.from_connection(conn, version)
+        finally:
+            conn.close()
+        _graph_checked_at = time.monotonic()
+        return _graph
+
+
+def invalidate_interaction_graph():
+    global _graph_checked_at
+    _graph_checked_at = 0.0
@@ -1,4 +1,5 @@
-from database_utils import get_connection, get_ingredient_id
+from bulk_importer import bulk_load_interactions
+from database_utils import get_connection
 import sqlite3
 
 INTERACTIONS_DATA = [
@@ -18,41 +19,19 @@ INTERACTIONS_DATA = [
 def import_interactions():
     conn = get_connection()
     if not conn: return
-    cursor = conn.cursor()
 
     print("\n🧠 Bắt đầu liên kết Tương tác (Interactions)...")
-    count = 0
+    # 1 câu lệnh nạp cả lô: cặp chuẩn (a < b) + unique index tự bỏ trùng ở cả 2 chiều
+    report = bulk_load_interactions(INTERACTIONS_DATA, conn=conn)
+    if report.get('error'):
+        print(f"   ❌ Lỗi: {report['error']}")
+    for name_a, name_b in report['missing']:
+        print(f"   ⚠️ Thiếu dữ liệu gốc cho cặp: {name_a} - {name_b}")
+    if report['duplicates']:
+        print(f"   ⏩ Bỏ qua {report['duplicates']} cặp đã có.")
 
-    for item in INTERACTIONS_DATA:
-        # Tái sử dụng hàm tìm ID chuẩn
-        id_a = get_ingredient_id(cursor, item['a'])
-        id_b = get_ingredient_id(cursor, item['b'])
-
-        if id_a and id_b:
-            try:
-                # Kiểm tra xem cặp này đã có chưa để tránh trùng lặp
-                check_sql = "SELECT 1 FROM Ingredient_Interactions WHERE ingredient_a_id=? AND ingredient_b_id=?"
-                cursor.execute(check_sql, (id_a, id_b))
-                if cursor.fetchone():
-                    print(f"   ⏩ Đã có: {item['a']} - {item['b']}")
-                    continue
-
-                sql = """
-                INSERT INTO Ingredient_Interactions 
-                (ingredient_a_id, ingredient_b_id, interaction_type, severity_level, advice_vn, scientific_ref)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """
-                cursor.execute(sql, (id_a, id_b, item['type'], item['level'], item['advice'], item['ref']))
-                count += 1
-                print(f"   🔗 Đã nối: {item['a']} <-> {item['b']} ({item['type']})")
-            except Exception as e:
-                print(f"   ❌ Lỗi: {e}")
-        else:
-            print(f"   ⚠️ Thiếu dữ liệu gốc cho cặp: {item['a']} - {item['b']}")
-
-    conn.commit()
     conn.close()
-    print(f"🎉 Hoàn tất liên kết {count} quy tắc mới.\n")
+    print(f"🎉 Hoàn tất liên kết {report['inserted']} quy tắc mới.\n")
 
 if __name__ == "__main__":
     import_interactions()
\ No newline at end of file
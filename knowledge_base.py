@@ -0,0 +1,293 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from database_utils import get_connection, get_db_path
+
+# =====================================================
+# KHO TRI THỨC HOẠT CHẤT (READ-ONLY, NẠP 1 LẦN / PROCESS)
+# =====================================================
+SNAPSHOT_SUFFIX = '.kb'
+SNAPSHOT_MAGIC = b'AKB\x00'
+SNAPSHOT_FORMAT = 2
+# Snapshot dạng cột, đọc thẳng trên mmap (các process dùng chung page cache của file, không unpickle):
+#   header (magic, format, số dòng, độ dài metadata) + metadata JSON (phiên bản, vị trí từng cột)
+#   + vùng dữ liệu, mỗi cột căn 8 byte: mảng giá trị cố định độ rộng (int64 / float64, hoặc offset
+#   uint32 vào blob UTF-8 với cột chữ) + mảng đánh dấu NULL (1 byte / dòng)
+SNAPSHOT_HEADER = struct.Struct('<4sIII')
+KB_CHECK_INTERVAL = 5.0  # Số giây giữa 2 lần kiểm tra DB có thay đổi không
+
+FIELDS = (
+    'ingredient_id', 'inci_name', 'common_names', 'function_category',
+    'safety_rating', 'comedogenic_rating', 'pregnancy_safe',
+    'mechanism_of_action', 'last_updated',
+)
+
+# Các cột trả về giống hệt database_utils.get_ingredient_details()
+DETAIL_FIELDS = (
+    'inci_name', 'function_category', 'safety_rating',
+    'comedogenic_rating', 'pregnancy_safe', 'mechanism_of_action',
+)
+
+
+def normalize_name(name):
+    """Chuẩn hóa tên chất để tra cứu: chữ thường, gộp khoảng trắng"""
+    return " ".join(str(name).casefold().split())
+
+
+class IngredientRecord:
+    """Một dòng trong bảng Ingredients (dùng __slots__ cho gọn bộ nhớ)"""
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(FIELDS, values):
+            setattr(self, field, value)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in DETAIL_FIELDS}
+
+
+class ColumnView:
+    """1 cột của snapshot trên mmap: đọc từng ô khi cần, không copy cả cột vào RAM của process"""
+    __slots__ = ('values', 'nulls', 'blob')
+
+    def __init__(self, values, nulls, blob=None):
+        self.values = values   # memoryview int64 / float64, hoặc offset uint32 (n + 1 phần tử) vào blob
+        self.nulls = nulls
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, row):
+        if self.nulls[row]:
+            return None
+        if self.blob is None:
+            return self.values[row]
+        return str(self.blob[self.values[row]:self.values[row + 1]], 'utf-8')
+
+
+def _align(pos):
+    return pos + (-pos % 8)
+
+
+def _encode_column(values):
+    """list giá trị -> (kiểu, bytes mảng giá trị, bytes NULL, bytes blob). Kiểu lạ -> ValueError."""
+    present = [v for v in values if v is not None]
+    nulls = bytes(v is None for v in values)
+    if all(isinstance(v, int) for v in present):
+        return 'q', array('q', [v or 0 for v in values]).tobytes(), nulls, b''
+    if all(isinstance(v, (int, float)) for v in present):
+        return 'd', array('d', [float(v or 0) for v in values]).tobytes(), nulls, b''
+    if all(isinstance(v, str) for v in present):
+        encoded = [(v or '').encode('utf-8') for v in values]
+        offsets = array('I', [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        return 's', offsets.tobytes(), nulls, b''.join(encoded)
+    raise ValueError("Cột có kiểu dữ liệu không hỗ trợ trong snapshot")
+
+
+def _column_view(data, n_rows, kind, values_at, nulls_at, blob_at):
+    """Dựng ColumnView trên vùng dữ liệu của snapshot, kiểm tra kích thước từng mảng"""
+    count = n_rows + 1 if kind == 's' else n_rows
+    fmt = {'q': 'q', 'd': 'd', 's': 'I'}[kind]
+    size = count * struct.calcsize(fmt)
+    values, nulls = data[values_at:values_at + size], data[nulls_at:nulls_at + n_rows]
+    if len(values) != size or len(nulls) != n_rows:
+        raise ValueError("Snapshot bị cắt cụt")
+    values = values.cast(fmt)
+    if kind != 's':
+        return ColumnView(values, nulls)
+    blob = data[blob_at:blob_at + values[-1]]
+    if len(blob) != values[-1]:
+        raise ValueError("Snapshot bị cắt cụt")
+    return ColumnView(values, nulls, blob)
+
+
+class IngredientKnowledgeBase:
+    """
+    Bản sao chỉ đọc của bảng Ingredients.
+    Tra cứu theo ingredient_id hoặc inci_name đều là O(1), không chạm vào DB.
+    Nạp từ snapshot thì dữ liệu nằm trên mmap (dùng chung giữa các process), chỉ 2 index là riêng.
+    """
+
+    def __init__(self, columns, version, buffer=None):
+        # columns: dict {tên cột: dãy giá trị (list hoặc ColumnView)}, cùng độ dài
+        self.version = version
+        self.columns = columns
+        self._buffer = buffer   # mmap mà các ColumnView trỏ vào (giữ mở suốt vòng đời KB)
+        ids, names = columns['ingredient_id'], columns['inci_name']
+        self._row_by_id = {ids[row]: row for row in range(len(ids))}
+        self._row_by_name = {normalize_name(names[row]): row for row in range(len(names))}
+
+    def _record(self, row):
+        return IngredientRecord(*(self.columns[f][row] for f in FIELDS))
+
+    @classmethod
+    def from_connection(cls, conn, version=None):
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(FIELDS)} FROM Ingredients ORDER BY inci_name")
+        rows = cursor.fetchall()
+        columns = {field: [row[i] for row in rows] for i, field in enumerate(FIELDS)}
+        if version is None:
+            version = get_db_version(conn)
+        return cls(columns, version)
+
+    def __len__(self):
+        return len(self.columns['ingredient_id'])
+
+    def __iter__(self):
+        return (self._record(row) for row in range(len(self)))
+
+    def __contains__(self, ingredient_id):
+        return ingredient_id in self._row_by_id
+
+    def get(self, ingredient_id):
+        row = self._row_by_id.get(ingredient_id)
+        return self._record(row) if row is not None else None
+
+    def get_details(self, ingredient_id):
+        """Thay thế cho get_ingredient_details() nhưng đọc từ RAM / mmap"""
+        row = self._row_by_id.get(ingredient_id)
+        if row is None:
+            return None
+        return {field: self.columns[field][row] for field in DETAIL_FIELDS}
+
+    def find_by_name(self, name):
+        row = self._row_by_name.get(normalize_name(name))
+        return self._record(row) if row is not None else None
+
+    def find_id(self, name):
+        rec = self.find_by_name(name)
+        return rec.ingredient_id if rec else None
+
+    # --- SNAPSHOT (chia sẻ giữa nhiều process qua file mmap) ---
+
+    def export_snapshot(self, path):
+        """Ghi snapshot dạng cột ra file (atomic: ghi file tạm rồi đổi tên). Cột kiểu lạ -> ValueError."""
+        n_rows = len(self)
+        sections, layout, pos = [], {}, 0
+        for field in FIELDS:
+            column = self.columns[field]
+            kind, values, nulls, blob = _encode_column([column[row] for row in range(n_rows)])
+            offsets = []
+            for data in (values, nulls, blob):
+                pos = _align(pos)
+                offsets.append(pos)
+                sections.append((pos, data))
+                pos += len(data)
+            layout[field] = [kind, *offsets]
+        meta = json.dumps({'version': list(self.version), 'byteorder': sys.byteorder, 'columns': layout},
+                          ensure_ascii=False).encode('utf-8')
+        data_start = _align(SNAPSHOT_HEADER.size + len(meta))
+        payload = bytearray(data_start + pos)
+        SNAPSHOT_HEADER.pack_into(payload, 0, SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, n_rows, len(meta))
+        payload[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + len(meta)] = meta
+        for offset, data in sections:
+            payload[data_start + offset:data_start + offset + len(data)] = data
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_snapshot(cls, path, expected_version=None):
+        """Mở snapshot qua mmap (không copy dữ liệu). Trả về None nếu file thiếu, hỏng hoặc lỗi thời."""
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):   # ValueError: file rỗng
+            return None
+        try:
+            magic, fmt, n_rows, meta_len = SNAPSHOT_HEADER.unpack_from(mm, 0)
+            if magic != SNAPSHOT_MAGIC or fmt != SNAPSHOT_FORMAT:
+                raise ValueError("Sai định dạng snapshot")
+            meta = json.loads(mm[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + meta_len])
+            version = tuple(meta['version'])
+            if meta['byteorder'] != sys.byteorder:
+                raise ValueError("Snapshot ghi trên máy khác thứ tự byte")
+            if expected_version is not None and version != expected_version:
+                raise ValueError("Snapshot lỗi thời")
+            data = memoryview(mm)[_align(SNAPSHOT_HEADER.size + meta_len):]
+            columns = {field: _column_view(data, n_rows, *meta['columns'][field]) for field in FIELDS}
+        except (struct.error, ValueError, KeyError, TypeError):
+            data = columns = None
+            try:
+                mm.close()
+            except BufferError:
+                pass   # Còn view trỏ vào mmap -> để GC đóng
+            return None
+        return cls(columns, version, buffer=mm)
+
+
+
+def get_snapshot_path():
+    return get_db_path() + SNAPSHOT_SUFFIX
+
+
+def get_db_version(conn):
+    """
+    Phiên bản dữ liệu = (số dòng, last_updated mới nhất, ID lớn nhất, bộ đếm thay đổi do trigger tăng).
+    Bộ đếm đổi cả khi UPDATE không chạm last_updated (sửa tay, sqlite3 CLI, importer cũ).
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*), MAX(last_updated), MAX(ingredient_id),
+               (SELECT version FROM Data_Versions WHERE table_name = 'Ingredients')
+        FROM Ingredients
+    """)
+    return tuple(cursor.fetchone())
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_kb = None
+_kb_checked_at = 0.0
+_kb_lock = threading.Lock()
+
+
+def get_knowledge_base(force_check=False):
+    """
+    Trả về kho tri thức dùng chung. Chỉ kiểm tra phiên bản DB mỗi KB_CHECK_INTERVAL giây;
+    nếu DB đã đổi thì nạp lại từ snapshot (nếu khớp) hoặc từ DB rồi xuất snapshot mới.
+    """
+    global _kb, _kb_checked_at
+    now = time.monotonic()
+    if _kb is not None and not force_check and now - _kb_checked_at < KB_CHECK_INTERVAL:
+        return _kb
+
+    with _kb_lock:
+        if _kb is not None and not force_check and now - _kb_checked_at < KB_CHECK_INTERVAL:
+            return _kb
+
+        conn = get_connection()
+        if not conn:
+            return _kb
+        try:
+            version = get_db_version(conn)
+            if _kb is None or _kb.version != version:
+                path = get_snapshot_path()
+                kb = IngredientKnowledgeBase.load_snapshot(path, expected_version=version)
+                if kb is None:
+                    kb = IngredientKnowledgeBase.from_connection(conn, version)
+                    try:
+                        kb.export_snapshot(path)
+                    except (OSError, ValueError, OverflowError) as e:
+                        print(f"⚠️ Không ghi được snapshot KB: {e}")
+                _kb = kb
+        finally:
+            conn.close()
+        _kb_checked_at = time.monotonic()
+        return _kb
+
+
+def invalidate_knowledge_base():
+    """Buộc lần gọi get_knowledge_base() kế tiếp phải kiểm tra lại DB"""
+    global _kb_checked_at
+    _kb_checked_at = 0.0
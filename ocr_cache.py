@@ -0,0 +1,183 @@
+import hashlib
+import io
+import json
+import threading
+
+from cache_utils import LRUCache
+from database_utils import get_connection
+
+# =====================================================
+# CACHE KẾT QUẢ OCR THEO NỘI DUNG ẢNH
+# =====================================================
+# Tầng 1: LRU trong RAM (mili-giây). Tầng 2: bảng OCR_Cache trong SQLite (dùng chung
+# giữa các process, sống qua lần khởi động lại). Chỉ khóa SHA-256(bytes) + model mới trả kết quả:
+# dHash 64 bit chỉ được lưu kèm để thống kê ảnh gần trùng, không bao giờ dùng làm cache hit
+# (2 nhãn khác nhau chụp cùng kiểu chai/bố cục có thể trùng dHash -> trả nhầm thành phần).
+MEMORY_SIZE = 256
+
+_pil_image = False   # False = chưa thử import; None = không có Pillow
+
+
+def _load_pil():
+    """Nạp Pillow lần đầu cần tới (~50ms) thay vì lúc import module"""
+    global _pil_image
+    if _pil_image is False:
+        try:
+            from PIL import Image
+            _pil_image = Image
+        except ImportError:  # Pillow không bắt buộc: khi thiếu chỉ dùng hash nội dung
+            _pil_image = None
+    return _pil_image
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes, size=8):
+    """dHash 64 bit (so sánh độ sáng các pixel kề nhau trên ảnh xám 9x8). None nếu không có Pillow."""
+    Image = _load_pil()
+    if Image is None:
+        return None
+    try:
+        img = Image.open(io.BytesIO(image_bytes)).convert('L').resize((size + 1, size))
+    except Exception:
+        return None
+    pixels = img.tobytes()   # Ảnh 'L': 1 byte / pixel, theo hàng
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+class _Flight:
+    """Một lần gọi OCR đang chạy; các request trùng khóa chờ chung kết quả"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OCRCache:
+    def __init__(self, memory_size=MEMORY_SIZE, persist=True):
+        self.memory = LRUCache(memory_size)
+        self.persist = persist
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.near_duplicates = 0   # Cache miss nhưng trùng dHash với ảnh đã lưu (chỉ thống kê)
+        self.computed = 0
+        self.shared = 0   # Số request được gộp vào 1 lần gọi đang chạy
+
+    def get_or_compute(self, image_bytes, model_name, compute_fn):
+        """
+        Trả về list tên chất cho ảnh. Chỉ gọi compute_fn(image_bytes) khi cả 2 tầng cache đều miss;
+        nhiều luồng cùng quét 1 ảnh thì chỉ 1 luồng gọi, các luồng khác chờ kết quả.
+        Kết quả rỗng (OCR thất bại) không được cache.
+        """
+        key = (content_hash(image_bytes), model_name)
+        cached = self.memory.get(key)
+        if cached is not None:
+            return list(cached)
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return list(flight.result)
+
+        try:
+            result, phash = self._lookup_db(key, image_bytes)
+            if result is None:
+                result = compute_fn(image_bytes)
+                self.computed += 1
+                if result:
+                    self._store_db(key, phash, result)
+            if result:
+                self.memory.put(key, tuple(result))
+            flight.result = result
+            return list(result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _lookup_db(self, key, image_bytes):
+        """Tra tầng SQLite. Trả về (kết quả hoặc None, phash đã tính để dùng lại khi lưu)"""
+        if not self.persist:
+            return None, None
+        conn = get_connection()
+        if not conn: return None, None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ingredients FROM OCR_Cache WHERE content_hash = ? AND model_name = ?", key)
+            row = cursor.fetchone()
+            if row:
+                self.db_hits += 1
+                return json.loads(row['ingredients']), None
+
+            # Không trả kết quả theo dHash: chỉ đếm để biết bao nhiêu ảnh là bản nén lại / gần trùng
+            phash = perceptual_hash(image_bytes)
+            if phash:
+                cursor.execute("SELECT 1 FROM OCR_Cache WHERE phash = ? AND model_name = ? LIMIT 1", (phash, key[1]))
+                if cursor.fetchone():
+                    self.near_duplicates += 1
+            return None, phash
+        finally:
+            conn.close()
+
+    def _store_db(self, key, phash, result):
+        if not self.persist:
+            return
+        conn = get_connection()
+        if not conn: return
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO OCR_Cache (content_hash, model_name, phash, ingredients)
+                VALUES (?, ?, ?, ?)
+            """, (key[0], key[1], phash, json.dumps(result, ensure_ascii=False)))
+            conn.commit()
+        except Exception as e:
+            print(f"⚠️ Lỗi lưu cache OCR: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        stats = self.memory.stats()
+        return {
+            'memory_hits': stats['hits'],
+            'memory_size': stats['size'],
+            'db_hits': self.db_hits,
+            'near_duplicates': self.near_duplicates,
+            'computed': self.computed,
+            'shared_inflight': self.shared,
+        }
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache()
+    return _cache
@@ -0,0 +1,186 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# =====================================================
+# ĐO THỜI GIAN CÁC ĐƯỜNG NÓNG (SPAN + HISTOGRAM)
+# =====================================================
+# Bật bằng biến môi trường AESTHETIC_PERF=1 (mặc định tắt).
+# - @timed('tên'): đo 1 hàm. Khi tắt lúc import, decorator trả về NGUYÊN hàm gốc
+#   -> không tốn thêm 1 lớp gọi hàm nào trên đường nóng.
+# - with span('tên'): đo 1 đoạn code; khi tắt chỉ tốn 1 lần kiểm tra cờ.
+# - Mỗi tên có 1 histogram: count, tổng, p50/p95/p99 (trên RESERVOIR_SIZE mẫu gần nhất)
+#   + bucket cố định để xuất định dạng Prometheus.
+# - start_trace() / last_trace(): danh sách span của lần rerun hiện tại (theo thread) cho panel debug.
+PERF_ENV = 'AESTHETIC_PERF'
+RESERVOIR_SIZE = 2048
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+TRACE_LIMIT = 500   # Số span tối đa giữ trong 1 trace
+
+_enabled = os.environ.get(PERF_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(value):
+    """Bật/tắt span() và observe() lúc chạy. Hàm đã gắn @timed khi đang tắt vẫn không được đo."""
+    global _enabled
+    _enabled = bool(value)
+
+
+class Histogram:
+    __slots__ = ('count', 'total_ms', 'max_ms', 'samples', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)   # Phần tử cuối = +Inf
+
+    def observe(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.samples.append(ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3) if ordered else 0.0
+
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'p99_ms': pct(0.99),
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def observe(name, ms):
+    """Ghi 1 mẫu thời gian (ms) cho `name` (dùng khi đã tự đo, VD: generator streaming)"""
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.observe(ms)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None and len(trace) < TRACE_LIMIT:
+        trace.append((name, round(ms, 3), getattr(_local, 'depth', 0)))
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _local.depth = getattr(_local, 'depth', 0) + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.start) * 1000
+        _local.depth -= 1
+        observe(self.name, ms)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name):
+    return _Span(name) if _enabled else _NOOP
+
+
+def timed(name):
+    """Decorator đo thời gian mỗi lần gọi hàm"""
+    def decorator(fn):
+        if not _enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- TRACE CHO TỪNG LẦN RERUN (PANEL DEBUG) ---
+
+def start_trace():
+    """Bắt đầu ghi danh sách span của thread hiện tại (gọi ở đầu mỗi lần rerun)"""
+    _local.trace = [] if _enabled else None
+    _local.depth = 0
+
+
+def last_trace():
+    """[(tên, ms, độ sâu), ...] theo thứ tự kết thúc"""
+    return list(getattr(_local, 'trace', None) or [])
+
+
+# --- XUẤT SỐ LIỆU ---
+
+def snapshot():
+    with _lock:
+        return {name: hist.summary() for name, hist in sorted(_histograms.items())}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def export_json():
+    return json.dumps({'enabled': _enabled, 'operations': snapshot()}, ensure_ascii=False, indent=2)
+
+
+def export_prometheus(prefix='aesthetic_op_duration_ms'):
+    """Định dạng text của Prometheus (histogram theo nhãn op)"""
+    lines = [f"# HELP {prefix} Thời gian xử lý theo thao tác (ms)", f"# TYPE {prefix} histogram"]
+    with _lock:
+        items = sorted((name, list(h.buckets), h.total_ms, h.count) for name, h in _histograms.items())
+    for name, buckets, total_ms, count in items:
+        op = name.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, buckets):
+            cumulative += n
+            lines.append(f'{prefix}_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_bucket{{op="{op}",le="+Inf"}} {count}')
+        lines.append(f'{prefix}_sum{{op="{op}"}} {round(total_ms, 3)}')
+        lines.append(f'{prefix}_count{{op="{op}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import time
+
+from interaction_graph import invalidate_interaction_graph
+from knowledge_base import get_knowledge_base, invalidate_knowledge_base
+
+# =====================================================
+# CACHE TÀI NGUYÊN DÙNG CHUNG CHO MỌI PHIÊN (SỐNG QUA CÁC LẦN RERUN)
+# =====================================================
+# Streamlit chạy lại app.py từ đầu sau mỗi thao tác, nhưng module Python chỉ được import
+# 1 lần cho mỗi process -> các biến ở đây được chia sẻ giữa mọi session/rerun.
+MODEL_DISCOVERY_TTL = 3600   # Giây. list_models() là 1 lời gọi mạng, không cần gọi lại liên tục
+
+DEFAULT_MODEL = 'gemini-1.5-flash'
+MODEL_PREFERENCE = ['gemini-2.5-flash', 'gemini-1.5-flash']
+
+
+class ResourceCache:
+    """Cache key -> giá trị, có TTL tùy chọn và đếm hit/miss theo từng nhóm"""
+
+    def __init__(self):
+        self._data = {}            # key -> (giá trị, hết hạn lúc)
+        self._lock = threading.RLock()
+        self.counters = {}         # nhóm -> {'hits': n, 'misses': n}
+
+    def _count(self, group, field):
+        stats = self.counters.setdefault(group, {'hits': 0, 'misses': 0})
+        stats[field] += 1
+
+    def get_or_load(self, group, key, loader, ttl=None):
+        full_key = (group, key)
+        now = time.monotonic()
+        entry = self._data.get(full_key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            self._count(group, 'hits')
+            return entry[0]
+
+        with self._lock:
+            entry = self._data.get(full_key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._count(group, 'hits')
+                return entry[0]
+            self._count(group, 'misses')
+            value = loader()
+            self._data[full_key] = (value, now + ttl if ttl else None)
+            return value
+
+    def invalidate(self, group=None):
+        with self._lock:
+            if group is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k[0] == group]:
+                    del self._data[key]
+
+    def stats(self):
+        return {group: dict(c) for group, c in self.counters.items()}
+
+
+_cache = ResourceCache()
+_configured_key = None
+_configure_lock = threading.Lock()
+
+
+def _key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def ensure_genai_configured(api_key):
+    """genai.configure() là trạng thái toàn cục: chỉ gọi lại khi đổi key"""
+    global _configured_key
+    fingerprint = _key_fingerprint(api_key)
+    if _configured_key == fingerprint:
+        _cache._count('genai_configure', 'hits')
+        return
+    with _configure_lock:
+        if _configured_key != fingerprint:
+            import google.generativeai as genai
+            _cache._count('genai_configure', 'misses')
+            genai.configure(api_key=api_key)
+            _configured_key = fingerprint
+
+
+def get_best_model_name(api_key):
+    """Chọn model tốt nhất key này dùng được (list_models được cache theo TTL)"""
+    ensure_genai_configured(api_key)
+
+    def _discover():
+        import google.generativeai as genai
+        all_models = [m.name for m in genai.list_models()]
+        for name in MODEL_PREFERENCE:
+            if f'models/{name}' in all_models:
+                return name
+        return 'gemini-pro'
+
+    try:
+        return _cache.get_or_load('model_discovery', _key_fingerprint(api_key), _discover, ttl=MODEL_DISCOVERY_TTL)
+    except Exception:
+        # Lỗi mạng tạm thời: dùng model mặc định nhưng KHÔNG cache -> lần gọi sau thử list_models() lại
+        return DEFAULT_MODEL
+
+
+class IngredientCatalog:
+    """Danh sách hoạt chất + các map tra cứu mà giao diện cần"""
+    __slots__ = ('version', 'ingredients', 'id_to_name', 'name_to_id')
+
+    def __init__(self, kb):
+        self.version = kb.version
+        self.ingredients = [(rec.ingredient_id, rec.inci_name) for rec in kb]   # Đã sắp theo inci_name
+        self.id_to_name = dict(self.ingredients)
+        self.name_to_id = {name.lower(): ing_id for ing_id, name in self.ingredients}
+
+
+def get_catalog():
+    """Catalog khớp với phiên bản kho tri thức hiện tại (DB đổi -> dựng lại 1 lần)"""
+    kb = get_knowledge_base()
+    if kb is None:
+        return None
+
+    def _build():
+        _cache.invalidate('catalog')   # Chỉ giữ bản của phiên bản mới nhất
+        return IngredientCatalog(kb)
+
+    return _cache.get_or_load('catalog', kb.version, _build)
+
+
+def get_analyzer(skin_type, is_pregnant):
+    """SkinAnalyzer không giữ trạng thái nên dùng chung cho mọi phiên có cùng hồ sơ"""
+    from services import SkinAnalyzer
+    return _cache.get_or_load('analyzer', (skin_type, bool(is_pregnant)),
+                              lambda: SkinAnalyzer({"skin_type": skin_type, "is_pregnant": bool(is_pregnant)}))
+
+
+def invalidate_resources():
+    """
+    Gọi sau khi sửa DB trong cùng process (bulk_importer tự gọi sau mỗi lần nạp có ghi dữ liệu):
+    buộc nạp lại kho tri thức, đồ thị tương tác và catalog
+    """
+    invalidate_knowledge_base()
+    invalidate_interaction_graph()
+    _cache.invalidate('catalog')
+
+
+def cache_stats():
+    stats = _cache.stats()
+    for group in stats.values():
+        total = group['hits'] + group['misses']
+        group['hit_rate'] = round(group['hits'] / total, 3) if total else 0.0
+    return stats
@@ -0,0 +1,63 @@
+# =====================================================
+# LUẬT ĐÁNH GIÁ AN TOÀN THEO HỒ SƠ DA
+# =====================================================
+# Kết quả chỉ phụ thuộc (hoạt chất, loại da, mang thai) nên có thể tính trước.
+# Mỗi khi sửa logic trong evaluate_safety() phải tăng RULES_VERSION
+# để bảng verdict đã lưu được tính lại.
+RULES_VERSION = 1
+
+SKIN_TYPES = ['Normal', 'Oily', 'Dry', 'Sensitive', 'Acne-Prone']
+PREGNANCY_STATES = [False, True]
+
+
+def evaluate_safety(details, skin_type='Normal', is_pregnant=False):
+    """
+    Phân tích một hoạt chất (dict chi tiết) theo loại da và tình trạng thai kỳ.
+    Trả về: (Mức độ nguy hiểm, Lời khuyên)
+    Mức độ: 'SAFE', 'WARNING', 'DANGER'
+    """
+    name = details['inci_name']
+    category = details['function_category']
+    com_rating = details['comedogenic_rating'] or 0
+    safety_rating = details['safety_rating'] or 0
+
+    messages = []
+    risk_level = 'SAFE'
+
+    # 1. KIỂM TRA CHO BÀ BẦU (Ưu tiên cao nhất)
+    if is_pregnant:
+        # Logic: Retinoid và BHA nồng độ cao, Hydroquinone là cấm kỵ
+        if category == 'Retinoid':
+            return 'DANGER', f"⛔ **TUYỆT ĐỐI TRÁNH:** {name} thuộc nhóm Retinoid, có nguy cơ gây dị tật thai nhi."
+        if name == 'Salicylic Acid' or name == 'BHA':
+            # Trong thực tế cần check nồng độ, nhưng an toàn thì cảnh báo luôn
+            messages.append(f"⚠️ **Thận trọng:** BHA liều cao không tốt cho thai kỳ. Nên hỏi ý kiến bác sĩ.")
+            risk_level = 'WARNING'
+
+    # 2. KIỂM TRA LOẠI DA
+    # Logic cho Da Dầu / Mụn
+    if skin_type in ['Oily', 'Acne-Prone']:
+        if com_rating >= 3:
+            messages.append(f"🚫 **Gây mụn:** Chỉ số bít tắc lỗ chân lông là {com_rating}/5. Rất dễ gây mụn cho da dầu.")
+            if risk_level != 'DANGER': risk_level = 'DANGER'
+        elif com_rating == 2:
+            messages.append(f"⚠️ **Lưu ý:** Có khả năng gây mụn nhẹ (Chỉ số 2/5).")
+            if risk_level == 'SAFE': risk_level = 'WARNING'
+
+    # Logic cho Da Khô
+    if skin_type == 'Dry':
+        if category in ['Solvent', 'Surfactant'] and safety_rating >= 4:
+             messages.append(f"⚠️ **Gây khô da:** {name} có thể làm mất độ ẩm tự nhiên.")
+             if risk_level == 'SAFE': risk_level = 'WARNING'
+
+    # Logic cho Da Nhạy Cảm
+    if skin_type == 'Sensitive':
+        if category in ['Perfume', 'Fragrance', 'Preservative'] and safety_rating >= 4:
+            messages.append(f"❌ **Dễ kích ứng:** Da nhạy cảm nên tránh hương liệu/chất bảo quản mạnh như {name}.")
+            if risk_level != 'DANGER': risk_level = 'WARNING'
+
+    # Tổng hợp kết quả
+    if not messages:
+        return 'SAFE', f"✅ Phù hợp với hồ sơ {skin_type}."
+
+    return risk_level, "\n".join(messages)
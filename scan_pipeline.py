@@ -0,0 +1,317 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from knowledge_base import get_knowledge_base
+from ocr_cache import get_ocr_cache
+from perf_metrics import observe, span
+from vision_service import analyze_label_image
+
+# =====================================================
+# PIPELINE QUÉT ẢNH: DEADLINE + RETRY + CHẠY CHỒNG KHỞI TẠO CHAT VỚI CHẤM ĐIỂM
+# =====================================================
+# OCR (gọi mạng, có deadline + retry) -> song song: [chấm điểm local] || [khởi tạo phiên chat]
+# - on_stage(tên bước, ScanResult) được gọi ngay khi từng phần có kết quả: UI vẽ điểm trước,
+#   không phải chờ chat sẵn sàng.
+# - Mỗi lần gọi mạng có timeout riêng, cả bước có deadline tổng; lỗi tạm thời (429, 503, mất mạng,
+#   quá hạn) được thử lại với backoff lũy thừa + jitter, lỗi cố định (key sai, ảnh hỏng) báo ngay.
+# - Lỗi được phân loại (StageError.kind) để báo đúng cho người dùng thay vì 1 câu chung chung.
+CHAT_WAIT_S = 10.0   # UI chờ phiên chat tối đa ngần này giây (sau khi đã vẽ xong điểm)
+
+# Tên class lỗi của google.api_core / requests được coi là tạm thời (so theo tên để không phải import SDK)
+TRANSIENT_ERRORS = {
+    'ServiceUnavailable', 'TooManyRequests', 'ResourceExhausted', 'DeadlineExceeded', 'InternalServerError',
+    'GatewayTimeout', 'BadGateway', 'Aborted', 'RetryError', 'ConnectTimeout', 'ReadTimeout',
+}
+
+ERROR_MESSAGES = {
+    'empty': "Không đọc được chữ trên ảnh. Hãy chụp rõ bảng thành phần hơn.",
+    'timeout': "AI phản hồi quá chậm (hết thời gian chờ). Vui lòng thử lại sau ít phút.",
+    'transient': "Dịch vụ AI đang quá tải hoặc mất kết nối (đã thử lại nhiều lần). Vui lòng thử lại sau.",
+    'fatal': "AI từ chối yêu cầu (kiểm tra API Key / định dạng ảnh).",
+    'stale': "Phiên chat của lần quét này đã được thay bằng lần quét mới hơn.",
+}
+
+
+class RetryPolicy:
+    """deadline_s: tổng thời gian cho cả bước (gồm retry); attempt_timeout_s: tối đa cho 1 lần gọi"""
+
+    def __init__(self, deadline_s=45.0, attempt_timeout_s=20.0, max_attempts=3, base_delay_s=0.5, max_delay_s=4.0):
+        self.deadline_s = deadline_s
+        self.attempt_timeout_s = attempt_timeout_s
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+
+    def backoff(self, attempt):
+        """Thời gian chờ trước lần thử thứ attempt+1 (full jitter)"""
+        return random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+
+
+OCR_POLICY = RetryPolicy(deadline_s=45.0, attempt_timeout_s=20.0, max_attempts=3)
+CHAT_POLICY = RetryPolicy(deadline_s=15.0, attempt_timeout_s=8.0, max_attempts=2)
+
+
+class StageError(Exception):
+    """
+    Lỗi của 1 bước trong pipeline.
+    kind: 'empty' | 'timeout' | 'transient' (hết lượt thử lại) | 'fatal' (không nên thử lại)
+          | 'stale' (kết quả đến khi đã có lần quét mới hơn)
+    """
+
+    def __init__(self, stage, kind, message='', attempts=0):
+        super().__init__(f"{stage}: {kind} {message}".strip())
+        self.stage = stage
+        self.kind = kind
+        self.message = message
+        self.attempts = attempts
+
+    @property
+    def user_message(self):
+        return ERROR_MESSAGES.get(self.kind, ERROR_MESSAGES['fatal'])
+
+    def as_dict(self):
+        return {'stage': self.stage, 'kind': self.kind, 'message': self.message, 'attempts': self.attempts}
+
+
+def is_transient(exc):
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+
+# --- MỖI LẦN GỌI MẠNG CHẠY TRÊN 1 THREAD RIÊNG ---
+# Không dùng pool cố định: lần gọi quá hạn bị bỏ lại vẫn giữ thread tới khi SDK trả về (timeout
+# phía SDK chặn trên thời gian này), nếu dùng chung pool thì các lời gọi mới phải xếp hàng sau nó
+# và quá hạn oan. Số lời gọi còn sống / đã bị bỏ lại được theo dõi qua remote_call_stats().
+_inflight = 0
+_abandoned = 0
+_stats_lock = threading.Lock()
+
+
+def remote_call_stats():
+    """inflight: lời gọi mạng đang chạy (kể cả lần đã bị bỏ lại); abandoned: lần quá hạn chưa kết thúc"""
+    return {'inflight': _inflight, 'abandoned': _abandoned}
+
+
+def _start_attempt(stage, fn, args):
+    """Chạy fn(*args) trên thread mới. Trả về (Future, hàm đánh dấu lần gọi đã bị bỏ lại)."""
+    global _inflight
+    future = Future()
+    state = {'abandoned': False}
+
+    def _run():
+        global _inflight, _abandoned
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _stats_lock:
+                _inflight -= 1
+                if state['abandoned']:
+                    _abandoned -= 1
+
+    def _abandon():
+        global _abandoned
+        with _stats_lock:
+            if not future.done():
+                state['abandoned'] = True
+                _abandoned += 1
+
+    with _stats_lock:
+        _inflight += 1
+    threading.Thread(target=_run, name=f'remote-{stage}', daemon=True).start()
+    return future, _abandon
+
+
+def call_with_retry(stage, fn, *args, policy=OCR_POLICY):
+    """
+    Gọi fn(*args) với timeout mỗi lần + deadline tổng, thử lại lỗi tạm thời theo backoff lũy thừa.
+    Lần gọi quá hạn bị bỏ lại (SDK không hủy được lời gọi đang chạy), kết quả muộn bị bỏ qua.
+    Ném StageError khi thất bại.
+    """
+    deadline = time.monotonic() + policy.deadline_s
+    last_kind, last_message = 'timeout', ''
+    attempt = 0
+    while attempt < policy.max_attempts:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        attempt += 1
+        started = time.perf_counter()
+        future, abandon = _start_attempt(stage, fn, args)
+        try:
+            value = future.result(timeout=min(policy.attempt_timeout_s, remaining))
+            observe(f'scan.{stage}.attempt', (time.perf_counter() - started) * 1000)
+            return value
+        except FutureTimeout:
+            abandon()
+            last_kind, last_message = 'timeout', f"quá {min(policy.attempt_timeout_s, remaining):.1f}s"
+        except Exception as e:
+            if not is_transient(e):
+                raise StageError(stage, 'fatal', f"{type(e).__name__}: {e}", attempt) from e
+            last_kind, last_message = ('timeout' if isinstance(e, TimeoutError) else 'transient'), f"{type(e).__name__}: {e}"
+        observe(f'scan.{stage}.attempt', (time.perf_counter() - started) * 1000)
+        if attempt < policy.max_attempts:
+            time.sleep(max(0.0, min(policy.backoff(attempt - 1), deadline - time.monotonic())))
+    raise StageError(stage, last_kind, last_message, attempt)
+
+
+class ScanResult:
+    """Kết quả (có thể dở dang) của 1 lần quét"""
+
+    def __init__(self):
+        self.detected = []
+        self.label = None          # SkinAnalyzer.analyze_label()
+        self.scored_for = None     # (skin_type, is_pregnant, kb.version) mà label được chấm cho
+        self.ocr_metrics = {}
+        self.errors = {}           # stage -> StageError
+        self.timings = {}          # ms theo từng bước
+        self.chat_future = None    # Future: phiên chat đang khởi tạo song song
+        self._started = time.perf_counter()
+
+    @property
+    def ok(self):
+        return bool(self.detected) and 'ocr' not in self.errors and 'analysis' not in self.errors
+
+    @property
+    def error(self):
+        """Lỗi chặn kết quả chính (OCR / chấm điểm); lỗi chat không tính"""
+        return self.errors.get('ocr') or self.errors.get('analysis')
+
+    def mark(self, name):
+        self.timings[name] = round((time.perf_counter() - self._started) * 1000, 2)
+
+    def wait_chat(self, timeout=CHAT_WAIT_S):
+        """Chờ phiên chat (tối đa timeout giây). True nếu sẵn sàng; lỗi được ghi vào errors['chat']."""
+        if self.chat_future is None:
+            return False
+        try:
+            self.chat_future.result(timeout=timeout)
+            self.errors.pop('chat', None)   # Lần chờ trước có thể đã báo quá hạn
+            return True
+        except FutureTimeout:
+            self.errors.setdefault('chat', StageError('chat', 'timeout', f"chưa xong sau {timeout:.1f}s"))
+        except StageError as e:
+            self.errors['chat'] = e
+        except Exception as e:
+            self.errors['chat'] = StageError('chat', 'fatal', f"{type(e).__name__}: {e}")
+        return False
+
+    def as_dict(self):
+        return {
+            'detected': self.detected,
+            'ocr_metrics': self.ocr_metrics,
+            'timings': self.timings,
+            'errors': {stage: e.as_dict() for stage, e in self.errors.items()},
+        }
+
+
+class ScanPipeline:
+    """
+    OCR -> (chấm điểm || khởi tạo chat). Dùng chung được giữa các lần quét (không giữ trạng thái riêng).
+    chatbot: AIChatbot (hoặc None nếu không cần chat).
+    """
+
+    def __init__(self, backend, analyzer, chatbot=None, ocr_policy=OCR_POLICY, chat_policy=CHAT_POLICY,
+                 use_cache=True, preprocess=True):
+        self.backend = backend
+        self.analyzer = analyzer
+        self.chatbot = chatbot
+        self.ocr_policy = ocr_policy
+        self.chat_policy = chat_policy
+        self.use_cache = use_cache
+        self.preprocess = preprocess
+
+    def ocr(self, image_bytes, result):
+        """Đọc nhãn (qua cache OCR); chỉ lần cache miss mới gọi mạng có deadline + retry"""
+        result.ocr_metrics = {'cached': True}
+
+        def _compute(data):
+            detected, metrics = call_with_retry('ocr', analyze_label_image, data, self.backend, self.preprocess,
+                                                policy=self.ocr_policy)
+            result.ocr_metrics = dict(metrics, cached=False)
+            return detected
+
+        if self.use_cache:
+            return get_ocr_cache().get_or_compute(image_bytes, self.backend.model_name, _compute)
+        return _compute(image_bytes)
+
+    def _start_chat(self, detected, profile, generation):
+        """
+        Chạy trong thread riêng: tóm tắt nhãn cho chat + dựng phiên (có deadline + retry).
+        Phiên được dựng tách rời (build_session) nên lần thử bị bỏ lại không sửa được chatbot;
+        chỉ gắn vào chatbot nếu chưa có lần quét nào mới hơn.
+        """
+        digest = self.analyzer.summarize_for_chat(detected)
+        session = call_with_retry('chat', self.chatbot.build_session, detected, profile, digest,
+                                  policy=self.chat_policy)
+        if session is None:
+            raise StageError('chat', 'fatal', "chatbot chưa có model")
+        if not self.chatbot.adopt_session(session, generation):
+            raise StageError('chat', 'stale')
+        return self.chatbot.chat_session
+
+    def run(self, image_bytes, profile, on_stage=None):
+        """
+        Quét 1 ảnh. Không ném lỗi: lỗi nằm trong result.errors.
+        on_stage(stage, result) với stage = 'ocr' | 'scores' | 'failed'.
+        Chat vẫn đang khởi tạo khi hàm trả về -> gọi result.wait_chat() lúc thật sự cần.
+        """
+        result = ScanResult()
+
+        def _emit(stage):
+            if on_stage is not None:
+                on_stage(stage, result)
+
+        # 1. OCR (span chỉ bao bước này: 'gemini.ocr' là độ trễ OCR thật, gồm cả cache + retry)
+        try:
+            with span(f"{getattr(self.backend, 'name', 'vision')}.ocr"):
+                result.detected = self.ocr(image_bytes, result) or []
+            if not result.detected:
+                raise StageError('ocr', 'empty')
+        except StageError as e:
+            result.errors['ocr'] = e
+        except Exception as e:
+            result.errors['ocr'] = StageError('ocr', 'transient' if is_transient(e) else 'fatal', f"{type(e).__name__}: {e}")
+        result.mark('ocr_ms')
+        if 'ocr' in result.errors:
+            observe('scan.failed', result.timings['ocr_ms'])
+            _emit('failed')
+            return result
+        _emit('ocr')
+
+        # 2. Khởi tạo chat chạy nền, chồng lên bước chấm điểm
+        if self.chatbot is not None:
+            result.chat_future = Future()
+            generation = self.chatbot.begin_session()
+
+            def _warm_up():
+                start = time.perf_counter()
+                try:
+                    result.chat_future.set_result(self._start_chat(result.detected, profile, generation))
+                except BaseException as e:
+                    result.chat_future.set_exception(e)
+                finally:
+                    result.timings['chat_ready_ms'] = round((time.perf_counter() - result._started) * 1000, 2)
+                    observe('scan.chat_warmup', (time.perf_counter() - start) * 1000)
+
+            threading.Thread(target=_warm_up, name='chat-warmup', daemon=True).start()
+
+        # 3. Chấm điểm local (ms) -> hiển thị được ngay
+        kb = get_knowledge_base()
+        profile = self.analyzer.profile
+        scored_for = (profile.get('skin_type', 'Normal'), bool(profile.get('is_pregnant')),
+                      kb.version if kb is not None else None)
+        try:
+            result.label = self.analyzer.analyze_label(result.detected)
+            result.scored_for = scored_for
+        except Exception as e:
+            result.errors['analysis'] = StageError('analysis', 'fatal', f"{type(e).__name__}: {e}")
+        result.mark('scores_ms')
+        observe('scan.first_result', result.timings['scores_ms'])
+        _emit('scores' if result.label is not None else 'failed')
+        return result
@@ -1,4 +1,13 @@
-from database_utils import get_connection, get_ingredient_details
+from fuzzy_index import get_fuzzy_index
+from ingredient_matcher import get_matcher
+from interaction_graph import get_interaction_graph
+from knowledge_base import get_knowledge_base
+from perf_metrics import timed
+from safety_rules import evaluate_safety
+from verdict_table import get_verdict_table
+
+# Nhãn hiển thị cho từng mức độ rủi ro
+STATUS_LABELS = {'SAFE': "An toàn", 'WARNING': "Cảnh báo", 'DANGER': "Nguy cơ"}
 
 class SkinAnalyzer:
     """
@@ -10,75 +19,153 @@ class SkinAnalyzer:
         # user_profile là dict: {'skin_type': 'Oily', 'is_pregnant': False, ...}
         self.profile = user_profile
 
+    @timed('analyzer.check_safety_for_user')
     def check_safety_for_user(self, ingredient_id):
         """
         Phân tích một hoạt chất dựa trên hồ sơ người dùng.
         Trả về: (Mức độ nguy hiểm, Lời khuyên)
         Mức độ: 'SAFE', 'WARNING', 'DANGER'
         """
-        details = get_ingredient_details(ingredient_id)
+        skin_type = self.profile.get('skin_type', 'Normal')
+        is_pregnant = bool(self.profile.get('is_pregnant'))
+
+        # Tra bảng kết luận tính sẵn trước (O(1))
+        table = get_verdict_table()
+        verdict = table.lookup(ingredient_id, skin_type, is_pregnant) if table else None
+        if verdict:
+            return verdict
+
+        kb = get_knowledge_base()
+        details = kb.get_details(ingredient_id) if kb is not None else None
         if not details:
             return 'UNKNOWN', "Không có dữ liệu"
+        return evaluate_safety(details, skin_type, is_pregnant)
 
-        name = details['inci_name']
-        category = details['function_category']
-        com_rating = details['comedogenic_rating'] or 0
-        # safety_rating = details['safety_rating'] # Có thể dùng sau này
-
-        messages = []
-        risk_level = 'SAFE'
-
-        # 1. KIỂM TRA CHO BÀ BẦU (Ưu tiên cao nhất)
-        if self.profile.get('is_pregnant'):
-            # Logic: Retinoid và BHA nồng độ cao, Hydroquinone là cấm kỵ
-            if category == 'Retinoid':
-                return 'DANGER', f"⛔ **TUYỆT ĐỐI TRÁNH:** {name} thuộc nhóm Retinoid, có nguy cơ gây dị tật thai nhi."
-            if name == 'Salicylic Acid' or name == 'BHA':
-                # Trong thực tế cần check nồng độ, nhưng an toàn thì cảnh báo luôn
-                messages.append(f"⚠️ **Thận trọng:** BHA liều cao không tốt cho thai kỳ. Nên hỏi ý kiến bác sĩ.")
-                risk_level = 'WARNING'
-
-        # 2. KIỂM TRA LOẠI DA
+    @timed('analyzer.check_safety_batch')
+    def check_safety_batch(self, ingredient_ids):
+        """Đánh giá cả danh sách hoạt chất. Trả về dict {ingredient_id: (mức độ, lời khuyên)}"""
         skin_type = self.profile.get('skin_type', 'Normal')
+        is_pregnant = bool(self.profile.get('is_pregnant'))
+        table = get_verdict_table()
 
-        # Logic cho Da Dầu / Mụn
-        if skin_type in ['Oily', 'Acne-Prone']:
-            if com_rating >= 3:
-                messages.append(f"🚫 **Gây mụn:** Chỉ số bít tắc lỗ chân lông là {com_rating}/5. Rất dễ gây mụn cho da dầu.")
-                if risk_level != 'DANGER': risk_level = 'DANGER'
-            elif com_rating == 2:
-                messages.append(f"⚠️ **Lưu ý:** Có khả năng gây mụn nhẹ (Chỉ số 2/5).")
-                if risk_level == 'SAFE': risk_level = 'WARNING'
-        
-        # Logic cho Da Khô
-        if skin_type == 'Dry':
-            if category in ['Solvent', 'Surfactant'] and details['safety_rating'] >= 4:
-                 messages.append(f"⚠️ **Gây khô da:** {name} có thể làm mất độ ẩm tự nhiên.")
-                 if risk_level == 'SAFE': risk_level = 'WARNING'
-
-        # Logic cho Da Nhạy Cảm
-        if skin_type == 'Sensitive':
-            if category in ['Perfume', 'Fragrance', 'Preservative'] and details['safety_rating'] >= 4:
-                messages.append(f"❌ **Dễ kích ứng:** Da nhạy cảm nên tránh hương liệu/chất bảo quản mạnh như {name}.")
-                if risk_level != 'DANGER': risk_level = 'WARNING'
-
-        # Tổng hợp kết quả
-        if not messages:
-            return 'SAFE', f"✅ Phù hợp với hồ sơ {skin_type}."
-        
-        return risk_level, "\n".join(messages)
+        results = {}
+        for ing_id in ingredient_ids:
+            verdict = table.lookup(ing_id, skin_type, is_pregnant) if table else None
+            results[ing_id] = verdict or self.check_safety_for_user(ing_id)
+        return results
 
+    @timed('analyzer.check_interaction')
     def check_interaction(self, id_a, id_b):
-        """Kiểm tra tương tác thuốc (Logic cũ chuyển vào đây)"""
-        conn = get_connection()
-        cursor = conn.cursor()
-        query = """
-        SELECT interaction_type, severity_level, advice_vn 
-        FROM Ingredient_Interactions 
-        WHERE (ingredient_a_id = ? AND ingredient_b_id = ?) 
-           OR (ingredient_a_id = ? AND ingredient_b_id = ?)
         """
-        cursor.execute(query, (id_a, id_b, id_b, id_a))
-        result = cursor.fetchone()
-        conn.close()
-        return result
\ No newline at end of file
+        Kiểm tra tương tác giữa 2 chất (không phân biệt thứ tự).
+        Trả về: (interaction_type, severity_level, advice_vn) hoặc None
+        """
+        graph = get_interaction_graph()
+        return graph.get(id_a, id_b) if graph else None
+
+    @timed('analyzer.find_interactions')
+    def find_interactions(self, ingredient_ids):
+        """
+        Kiểm tra chéo toàn bộ một tập hoạt chất trong 1 lượt.
+        Trả về list (id_a, id_b, interaction_type, severity_level, advice_vn)
+        """
+        graph = get_interaction_graph()
+        return graph.find_pairs(ingredient_ids) if graph else []
+
+    @timed('analyzer.analyze_label')
+    def analyze_label(self, detected_names):
+        """
+        Phân tích toàn bộ nhãn (list tên do OCR trả về): nhận diện + đánh giá từng chất.
+        Trả về dict:
+          rows: list dòng bảng chi tiết (cùng thứ tự với detected_names)
+          ingredient_ids: ID nhận diện cho từng tên (None nếu không rõ)
+          verdicts: (mức độ, lời khuyên) cho từng tên (None nếu không rõ)
+          product_ids: các ID đã nhận diện
+          safe_count / warning_count / risk_count, risk_summary
+        """
+        kb = get_knowledge_base()
+        # Khớp cả nhãn trong 1 lượt (Aho–Corasick), match dài nhất thắng
+        matcher = get_matcher()
+        matched_ids = matcher.match_names(detected_names) if matcher else [None] * len(detected_names)
+        fuzzy = get_fuzzy_index()
+
+        rows = []
+        row_ids = []
+        verdicts = []
+        product_ids = []
+        counts = {'SAFE': 0, 'WARNING': 0, 'DANGER': 0}
+        for name, db_id in zip(detected_names, matched_ids):
+            match_note = "Chính xác"
+            if not db_id and fuzzy:
+                # Thử tra gần đúng để chịu lỗi chính tả của OCR
+                guess = fuzzy.resolve(name)
+                if guess:
+                    db_id = guess.ingredient_id
+                    match_note = f"{'⚠️ ' if guess.is_low_confidence else ''}Gần đúng ({guess.confidence:.0%})"
+            details = kb.get_details(db_id) if db_id and kb is not None else None
+            if not details:
+                row_ids.append(None)
+                verdicts.append(None)
+                rows.append({"Tên chất": name, "Chức năng": "Chưa rõ", "Đánh giá": "Không xác định", "Gây mụn": "-", "Nhận diện": "-"})
+                continue
+
+            # Logic đánh giá rủi ro
+            user_risk, message = self.check_safety_for_user(db_id)
+            risk_key = user_risk if user_risk in ('DANGER', 'WARNING') else 'SAFE'
+            counts[risk_key] += 1
+            row_ids.append(db_id)
+            verdicts.append((risk_key, message))
+            product_ids.append(db_id)
+            rows.append({
+                "Tên chất": details['inci_name'],
+                "Chức năng": details['function_category'],
+                "Đánh giá": STATUS_LABELS[risk_key],
+                "Gây mụn": details['comedogenic_rating'],
+                "Nhận diện": match_note
+            })
+
+        # Xác định kết quả tổng quan
+        risk_summary = "An toàn"
+        if counts['DANGER'] > 0: risk_summary = "Rủi ro cao 🔴"
+        elif counts['WARNING'] > 0: risk_summary = "Cần lưu ý ⚠️"
+
+        return {
+            'rows': rows,
+            'ingredient_ids': row_ids,
+            'verdicts': verdicts,
+            'product_ids': product_ids,
+            'safe_count': counts['SAFE'],
+            'warning_count': counts['WARNING'],
+            'risk_count': counts['DANGER'],
+            'risk_summary': risk_summary,
+        }
+
+    @timed('analyzer.summarize_for_chat')
+    def summarize_for_chat(self, detected_names, max_items=15):
+        """
+        Bản tóm tắt gọn (đã chấm điểm theo hồ sơ) để đưa vào ngữ cảnh chatbot thay cho
+        danh sách thành phần thô: chất rủi ro kèm lý do, chất an toàn chỉ liệt kê tên.
+        """
+        label = self.analyze_label(detected_names)   # Đã đánh giá từng chất 1 lần, không tra lại
+        flagged, safe_names, unknown = [], [], []
+        for name, row, verdict in zip(detected_names, label['rows'], label['verdicts']):
+            if verdict is None:
+                unknown.append(name)
+                continue
+            risk, message = verdict
+            inci = row["Tên chất"]
+            if risk in ('DANGER', 'WARNING'):
+                reason = " ".join(message.replace("**", "").split("\n")[0].split()[1:])
+                flagged.append(f"{inci} [{risk}: {reason[:90]}]")
+            else:
+                safe_names.append(inci)
+
+        parts = [f"{len(detected_names)} thành phần, kết luận: {label['risk_summary']}."]
+        if flagged:
+            parts.append("Cần chú ý: " + "; ".join(flagged[:max_items]) + ".")
+        if safe_names:
+            extra = f" (+{len(safe_names) - max_items} chất khác)" if len(safe_names) > max_items else ""
+            parts.append("Phù hợp: " + ", ".join(safe_names[:max_items]) + extra + ".")
+        if unknown:
+            parts.append("Chưa có dữ liệu: " + ", ".join(unknown[:5]) + (" ..." if len(unknown) > 5 else "") + ".")
+        return " ".join(parts)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# =====================================================
+# FIXTURE DÙNG CHUNG CHO TEST
+# =====================================================
+# Mọi test (autouse) chạy trên BẢN SAO của Aesthetic_DB.db trong thư mục tạm (AESTHETIC_DB_PATH):
+# migration, snapshot KB, cache... không bao giờ chạm vào DB thật. Các bản dùng chung trong
+# process được reset giữa các test.
+
+
+@pytest.fixture(autouse=True)
+def db_path(tmp_path, monkeypatch):
+    import answer_cache
+    import database_utils
+    import history_writer
+    import interaction_graph
+    import ocr_cache
+
+    path = tmp_path / 'test.db'
+    shutil.copyfile(os.path.join(ROOT, 'Aesthetic_DB.db'), path)
+    monkeypatch.setenv(database_utils.DB_PATH_ENV, str(path))
+    monkeypatch.setattr(answer_cache, '_cache', None)
+    monkeypatch.setattr(ocr_cache, '_cache', None)
+    monkeypatch.setattr(interaction_graph, '_graph', None)
+    yield str(path)
+    if history_writer._writer is not None:
+        history_writer._writer.flush(timeout=5.0)
+    database_utils.close_all_connections()
+
+
+def make_image(size=(64, 48), seed=None):
+    """Ảnh PNG nhiễu ngẫu nhiên (mỗi seed cho 1 ảnh khác nhau)"""
+    from PIL import Image
+    rng = random.Random(seed)
+    img = Image.frombytes('RGB', size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+async def _call(app, method, path, body=b'', headers=(), query=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': list(headers)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def call(app, method, path, body=b'', headers=(), query=b''):
+    """Gọi app ASGI trực tiếp (không cần uvicorn). Trả về (status, text, list message đã gửi)."""
+    if isinstance(body, dict):
+        body = json.dumps(body).encode('utf-8')
+        headers = list(headers) + [(b'content-type', b'application/json')]
+    sent = asyncio.run(_call(app, method, path, body, headers, query))
+    starts = [m for m in sent if m['type'] == 'http.response.start']
+    text = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body').decode('utf-8')
+    return starts[0]['status'], text, sent
+
+
+def parse_sse(text):
+    """'data: {...}\\n\\nevent: done\\ndata: {...}' -> list (event, payload)"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = 'message', None
+        for line in block.splitlines():
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+        events.append((event, data))
+    return events
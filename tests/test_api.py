@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from api_server import AnalysisAPI
+from chat_service import StubChatModel
+from conftest import call, make_image, parse_sse
+from vision_service import StubVisionBackend
+
+LABEL = ['Water', 'Glycerin', 'Niacinamide']
+
+
+@pytest.fixture
+def make_api():
+    """AnalysisAPI offline (vision + chat giả lập, không độ trễ). Mỗi lần gọi = 1 'worker process'."""
+    apis = []
+
+    def _make(**kwargs):
+        kwargs.setdefault('vision_backend', StubVisionBackend(LABEL, latency_ms=0))
+        kwargs.setdefault('chat_model_factory', lambda: StubChatModel(reply="Sản phẩm an toàn", latency_ms=0))
+        api = AnalysisAPI(backend='stub', **kwargs)
+        apis.append(api)
+        return api
+
+    yield _make
+    for api in apis:
+        api.close()
+
+
+def test_health(make_api):
+    status, text, _ = call(make_api(), 'GET', '/health')
+    assert status == 200 and '"status": "ok"' in text
+    assert '"remote_calls"' in text
+
+
+def test_unknown_route_and_method(make_api):
+    api = make_api()
+    assert call(api, 'GET', '/nope')[0] == 404
+    assert call(api, 'GET', '/score')[0] == 405
+
+
+def test_score(make_api):
+    status, text, _ = call(make_api(), 'POST', '/score', {'ingredients': LABEL, 'skin_type': 'Oily'})
+    assert status == 200
+    result = json.loads(text)
+    assert len(result['ingredient_ids']) == len(LABEL)
+    assert result['risk_summary']
+    assert isinstance(result['interactions'], list)
+
+
+def test_score_rejects_bad_input(make_api):
+    api = make_api()
+    assert call(api, 'POST', '/score', {'ingredients': [], 'skin_type': 'Oily'})[0] == 400
+    assert call(api, 'POST', '/score', {'ingredients': LABEL, 'skin_type': 'Purple'})[0] == 400
+    assert call(api, 'POST', '/score', b'{not json', [(b'content-type', b'application/json')])[0] == 400
+
+
+def test_scan_raw_and_base64(make_api):
+    api = make_api()
+    status, text, _ = call(api, 'POST', '/scan', make_image(seed=1), [(b'content-type', b'image/png')],
+                           query=b'skin_type=Dry')
+    assert status == 200
+    result = json.loads(text)
+    assert result['detected'] == LABEL
+    assert result['metrics']['cached'] is False
+
+    body = {'image_base64': base64.b64encode(make_image(seed=2)).decode(), 'skin_type': 'Normal'}
+    status, text, _ = call(api, 'POST', '/scan', body)
+    assert status == 200 and json.loads(text)['detected'] == LABEL
+
+
+def test_scan_maps_ocr_failures_to_status(make_api):
+    class Failing(StubVisionBackend):
+        def extract(self, image_bytes):
+            raise PermissionError("API key sai")
+
+    api = make_api(vision_backend=Failing(latency_ms=0))
+    status, text, _ = call(api, 'POST', '/scan', make_image(seed=3), [(b'content-type', b'image/png')])
+    assert status == 502 and '"kind": "fatal"' in text
+    assert call(api, 'POST', '/scan', b'')[0] == 400
+
+
+def test_chat_and_follow_up_on_another_worker(make_api):
+    first, second = make_api(), make_api()
+    status, text, _ = call(first, 'POST', '/chat', {'message': "Dùng được không?", 'ingredients': LABEL,
+                                                     'skin_type': 'Oily'})
+    assert status == 200
+    reply = json.loads(text)
+    assert reply['reply'] == "Sản phẩm an toàn"
+
+    # Worker khác chưa từng thấy phiên này: dựng lại từ bảng Chat_Sessions thay vì 404
+    status, text, _ = call(second, 'POST', '/chat', {'message': "Tại sao?", 'session_id': reply['session_id']})
+    assert status == 200
+    session = second.sessions[reply['session_id']]
+    assert [q for q, _ in session.bot.context.turns] == ["Dùng được không?", "Tại sao?"]
+    assert session.skin_type == 'Oily'
+
+    assert call(second, 'POST', '/chat', {'message': "?", 'session_id': 'không-tồn-tại'})[0] == 404
+
+
+def test_chat_streams_server_sent_events(make_api):
+    status, text, sent = call(make_api(), 'POST', '/chat', {'message': "Dùng được không?", 'ingredients': LABEL,
+                                                            'stream': True})
+    assert status == 200
+    assert (b'content-type', b'text/event-stream; charset=utf-8') in sent[0]['headers']
+    events = parse_sse(text)
+    assert "".join(data['text'] for event, data in events if event == 'message') == "Sản phẩm an toàn"
+    event, final = events[-1]
+    assert event == 'done' and final['metrics']['ttft_ms'] is not None
+
+
+def test_stream_failure_after_start_ends_with_error_event(make_api):
+    api = make_api()
+
+    async def _fail(*args):
+        raise RuntimeError("DB hỏng")
+
+    api._save_session = _fail
+    status, text, sent = call(api, 'POST', '/chat', {'message': "Hi", 'ingredients': LABEL, 'stream': True})
+    assert status == 200
+    assert sum(m['type'] == 'http.response.start' for m in sent) == 1
+    assert parse_sse(text)[-1] == ('error', {'error': "Lỗi hệ thống", 'status': 500})
+    assert sent[-1].get('more_body') is not True
+
+
+def test_lifespan_reports_failed_startup(make_api):
+    api = make_api()
+
+    async def _fail(*args):
+        raise RuntimeError("không mở được DB")
+
+    api.db.run = _fail
+    messages, sent = [{'type': 'lifespan.startup'}], []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(api({'type': 'lifespan'}, receive, send))
+    assert sent[0]['type'] == 'lifespan.startup.failed'
+
+
+def test_history_and_search(make_api):
+    api = make_api()
+    call(api, 'POST', '/scan', make_image(seed=4), [(b'content-type', b'image/png')], query=b'save=1')
+    from history_writer import get_history_writer
+    get_history_writer().flush(timeout=5.0)
+
+    status, text, _ = call(api, 'GET', '/history', query=b'limit=5')
+    assert status == 200 and json.loads(text)['items'][0]['ingredients_detected'] == ", ".join(LABEL)
+    assert call(api, 'GET', '/history', query=b'limit=x')[0] == 400
+
+    status, text, _ = call(api, 'GET', '/search', query=b'q=glyc')
+    assert status == 200
+    assert 'Glycerin' in [row['inci_name'] for row in json.loads(text)['items']]
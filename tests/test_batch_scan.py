@@ -0,0 +1,96 @@
+import json
+import threading
+
+import pytest
+
+import batch_scan
+from conftest import make_image
+from database_utils import get_connection
+from vision_service import StubVisionBackend
+
+
+@pytest.fixture
+def images(tmp_path):
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    for i in range(25):
+        (folder / f'{i:03d}.png').write_bytes(make_image(size=(16, 16), seed=100 + i))
+    return folder
+
+
+def _args(images, out):
+    return batch_scan.build_parser().parse_args([str(images), '--backend', 'stub', '--out', str(out),
+                                                 '--workers', '2', '--stub-latency-ms', '0', '--no-cache'])
+
+
+def _history_count():
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM Scan_History").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _lines(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for _ in f)
+
+
+def test_checkpoint_only_covers_stored_history(images, tmp_path, monkeypatch):
+    out = tmp_path / 'results.jsonl'
+    monkeypatch.setattr(batch_scan, 'HISTORY_BATCH', 10)
+    insert = batch_scan.insert_scan_results
+    calls = []
+
+    def fail_second_batch(rows):
+        calls.append(len(rows))
+        return insert(rows) if len(calls) == 1 else False
+
+    monkeypatch.setattr(batch_scan, 'insert_scan_results', fail_second_batch)
+    with pytest.raises(batch_scan.HistoryWriteError):
+        batch_scan.run_batch(_args(images, out))
+    assert _lines(out) == calls[0] == _history_count()   # Checkpoint không đi trước DB
+
+    # Chạy lại: chỉ quét phần chưa có trong checkpoint, lịch sử không bị thiếu / trùng
+    monkeypatch.setattr(batch_scan, 'insert_scan_results', insert)
+    stats = batch_scan.run_batch(_args(images, out))
+    assert stats['skipped'] == calls[0] and stats['ok'] == 25 - calls[0]
+    assert _lines(out) == _history_count() == 25
+
+
+class ServiceUnavailable(Exception):
+    """Cùng tên với lỗi 503 của google.api_core"""
+
+
+class Flaky(StubVisionBackend):
+    """Lần gọi đầu của mỗi ảnh lỗi 503; ảnh tên 'bad' luôn lỗi cố định"""
+
+    def __init__(self):
+        super().__init__(['Water'], latency_ms=0)
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def extract(self, image_bytes):
+        if image_bytes == b'bad':
+            raise PermissionError("ảnh hỏng")
+        with self.lock:
+            first = image_bytes not in self.seen
+            self.seen.add(image_bytes)
+        if first:
+            raise ServiceUnavailable("503")
+        return super().extract(image_bytes)
+
+
+def test_ocr_is_retried_and_failures_are_classified(images, tmp_path, monkeypatch):
+    backend = Flaky()
+    monkeypatch.setattr(batch_scan, 'make_backend', lambda args: backend)
+    (images / 'zz_bad.png').write_bytes(b'bad')
+    out = tmp_path / 'results.jsonl'
+    args = _args(images, out)
+    args.no_preprocess = True
+
+    stats = batch_scan.run_batch(args)
+    assert (stats['ok'], stats['error']) == (25, 1)   # 503 lần đầu được thử lại, không làm hỏng ảnh
+    with open(out, encoding='utf-8') as f:
+        errors = [json.loads(line) for line in f if '"error"' in line]
+    assert [(e['file'].endswith('zz_bad.png'), e['error_kind']) for e in errors] == [(True, 'fatal')]
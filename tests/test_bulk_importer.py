@@ -0,0 +1,102 @@
+import json
+
+from bulk_importer import bulk_load_interactions, bulk_upsert_ingredients, import_file, normalize_record
+from database_utils import get_connection
+
+
+def _row(inci_name):
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT * FROM Ingredients WHERE inci_name = ?", (inci_name,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def test_normalize_record_maps_aliases_and_types():
+    row = dict(zip(('inci_name', 'common_names', 'function_category', 'safety_rating', 'comedogenic_rating',
+                    'optimal_ph_min', 'optimal_ph_max', 'mechanism_of_action', 'side_effects', 'pregnancy_safe'),
+                   normalize_record({' INCI Name ': ' Bakuchiol ', 'Category': 'Active', 'com': '1',
+                                     'ph_min': '4.5', 'pregnancy': 'Có', 'safe': 'x', 'unknown': 'bỏ qua'})))
+    assert row == {'inci_name': 'Bakuchiol', 'common_names': None, 'function_category': 'Active',
+                   'safety_rating': None, 'comedogenic_rating': 1, 'optimal_ph_min': 4.5, 'optimal_ph_max': None,
+                   'mechanism_of_action': None, 'side_effects': None, 'pregnancy_safe': 1}
+    assert normalize_record({'common': 'Không có tên INCI'}) is None
+
+
+def test_upsert_reports_new_changed_unchanged_and_keeps_ids():
+    glycerin, niacinamide = _row('Glycerin'), _row('Niacinamide')
+    records = [
+        {'inci_name': 'Bakuchiol', 'function_category': 'Active', 'comedogenic_rating': 0},
+        {'inci_name': 'Glycerin', 'comedogenic_rating': 1},           # Sửa 1 cột, cột trống giữ nguyên
+        {'inci_name': 'Niacinamide', 'function_category': 'Active'},  # Giống hệt DB -> không ghi
+        {'common_names': 'thiếu inci_name'},
+    ]
+    report = bulk_upsert_ingredients(records, chunk_size=2)
+    assert {k: report[k] for k in ('processed', 'new', 'changed', 'unchanged', 'skipped')} == \
+        {'processed': 3, 'new': 1, 'changed': 1, 'unchanged': 1, 'skipped': 1}
+
+    updated = _row('Glycerin')
+    assert updated['ingredient_id'] == glycerin['ingredient_id']   # Không xóa/chèn lại như INSERT OR REPLACE
+    assert updated['comedogenic_rating'] == 1
+    assert updated['common_names'] == glycerin['common_names']
+    assert updated['last_updated'] != glycerin['last_updated']
+    assert _row('Niacinamide') == niacinamide
+
+    again = bulk_upsert_ingredients(records[:3])
+    assert (again['new'], again['changed'], again['unchanged']) == (0, 0, 3)
+
+
+def test_import_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / 'cosing.csv'
+    csv_path.write_text("INCI Name,Function,Comedogenic\nBakuchiol,Active,0\nSqualane,Emollient,\n",
+                        encoding='utf-8-sig')
+    report = import_file(str(csv_path), verbose=False)
+    assert (report['new'], report['unchanged']) == (1, 1)
+
+    jsonl_path = tmp_path / 'ingredients.jsonl'
+    jsonl_path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in [
+        {'inci_name': 'Bakuchiol', 'common_names': 'Retinol thực vật'}, {'inci_name': 'Ectoin'}]) + "\n",
+        encoding='utf-8')
+    report = import_file(str(jsonl_path), verbose=False)
+    assert (report['new'], report['changed']) == (1, 1)
+    assert _row('Bakuchiol')['common_names'] == 'Retinol thực vật'
+    assert _row('Bakuchiol')['function_category'] == 'Active'
+
+
+# --- LUẬT TƯƠNG TÁC ---
+
+def _pairs():
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT a.inci_name, b.inci_name, i.advice_vn FROM Ingredient_Interactions i
+            JOIN Ingredients a ON a.ingredient_id = i.ingredient_a_id
+            JOIN Ingredients b ON b.ingredient_id = i.ingredient_b_id
+        """).fetchall()
+        return {frozenset(r[:2]): (r[0], r[1], r[2]) for r in rows}
+    finally:
+        conn.close()
+
+
+def test_interactions_are_canonical_and_duplicates_do_nothing():
+    before = _pairs()
+    rules = [
+        {'a': 'Zinc Oxide', 'b': 'Glycolic Acid', 'type': 'CAUTION', 'level': 'LOW', 'advice': 'đầu tiên'},
+        {'a': 'glycolic acid ', 'b': 'ZINC OXIDE', 'type': 'AVOID', 'level': 'HIGH', 'advice': 'chiều ngược'},
+        {'a': 'Zinc Oxide', 'b': 'Zinc Oxide', 'type': 'AVOID'},     # Cặp với chính nó
+        {'a': 'Zinc Oxide', 'b': 'Không tồn tại'},
+    ]
+    report = bulk_load_interactions(rules, chunk_size=3)
+    assert {k: report[k] for k in ('processed', 'inserted', 'duplicates')} == \
+        {'processed': 2, 'inserted': 1, 'duplicates': 1}
+    assert report['missing'] == [('Zinc Oxide', 'Zinc Oxide'), ('Zinc Oxide', 'Không tồn tại')]
+
+    after = _pairs()
+    pair = after[frozenset({'Zinc Oxide', 'Glycolic Acid'})]
+    assert pair == ('Glycolic Acid', 'Zinc Oxide', 'đầu tiên')   # id nhỏ trước; luật trùng không ghi đè
+    assert len(after) == len(before) + 1
+
+    again = bulk_load_interactions(rules[:2])
+    assert (again['inserted'], again['duplicates']) == (0, 2)
+    assert _pairs() == after
@@ -0,0 +1,57 @@
+import random
+
+from catalog_scoring import PROFILES, build_scoring_table, iter_catalog, score_catalog, score_product, score_shard
+from database_utils import get_connection
+from knowledge_base import get_knowledge_base
+from resource_cache import get_analyzer
+
+SUMMARY_RISK = {"Rủi ro cao 🔴": 'DANGER', "Cần lưu ý ⚠️": 'WARNING', "An toàn": 'SAFE'}
+
+
+def _catalog(n, seed=5):
+    """Sản phẩm giả lập từ tên INCI thật (không trùng chất trong 1 sản phẩm) + vài tên lạ"""
+    rng = random.Random(seed)
+    names = [rec.inci_name for rec in get_knowledge_base()]
+    products = []
+    for i in range(n):
+        label = rng.sample(names, rng.randint(3, 12)) + (['Unknown Extract'] if i % 3 == 0 else [])
+        rng.shuffle(label)
+        products.append((f"p{i}", f"Sản phẩm {i}", label))
+    return products
+
+
+def test_score_product_agrees_with_analyze_label_for_all_profiles():
+    table = build_scoring_table()
+    for _, _, names in _catalog(40):
+        scores = score_product(table, names)
+        for (skin, preg), (risk, safe, warn, danger, unknown, flagged) in zip(PROFILES, scores):
+            label = get_analyzer(skin, preg).analyze_label(names)
+            assert risk == SUMMARY_RISK[label['risk_summary']], (skin, preg, names)
+            assert (safe, warn, danger) == (label['safe_count'], label['warning_count'], label['risk_count'])
+            assert unknown == label['ingredient_ids'].count(None)
+            flagged_ids = [str(i) for i, row in zip(label['ingredient_ids'], label['rows'])
+                           if i is not None and row["Đánh giá"] != "An toàn"]
+            assert flagged == ",".join(flagged_ids)
+
+
+def test_parallel_scoring_matches_sequential_and_is_written(tmp_path):
+    catalog = _catalog(60)
+    expected = score_shard([(key, names) for key, _, names in catalog], build_scoring_table())
+
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text("\n".join(
+        '{"product_id": "%s", "product_name": "%s", "ingredients": "%s"}' % (key, name, ", ".join(names))
+        for key, name, names in catalog) + "\n", encoding='utf-8')
+    report = score_catalog(iter_catalog(str(path)), workers=2, shard_size=7)
+    assert (report['products'], report['rows']) == (60, 60 * len(PROFILES))
+
+    conn = get_connection()
+    try:
+        stored = conn.execute("""
+            SELECT product_key, skin_type, is_pregnant, risk_level, safe_count, warning_count, danger_count,
+                   unknown_count, flagged_ids, kb_version FROM Catalog_Scores
+        """).fetchall()
+        assert conn.execute("SELECT COUNT(*) FROM Catalog_Products").fetchone()[0] == 60
+    finally:
+        conn.close()
+    assert sorted(tuple(row) for row in stored) == sorted(expected)
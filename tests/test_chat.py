@@ -0,0 +1,184 @@
+from answer_cache import AnswerCache, make_key, normalize_question
+from chat_context import ChatContextManager
+from chat_service import AIChatbot, StubChatModel
+
+
+def make_bot(reply="Không nên dùng khi mang thai", latency_ms=0, cache=False, ingredients=('Water', 'Glycerin'),
+             profile="Da Dầu, Bầu: False", digest=None):
+    bot = AIChatbot(None, model=StubChatModel(reply=reply, latency_ms=latency_ms), answer_cache=cache)
+    bot.start_new_session(list(ingredients), profile, digest)
+    return bot
+
+
+# --- STREAMING + SỐ LIỆU THỜI GIAN ---
+
+def test_stream_yields_chunks_and_records_ttft():
+    bot = make_bot(reply="Một hai ba", latency_ms=30)
+    chunks = list(bot.send_message_stream("Có dùng được không?"))
+    assert chunks == ["Một", " hai", " ba"]
+
+    metrics = bot.last_metrics
+    assert metrics['error'] is None and metrics['cached'] is False
+    assert metrics['chars'] == len("Một hai ba")
+    assert metrics['prompt_tokens'] > 0
+    assert 0 < metrics['ttft_ms'] <= metrics['total_ms']
+    assert metrics['total_ms'] >= 25   # Độ trễ giả lập được tính vào tổng thời gian
+    assert list(bot.metrics) == [metrics]
+
+
+def test_turns_are_added_to_context():
+    bot = make_bot(reply="Được")
+    assert bot.send_message("Câu 1?") == "Được"
+    assert bot.send_message("Câu 2?") == "Được"
+    assert [q for q, _ in bot.context.turns] == ["Câu 1?", "Câu 2?"]
+
+
+def test_stream_without_session_reports_error():
+    bot = AIChatbot(None, model=StubChatModel(latency_ms=0), answer_cache=False)
+    assert "chưa được khởi tạo" in bot.send_message("Xin chào")
+
+
+def test_context_stays_within_budget_with_huge_turns():
+    context = ChatContextManager("Bạn là bác sĩ da liễu. " * 40, "Chào bạn!", budget=500)
+    for i in range(4):
+        context.add_turn(f"Câu hỏi {i}?", "x " * 3000)
+    assert context.prompt_tokens() <= 500
+    assert [q for q, _ in context.turns] == ["Câu hỏi 2?", "Câu hỏi 3?"]   # Câu hỏi ngắn giữ nguyên
+
+
+# --- CACHE CÂU TRẢ LỜI ---
+
+def test_long_label_digest_never_truncates_profile_or_rules():
+    digest = "Sản phẩm chứa: " + ", ".join(f"Chất số {i}" for i in range(500))
+    bot = AIChatbot(None, model=StubChatModel(latency_ms=0), token_budget=600, answer_cache=False)
+    bot.start_new_session(['Water'], "Da Dầu, Bầu: True", digest)
+    prompt = bot.context.system_prompt
+    assert bot.context.prompt_tokens() <= 600 and prompt.endswith("…")   # Chỉ phần nhãn bị cắt
+    assert "HỒ SƠ KHÁCH HÀNG (QUAN TRỌNG): Da Dầu, Bầu: True." in prompt
+    assert "ƯU TIÊN SỐ 1: An toàn cho Bà bầu" in prompt and "Chất số 0" in prompt
+
+
+def test_question_normalization_keeps_vietnamese_marks():
+    assert normalize_question("  Tại   sao?? ") == "tại sao"
+    assert make_key('h', 'p', "Tại sao?", 'm') == make_key('h', 'p', "tại sao", 'm')
+    assert normalize_question("bầu") != normalize_question("bâu")
+
+
+def test_first_turn_answer_is_shared_between_sessions():
+    cache = AnswerCache(persist=False)
+    first = make_bot(reply="A", cache=cache)
+    assert first.send_message("Có dùng được không?") == "A"
+    assert first.last_metrics['cached'] is False
+
+    second = make_bot(reply="B", cache=cache, ingredients=('glycerin', 'WATER'))   # Khác thứ tự / hoa thường
+    assert second.send_message("có dùng được không") == "A"
+    assert second.last_metrics['cached'] is True
+    assert second.context.turns == [("có dùng được không", "A")]
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_follow_up_questions_never_use_cache():
+    cache = AnswerCache(persist=False)
+    make_bot(reply="A", cache=cache).send_message("Tại sao?")
+
+    bot = make_bot(reply="B", cache=cache)
+    bot.send_message("Có dùng được không?")
+    assert bot.send_message("Tại sao?") == "B"   # Giữa hội thoại: luôn hỏi model
+    assert bot.last_metrics['cached'] is False
+
+
+def test_cache_miss_on_other_profile_digest_or_data_version(monkeypatch):
+    import answer_cache
+    cache = AnswerCache(persist=False)
+    make_bot(reply="A", cache=cache, digest="d1").send_message("Dùng được không?")
+
+    for kwargs in ({'profile': "Da Khô, Bầu: True", 'digest': "d1"}, {'digest': "d2"}):
+        bot = make_bot(reply="B", cache=cache, **kwargs)
+        assert bot.send_message("Dùng được không?") == "B"
+
+    monkeypatch.setattr(answer_cache, 'RULES_VERSION', answer_cache.RULES_VERSION + 1)
+    assert make_bot(reply="C", cache=cache, digest="d1").send_message("Dùng được không?") == "C"
+
+
+def test_interrupted_stream_is_not_cached():
+    cache = AnswerCache(persist=False)
+    bot = make_bot(reply="một câu trả lời rất dài", cache=cache)
+    stream = bot.send_message_stream("Dùng được không?")
+    next(stream)
+    stream.close()   # Người xem dừng giữa chừng
+    assert cache.stats()['stores'] == 0
+    assert make_bot(reply="B", cache=cache).send_message("Dùng được không?") == "B"
+
+
+def test_persisted_answers_survive_new_process_cache(db_path):
+    AnswerCache().put('hash', 'profile', "Tại sao?", 'stub', "Vì retinol")
+    fresh = AnswerCache()   # RAM trống, phải đọc từ bảng Chat_Answer_Cache
+    assert fresh.get('hash', 'profile', "tại sao", 'stub') == "Vì retinol"
+    assert fresh.stats()['db_hits'] == 1
+    assert fresh.get('hash', 'other profile', "tại sao", 'stub') is None
+
+
+def test_memory_hits_keep_hot_answers_through_db_eviction(db_path, monkeypatch):
+    import answer_cache
+    from database_utils import get_connection
+    monkeypatch.setattr(answer_cache, 'EVICT_EVERY', 4)
+    cache = AnswerCache(max_rows=2)
+    cache.put('hash', 'p', "Câu nóng?", 'stub', "nóng")
+    for i in range(2):
+        cache.put('hash', 'p', f"Câu {i}?", 'stub', str(i))
+        assert cache.get('hash', 'p', "Câu nóng?", 'stub') == "nóng"   # Chỉ trúng tầng RAM
+    assert cache.stats()['db_hits'] == 0
+
+    cache.put('hash', 'p', "Câu 2?", 'stub', "2")   # Lần ghi thứ 4 -> dồn lần dùng rồi cắt bảng còn 2 dòng
+    conn = get_connection()
+    try:
+        rows = dict(conn.execute("SELECT question, hit_count FROM Chat_Answer_Cache").fetchall())
+    finally:
+        conn.close()
+    assert rows == {"câu nóng": 2, "câu 2": 0}
+
+
+def test_memory_hit_touches_are_flushed_periodically(db_path, monkeypatch):
+    import answer_cache
+    from database_utils import get_connection
+    cache = AnswerCache()
+    cache.put('hash', 'p', "Tại sao?", 'stub', "Vì retinol")
+    monkeypatch.setattr(answer_cache, 'TOUCH_FLUSH_S', 0.0)
+    assert cache.get('hash', 'p', "Tại sao?", 'stub') == "Vì retinol"
+    conn = get_connection()
+    try:
+        used, created, hits = conn.execute(
+            "SELECT last_used_at, created_at, hit_count FROM Chat_Answer_Cache").fetchone()
+    finally:
+        conn.close()
+    assert used > created and hits == 1
+
+
+def test_expired_answers_are_not_served(db_path):
+    cache = AnswerCache(ttl=-1)
+    cache.put('hash', 'profile', "Tại sao?", 'stub', "Vì retinol")
+    assert cache.get('hash', 'profile', "Tại sao?", 'stub') is None
+
+
+# --- TÓM TẮT NHÃN CHO CHAT ---
+
+def test_summary_scores_each_ingredient_once(monkeypatch):
+    from resource_cache import get_analyzer
+    analyzer = get_analyzer('Oily', True)
+    calls = []
+    check = analyzer.check_safety_for_user
+    monkeypatch.setattr(analyzer, 'check_safety_for_user', lambda ing_id: calls.append(ing_id) or check(ing_id))
+
+    summary = analyzer.summarize_for_chat(['Water', 'Tretinoin', 'Cocos Nucifera Oil', 'Chất lạ XYZ'])
+    assert len(calls) == 3
+    assert "Cần chú ý: Tretinoin [DANGER:" in summary and "Cocos Nucifera Oil [DANGER:" in summary
+    assert "Phù hợp: Water." in summary and "Chưa có dữ liệu: Chất lạ XYZ." in summary
+
+
+def test_summary_without_knowledge_base(monkeypatch):
+    import services
+    from resource_cache import get_analyzer
+    for name in ('get_knowledge_base', 'get_matcher', 'get_fuzzy_index', 'get_verdict_table'):
+        monkeypatch.setattr(services, name, lambda: None)
+    summary = get_analyzer('Normal', False).summarize_for_chat(['Water', 'Glycerin'])
+    assert summary == "2 thành phần, kết luận: An toàn. Chưa có dữ liệu: Water, Glycerin."
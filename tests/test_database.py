@@ -0,0 +1,106 @@
+import sqlite3
+
+import pytest
+
+import database_utils
+from database_utils import MIGRATIONS, get_connection, get_history_page, run_migrations, search_ingredients
+
+
+def _names(conn, kind):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+# --- MIGRATION (trên bản sao Aesthetic_DB.db, chưa từng migrate) ---
+
+def test_migrations_upgrade_fresh_copy(db_path):
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    ingredients = conn.execute("SELECT COUNT(*) FROM Ingredients").fetchone()[0]
+
+    run_migrations(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    assert {'Scan_History', 'Scan_History_Ingredients', 'Safety_Verdicts', 'OCR_Cache', 'Catalog_Products',
+            'Catalog_Scores', 'Ingredients_FTS', 'Chat_Answer_Cache', 'Chat_Sessions', 'Data_Versions'} <= _names(conn, 'table')
+    assert {'idx_interactions_pair', 'idx_ingredients_name_nocase', 'idx_answer_cache_last_used',
+            'idx_chat_sessions_updated'} <= _names(conn, 'index')
+    assert {'trg_interactions_canonical', 'trg_ingredients_fts_insert', 'trg_ingredients_fts_update',
+            'trg_interactions_version_update', 'trg_ingredients_version_update'} <= _names(conn, 'trigger')
+    # FTS được dựng lại từ dữ liệu sẵn có
+    assert conn.execute("SELECT COUNT(*) FROM Ingredients_FTS").fetchone()[0] == ingredients
+
+    run_migrations(conn)   # Chạy lại: không làm gì
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MIGRATIONS[-1][0]
+    conn.close()
+
+
+def test_migration_versions_are_sequential():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_interaction_pairs_are_canonical_and_versioned(db_path):
+    from interaction_graph import get_interactions_version
+    conn = get_connection()
+    try:
+        a, b = conn.execute("SELECT ingredient_id FROM Ingredients ORDER BY ingredient_id DESC LIMIT 2").fetchall()
+        conn.execute("DELETE FROM Ingredient_Interactions WHERE ingredient_a_id IN (?, ?) AND ingredient_b_id IN (?, ?)",
+                     (a[0], b[0], a[0], b[0]))
+        conn.execute("""INSERT INTO Ingredient_Interactions (ingredient_a_id, ingredient_b_id, interaction_type,
+                        severity_level, advice_vn) VALUES (?, ?, 'CAUTION', 'LOW', 'cũ')""", (a[0], b[0]))
+        conn.commit()
+        row = conn.execute("SELECT interaction_id, ingredient_a_id, ingredient_b_id FROM Ingredient_Interactions "
+                           "WHERE advice_vn = 'cũ'").fetchone()
+        assert row[1] < row[2]   # Trigger đảo về dạng a < b
+
+        before = get_interactions_version(conn)
+        conn.execute("UPDATE Ingredient_Interactions SET advice_vn = 'mới' WHERE interaction_id = ?", (row[0],))
+        conn.commit()
+        assert get_interactions_version(conn) != before   # UPDATE cũng làm đổi phiên bản
+    finally:
+        conn.close()
+
+
+def test_ingredient_updates_keep_fts_in_sync(db_path):
+    conn = get_connection()
+    try:
+        conn.execute("UPDATE Ingredients SET common_names = 'Zzyzxium test' WHERE inci_name = 'Glycerin'")
+        conn.commit()
+    finally:
+        conn.close()
+    assert [row['inci_name'] for row in search_ingredients('zzyzx')] == ['Glycerin']
+
+
+# --- TÌM KIẾM + LỊCH SỬ ---
+
+def test_search_prefix_first_then_ranked_fts():
+    rows = search_ingredients('acid', 5)
+    assert 0 < len(rows) <= 5
+    assert all('acid' in row['inci_name'].lower() for row in rows)
+    assert search_ingredients('"; DROP TABLE', 5) == []   # Ký tự đặc biệt không gây lỗi cú pháp FTS
+
+
+@pytest.fixture
+def history(db_path):
+    """Lịch sử có scan_date KHÔNG tăng cùng scan_id (như khi nhiều process ghi theo lô)"""
+    dates = ['2026-03-05', '2026-01-10', '2026-03-01', '2026-02-20', '2026-03-09', '2026-02-01', '2026-03-03']
+    rows = [database_utils.make_scan_row(['Water'], 'An toàn') for _ in dates]
+    rows = [(ing, risk, f"{date} 10:00:00", level, name, links) for (ing, risk, _, level, name, links), date
+            in zip(rows, dates)]
+    assert database_utils.insert_scan_results(rows)
+    return dates
+
+
+def test_history_pages_by_date_range(history):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = get_history_page(2, before_scan_id=cursor, date_from='2026-02-01', date_to='2026-03-06')
+        pages.extend(row['scan_date'][:10] for row in rows)
+        if cursor is None:
+            break
+    assert pages == ['2026-03-05', '2026-03-03', '2026-03-01', '2026-02-20', '2026-02-01']
+
+
+def test_history_pages_without_filters_follow_scan_id(history):
+    rows, cursor = get_history_page(3)
+    assert [row['scan_id'] for row in rows] == sorted((row['scan_id'] for row in rows), reverse=True)
+    rest, _ = get_history_page(10, before_scan_id=cursor)
+    assert len(rows) + len(rest) == len(history)
@@ -0,0 +1,78 @@
+import random
+
+from fuzzy_index import FuzzyIndex, bounded_levenshtein, max_distance_for, normalize_token
+from knowledge_base import get_knowledge_base
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _typo(text, rng, edits):
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randrange(len(chars))
+        op = rng.choice('sdi')
+        if op == 's':
+            chars[pos] = rng.choice('abcdefghilmnorstuy')
+        elif op == 'd' and len(chars) > 1:
+            del chars[pos]
+        else:
+            chars.insert(pos, rng.choice('abcdefghilmnorstuy'))
+    return "".join(chars)
+
+
+def test_bounded_levenshtein_matches_full_distance():
+    rng = random.Random(1)
+    words = ['niacinamide', 'glycerin', 'tocopherol', 'squalane', 'panthenol', 'aqua']
+    for _ in range(300):
+        a = _typo(rng.choice(words), rng, rng.randrange(4))
+        b = _typo(rng.choice(words), rng, rng.randrange(4))
+        limit = rng.randrange(4)
+        assert bounded_levenshtein(a, b, limit) == min(levenshtein(a, b), limit + 1)
+
+
+def test_ocr_typos_resolve_to_the_right_ingredient():
+    kb = get_knowledge_base()
+    index = FuzzyIndex.from_knowledge_base(kb)
+    for token, name in [('Niacinamde', 'Niacinamide'), ('GLYCERlN', 'Glycerin'), ('Tocopheroi', 'Tocopherol'),
+                        ('Phenoxyethano1', 'Phenoxyethanol'), ('Sodium Hyaluronatee', 'Sodium Hyaluronate')]:
+        result = index.resolve(token)
+        assert result is not None and result.ingredient_id == kb.find_id(name), token
+        assert 0 < result.distance <= max_distance_for(len(normalize_token(token)))
+
+    exact = index.resolve('niacinamide')
+    assert (exact.distance, exact.confidence, exact.is_low_confidence) == (0, 1.0, False)
+    assert index.resolve('Aqux') is None          # Tên ngắn: chỉ chấp nhận khớp chính xác
+    assert index.resolve('Xylitolamine') is None
+
+
+def test_trigram_filter_never_misses_the_brute_force_answer():
+    """Bổ đề q-gram: lọc ứng viên theo trigram không được bỏ sót kết quả mà duyệt toàn bộ tìm ra"""
+    index = FuzzyIndex.from_knowledge_base(get_knowledge_base(), cache_size=0)
+    rng = random.Random(2)
+    for _ in range(200):
+        norm, _, _ = rng.choice(index._names)
+        query = normalize_token(_typo(norm, rng, rng.randrange(1, 4)))
+        k = max_distance_for(len(query))
+        if not query or k == 0 or query in index._seen:
+            continue
+        best = min(levenshtein(query, name) for name, _, _ in index._names)
+        result = index.resolve(query)
+        if best <= k:
+            assert result is not None and result.distance == best, query
+        else:
+            assert result is None, query
+
+
+def test_results_are_cached():
+    index = FuzzyIndex.from_knowledge_base(get_knowledge_base())
+    first = index.resolve('Niacinamde')
+    assert index.resolve('niacinamde') is first
+    assert index.cache.stats()['hits'] == 1
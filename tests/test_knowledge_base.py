@@ -0,0 +1,83 @@
+import os
+
+import knowledge_base
+from database_utils import get_connection
+from knowledge_base import FIELDS, ColumnView, IngredientKnowledgeBase
+
+
+def _load_from_db():
+    conn = get_connection()
+    try:
+        return IngredientKnowledgeBase.from_connection(conn)
+    finally:
+        conn.close()
+
+
+def _rows(kb):
+    return [tuple(getattr(rec, f) for f in FIELDS) for rec in kb]
+
+
+def test_snapshot_round_trip(tmp_path):
+    kb = _load_from_db()
+    kb.columns['common_names'][0] = None   # NULL phải giữ nguyên là None
+    path = str(tmp_path / 'kb.snapshot')
+    kb.export_snapshot(path)
+
+    loaded = IngredientKnowledgeBase.load_snapshot(path, expected_version=kb.version)
+    assert isinstance(loaded.columns['inci_name'], ColumnView)   # Đọc thẳng trên mmap
+    assert loaded.version == kb.version
+    assert _rows(loaded) == _rows(kb)
+    for rec in kb:
+        assert loaded.get_details(rec.ingredient_id) == kb.get_details(rec.ingredient_id)
+        assert loaded.find_id(rec.inci_name.upper()) == rec.ingredient_id
+
+
+def test_bad_snapshots_are_rejected(tmp_path):
+    kb = _load_from_db()
+    path = str(tmp_path / 'kb.snapshot')
+    kb.export_snapshot(path)
+    assert IngredientKnowledgeBase.load_snapshot(path, expected_version=('khác',)) is None
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    for name, content in (('cut', data[:len(data) // 2]), ('empty', b''), ('junk', b'x' * 64)):
+        broken = str(tmp_path / name)
+        with open(broken, 'wb') as f:
+            f.write(content)
+        assert IngredientKnowledgeBase.load_snapshot(broken) is None
+    assert IngredientKnowledgeBase.load_snapshot(str(tmp_path / 'missing')) is None
+
+
+def test_shared_kb_writes_and_reuses_snapshot(monkeypatch):
+    monkeypatch.setattr(knowledge_base, '_kb', None)
+    first = knowledge_base.get_knowledge_base(force_check=True)
+    assert os.path.exists(knowledge_base.get_snapshot_path())
+
+    monkeypatch.setattr(knowledge_base, '_kb', None)
+    second = knowledge_base.get_knowledge_base(force_check=True)
+    assert isinstance(second.columns['inci_name'], ColumnView)
+    assert _rows(second) == _rows(first)
+
+
+def test_updates_without_last_updated_reload_the_kb(monkeypatch):
+    monkeypatch.setattr(knowledge_base, '_kb', None)
+    before = knowledge_base.get_knowledge_base(force_check=True)
+    glycerin = before.find_id('Glycerin')
+    conn = get_connection()
+    try:   # Sửa tay kiểu sqlite3 CLI: không đụng last_updated
+        conn.execute("UPDATE Ingredients SET pregnancy_safe = 0 WHERE ingredient_id = ?", (glycerin,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    after = knowledge_base.get_knowledge_base(force_check=True)
+    assert after.version != before.version
+    assert not after.get_details(glycerin)['pregnancy_safe']
+
+
+def test_unknown_verdict_when_kb_unavailable(monkeypatch):
+    import services
+    from resource_cache import get_analyzer
+    monkeypatch.setattr(services, 'get_knowledge_base', lambda: None)
+    monkeypatch.setattr(services, 'get_verdict_table', lambda: None)
+    assert get_analyzer('Oily', False).check_safety_for_user(1)[0] == 'UNKNOWN'
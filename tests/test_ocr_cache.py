@@ -0,0 +1,65 @@
+import io
+
+from PIL import Image
+
+from conftest import make_image
+from ocr_cache import OCRCache, perceptual_hash
+
+
+def _gradient():
+    """Ảnh mịn (dHash ổn định khi nén lại, khác với ảnh nhiễu của make_image)"""
+    img = Image.new('L', (90, 80))
+    img.putdata([(x * 7 + y * 3) % 256 for y in range(80) for x in range(90)])
+    out = io.BytesIO()
+    img.save(out, format='PNG')
+    return out.getvalue()
+
+
+def _reencode(image_bytes):
+    """Cùng ảnh, khác bytes (nén lại sang JPEG) -> khác SHA-256, cùng dHash"""
+    out = io.BytesIO()
+    Image.open(io.BytesIO(image_bytes)).convert('RGB').save(out, format='JPEG', quality=95)
+    return out.getvalue()
+
+
+class Counter:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self, image_bytes):
+        self.calls += 1
+        return list(self.result)
+
+
+def test_same_bytes_hit_memory_then_db():
+    image = make_image(seed=20)
+    ocr = Counter(['Water', 'Glycerin'])
+    assert OCRCache().get_or_compute(image, 'm', ocr) == ['Water', 'Glycerin']
+
+    fresh = OCRCache()   # Process khác: RAM trống, đọc lại từ SQLite
+    assert fresh.get_or_compute(image, 'm', ocr) == ['Water', 'Glycerin']
+    assert fresh.get_or_compute(image, 'm', ocr) == ['Water', 'Glycerin']
+    assert ocr.calls == 1
+    assert fresh.stats()['db_hits'] == 1 and fresh.stats()['memory_hits'] == 1
+
+
+def test_matching_dhash_is_never_a_hit():
+    image = _gradient()
+    similar = _reencode(image)
+    assert perceptual_hash(similar) == perceptual_hash(image)
+
+    cache = OCRCache()
+    cache.get_or_compute(image, 'm', Counter(['Retinol']))
+    other = Counter(['Water'])
+    assert cache.get_or_compute(similar, 'm', other) == ['Water']   # Không trả thành phần của ảnh khác
+    assert other.calls == 1 and cache.stats()['near_duplicates'] == 1
+
+
+def test_empty_results_and_other_models_are_not_shared():
+    image = make_image(seed=22)
+    cache = OCRCache()
+    assert cache.get_or_compute(image, 'm', Counter([])) == []
+    ocr = Counter(['Water'])
+    assert cache.get_or_compute(image, 'm', ocr) == ['Water'] and ocr.calls == 1
+    assert cache.get_or_compute(image, 'other-model', ocr) == ['Water'] and ocr.calls == 2
@@ -0,0 +1,48 @@
+import sys
+import types
+
+import pytest
+
+import knowledge_base
+import resource_cache
+from bulk_importer import bulk_upsert_ingredients
+from resource_cache import DEFAULT_MODEL, get_best_model_name, get_catalog
+
+
+@pytest.fixture
+def genai(monkeypatch):
+    """Module google.generativeai giả lập: list_models() lỗi / trả về theo kịch bản"""
+    module = types.SimpleNamespace(calls=0, outcomes=[], configure=lambda api_key: None)
+
+    def list_models():
+        module.calls += 1
+        outcome = module.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return [types.SimpleNamespace(name=f'models/{name}') for name in outcome]
+
+    module.list_models = list_models
+    google = types.ModuleType('google')
+    google.generativeai = module
+    monkeypatch.setitem(sys.modules, 'google', google)
+    monkeypatch.setitem(sys.modules, 'google.generativeai', module)
+    monkeypatch.setattr(resource_cache, '_cache', resource_cache.ResourceCache())
+    monkeypatch.setattr(resource_cache, '_configured_key', None)
+    return module
+
+
+def test_failed_model_discovery_is_not_cached(genai):
+    genai.outcomes = [ConnectionError("mất mạng"), ['gemini-2.5-flash', 'gemini-1.5-flash']]
+    assert get_best_model_name('key') == DEFAULT_MODEL
+    assert get_best_model_name('key') == 'gemini-2.5-flash'   # Thử lại ngay, không bị ghim 1 giờ
+    assert get_best_model_name('key') == 'gemini-2.5-flash'
+    assert genai.calls == 2
+
+
+def test_bulk_import_invalidates_shared_resources(monkeypatch):
+    monkeypatch.setattr(knowledge_base, 'KB_CHECK_INTERVAL', 3600)   # Không trông vào lần kiểm tra định kỳ
+    assert 'bakuchiol' not in get_catalog().name_to_id
+
+    bulk_upsert_ingredients([{'inci_name': 'Bakuchiol', 'function_category': 'Active'}])
+    assert knowledge_base.get_knowledge_base().find_id('Bakuchiol') is not None
+    assert 'bakuchiol' in get_catalog().name_to_id
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+from chat_service import AIChatbot, StubChatModel
+from conftest import make_image
+from resource_cache import get_analyzer
+from scan_pipeline import RetryPolicy, ScanPipeline, StageError, call_with_retry, is_transient, remote_call_stats
+from vision_service import StubVisionBackend
+
+FAST = RetryPolicy(deadline_s=2.0, attempt_timeout_s=0.5, max_attempts=3, base_delay_s=0.0, max_delay_s=0.0)
+
+
+class ServiceUnavailable(Exception):
+    """Cùng tên với lỗi 503 của google.api_core (phân loại theo tên class)"""
+
+
+class Flaky:
+    def __init__(self, errors, value='ok'):
+        self.errors = list(errors)
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.value
+
+
+# --- PHÂN LOẠI LỖI + RETRY ---
+
+def test_is_transient():
+    assert is_transient(ConnectionError())
+    assert is_transient(TimeoutError())
+    assert is_transient(ServiceUnavailable())
+    assert not is_transient(ValueError())
+    assert not is_transient(PermissionError())
+
+
+def test_transient_errors_are_retried():
+    fn = Flaky([ConnectionError("reset"), ServiceUnavailable("503")])
+    assert call_with_retry('ocr', fn, policy=FAST) == 'ok'
+    assert fn.calls == 3
+
+
+def test_fatal_errors_fail_immediately():
+    fn = Flaky([ValueError("ảnh hỏng")])
+    with pytest.raises(StageError) as info:
+        call_with_retry('ocr', fn, policy=FAST)
+    assert (info.value.kind, info.value.attempts) == ('fatal', 1)
+    assert fn.calls == 1
+
+
+def test_retries_exhausted_report_last_kind():
+    fn = Flaky([ServiceUnavailable()] * 3)
+    with pytest.raises(StageError) as info:
+        call_with_retry('ocr', fn, policy=FAST)
+    assert (info.value.kind, info.value.attempts) == ('transient', 3)
+
+    with pytest.raises(StageError) as info:
+        call_with_retry('ocr', Flaky([TimeoutError()] * 3), policy=FAST)
+    assert info.value.kind == 'timeout'
+
+
+def test_hung_attempts_do_not_block_new_calls():
+    release = threading.Event()
+    policy = RetryPolicy(deadline_s=0.3, attempt_timeout_s=0.1, max_attempts=3, base_delay_s=0.0)
+    try:
+        for _ in range(4):   # 12 lần gọi bị treo: nhiều hơn mọi pool cố định trước đây
+            with pytest.raises(StageError) as info:
+                call_with_retry('ocr', release.wait, policy=policy)
+            assert info.value.kind == 'timeout'
+        assert remote_call_stats()['abandoned'] >= 12
+
+        started = time.perf_counter()
+        assert call_with_retry('ocr', lambda: 42, policy=policy) == 42
+        assert time.perf_counter() - started < 0.1
+    finally:
+        release.set()
+
+
+# --- PIPELINE ---
+
+def _pipeline(bot, label, **kwargs):
+    return ScanPipeline(StubVisionBackend(label, latency_ms=0), get_analyzer('Oily', False), bot,
+                        use_cache=False, **kwargs)
+
+
+def test_pipeline_reports_scores_then_chat():
+    bot = AIChatbot(None, model=StubChatModel(latency_ms=0), answer_cache=False)
+    stages = []
+    result = _pipeline(bot, ['Water', 'Glycerin']).run(make_image(seed=10), "Da Dầu",
+                                                       on_stage=lambda stage, r: stages.append(stage))
+    assert stages == ['ocr', 'scores']
+    assert result.ok and result.label['risk_summary']
+    from knowledge_base import get_knowledge_base
+    assert result.scored_for == ('Oily', False, get_knowledge_base().version)   # app.py so với view_key[1:]
+    assert result.wait_chat(5.0)
+    assert bot.chat_session is not None and 'chat_ready_ms' in result.timings
+
+
+def test_pipeline_ocr_failure_is_classified():
+    class Broken(StubVisionBackend):
+        def extract(self, image_bytes):
+            raise PermissionError("API key sai")
+
+    pipeline = ScanPipeline(Broken(latency_ms=0), get_analyzer('Oily', False), None, use_cache=False)
+    result = pipeline.run(make_image(seed=11), "Da Dầu")
+    assert not result.ok and result.error.kind == 'fatal'
+
+
+def test_older_scan_cannot_replace_newer_chat_session():
+    bot = AIChatbot(None, model=StubChatModel(latency_ms=0), answer_cache=False)
+    build = bot.build_session
+
+    def slow_build(names, *args):
+        if 'Retinol' in names:
+            time.sleep(0.3)
+        return build(names, *args)
+
+    bot.build_session = slow_build
+    old = _pipeline(bot, ['Retinol', 'Water']).run(make_image(seed=12), "Da Dầu")
+    new = _pipeline(bot, ['Glycerin']).run(make_image(seed=13), "Da Dầu")
+    assert new.wait_chat(5.0)
+    assert not old.wait_chat(5.0) and old.errors['chat'].kind == 'stale'
+    assert "Phù hợp: Glycerin" in bot.context.system_prompt
+
+
+def test_ocr_span_covers_only_the_ocr_stage(monkeypatch):
+    import perf_metrics
+    monkeypatch.setattr(perf_metrics, '_enabled', True)
+    perf_metrics.reset()
+
+    class SlowAnalyzer:
+        profile = {'skin_type': 'Oily', 'is_pregnant': False}
+
+        def analyze_label(self, detected):
+            time.sleep(0.2)   # Chấm điểm chậm không được tính vào độ trễ OCR
+            return get_analyzer('Oily', False).analyze_label(detected)
+
+    pipeline = ScanPipeline(StubVisionBackend(['Water'], latency_ms=0), SlowAnalyzer(), None, use_cache=False)
+    assert pipeline.run(make_image(seed=14), "Da Dầu").ok
+    ocr = perf_metrics.snapshot()['stub.ocr']
+    assert ocr['count'] == 1 and ocr['max_ms'] < 150
+    perf_metrics.reset()
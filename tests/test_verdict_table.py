@@ -0,0 +1,76 @@
+import threading
+
+import knowledge_base
+import verdict_table
+from database_utils import get_connection
+from safety_rules import PREGNANCY_STATES, SKIN_TYPES, evaluate_safety
+from verdict_table import VerdictTable, get_verdict_table
+
+
+def _fresh(monkeypatch):
+    monkeypatch.setattr(knowledge_base, '_kb', None)
+    monkeypatch.setattr(verdict_table, '_table', None)
+    knowledge_base.get_knowledge_base(force_check=True)
+    return get_verdict_table()
+
+
+def test_table_matches_rules_for_every_profile(monkeypatch):
+    table = _fresh(monkeypatch)
+    kb = knowledge_base.get_knowledge_base()
+    for rec in kb:
+        for skin_type in SKIN_TYPES:
+            for is_pregnant in PREGNANCY_STATES:
+                assert table.lookup(rec.ingredient_id, skin_type, is_pregnant) == \
+                    evaluate_safety(rec.as_dict(), skin_type, is_pregnant)
+
+
+def test_in_place_edit_is_recomputed(monkeypatch):
+    table = _fresh(monkeypatch)
+    kb = knowledge_base.get_knowledge_base()
+    rec = next(r for r in kb if table.lookup(r.ingredient_id, 'Normal', True)[0] == 'SAFE')
+    conn = get_connection()
+    try:   # Sửa tay, last_updated giữ nguyên
+        conn.execute("UPDATE Ingredients SET function_category = 'Retinoid' WHERE ingredient_id = ?", (rec.ingredient_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    knowledge_base.get_knowledge_base(force_check=True)
+    updated = get_verdict_table()
+    assert updated.lookup(rec.ingredient_id, 'Normal', True)[0] == 'DANGER'
+
+    # Process khác đọc lại từ Safety_Verdicts: dấu vân tay đã lưu khớp -> không tính lại gì
+    stored = VerdictTable()
+    conn = get_connection()
+    try:
+        stored.load(conn)
+        assert stored.sync(knowledge_base.get_knowledge_base(), conn) == 0
+    finally:
+        conn.close()
+    assert stored.lookup(rec.ingredient_id, 'Normal', True)[0] == 'DANGER'
+
+
+def test_readers_never_see_a_partial_table(monkeypatch):
+    table = _fresh(monkeypatch)
+    kb = knowledge_base.get_knowledge_base()
+    ids = [rec.ingredient_id for rec in kb]
+    stop, missing = threading.Event(), []
+
+    def _read():
+        while not stop.is_set():
+            missing.extend(i for i in ids if table.lookup(i, 'Oily', False) is None)
+
+    reader = threading.Thread(target=_read)
+    reader.start()
+    try:
+        for _ in range(5):
+            table._stamps = {}   # Ép tính lại toàn bộ
+            conn = get_connection()
+            try:
+                assert table.sync(kb, conn) == len(ids)
+            finally:
+                conn.close()
+    finally:
+        stop.set()
+        reader.join()
+    assert missing == []
@@ -0,0 +1,134 @@
+import hashlib
+import threading
+
+from database_utils import get_connection
+from knowledge_base import get_knowledge_base
+from safety_rules import RULES_VERSION, SKIN_TYPES, PREGNANCY_STATES, evaluate_safety
+
+# =====================================================
+# BẢNG KẾT LUẬN TÍNH SẴN: (hoạt chất, loại da, mang thai) -> (mức độ, lời khuyên)
+# =====================================================
+
+# Bảng Safety_Verdicts được tạo bởi migration trong database_utils
+# - Khi nào tính lại: kb.version đổi (gồm bộ đếm thay đổi do trigger tăng, thấy cả UPDATE sửa tay).
+# - Tính lại chất nào: dấu vân tay nội dung các cột mà luật dùng (không dựa vào last_updated),
+#   lưu ở cột ingredient_updated của Safety_Verdicts.
+
+
+def record_stamp(rec):
+    """Dấu vân tay nội dung 1 hoạt chất: đổi khi bất kỳ cột nào evaluate_safety() đọc bị sửa"""
+    return hashlib.sha1(repr(tuple(rec.as_dict().items())).encode('utf-8')).hexdigest()[:16]
+
+
+class VerdictTable:
+    """
+    Tra cứu kết luận an toàn bằng dict trong RAM, đồng bộ với Safety_Verdicts.
+    sync() dựng dict mới rồi tráo vào 1 lần dưới khóa: luồng khác đang lookup() không bao giờ thấy bảng dở dang.
+    """
+
+    def __init__(self):
+        self.kb_version = None
+        self._verdicts = {}   # (ingredient_id, skin_type, is_pregnant) -> (risk, message)
+        self._stamps = {}     # ingredient_id -> (record_stamp, rules_version) đã tính
+        self._lock = threading.Lock()
+
+    def lookup(self, ingredient_id, skin_type, is_pregnant):
+        return self._verdicts.get((ingredient_id, skin_type, bool(is_pregnant)))
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def load(self, conn):
+        """Nạp các kết luận đã lưu trong DB vào RAM"""
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ingredient_id, skin_type, is_pregnant, risk_level, message, ingredient_updated, rules_version
+            FROM Safety_Verdicts
+        """)
+        verdicts, stamps = {}, {}
+        for row in cursor.fetchall():
+            ing_id = row['ingredient_id']
+            verdicts[(ing_id, row['skin_type'], bool(row['is_pregnant']))] = (row['risk_level'], row['message'])
+            stamps[ing_id] = (row['ingredient_updated'], row['rules_version'])
+        with self._lock:
+            self._verdicts, self._stamps = verdicts, stamps
+
+    def sync(self, kb, conn):
+        """
+        Tính lại (tăng dần) những hoạt chất mới/đã sửa so với lần tính trước,
+        xóa kết luận của hoạt chất đã bị xóa. Trả về số hoạt chất được tính lại.
+        """
+        verdicts, stamps = dict(self._verdicts), dict(self._stamps)
+        stale = []
+        for rec in kb:
+            stamp = (record_stamp(rec), RULES_VERSION)
+            if stamps.get(rec.ingredient_id) != stamp:
+                stale.append((rec, stamp))
+        removed = [ing_id for ing_id in stamps if ing_id not in kb]
+
+        rows = []
+        for rec, stamp in stale:
+            details = rec.as_dict()
+            for skin_type in SKIN_TYPES:
+                for is_pregnant in PREGNANCY_STATES:
+                    risk, message = evaluate_safety(details, skin_type, is_pregnant)
+                    verdicts[(rec.ingredient_id, skin_type, is_pregnant)] = (risk, message)
+                    rows.append((rec.ingredient_id, skin_type, int(is_pregnant), risk, message, *stamp))
+            stamps[rec.ingredient_id] = stamp
+
+        for ing_id in removed:
+            del stamps[ing_id]
+            for skin_type in SKIN_TYPES:
+                for is_pregnant in PREGNANCY_STATES:
+                    verdicts.pop((ing_id, skin_type, is_pregnant), None)
+
+        with self._lock:
+            self._verdicts, self._stamps, self.kb_version = verdicts, stamps, kb.version
+
+        if rows or removed:
+            try:
+                cursor = conn.cursor()
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO Safety_Verdicts
+                    (ingredient_id, skin_type, is_pregnant, risk_level, message, ingredient_updated, rules_version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+                cursor.executemany("DELETE FROM Safety_Verdicts WHERE ingredient_id = ?", [(i,) for i in removed])
+                conn.commit()
+            except Exception as e:
+                # Không lưu được thì vẫn dùng bảng trong RAM
+                conn.rollback()
+                print(f"⚠️ Lỗi lưu bảng verdict: {e}")
+        return len(stale)
+
+
+# --- BẢN DÙNG CHUNG TRONG PROCESS ---
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_verdict_table():
+    """Trả về bảng verdict khớp với phiên bản kho tri thức hiện tại"""
+    global _table
+    kb = get_knowledge_base()
+    if kb is None:
+        return None
+    if _table is not None and _table.kb_version == kb.version:
+        return _table
+
+    with _table_lock:
+        if _table is not None and _table.kb_version == kb.version:
+            return _table
+        conn = get_connection()
+        if not conn:
+            return _table
+        try:
+            table = _table
+            if table is None:
+                table = VerdictTable()
+                table.load(conn)
+            table.sync(kb, conn)
+            _table = table
+        finally:
+            conn.close()
+        return _table
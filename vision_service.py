@@ -0,0 +1,105 @@
+import io
+import time
+
+# =====================================================
+# BACKEND ĐỌC NHÃN (VISION) CÓ THỂ THAY THẾ
+# =====================================================
+# - GeminiVisionBackend: gọi Gemini thật (cần API key đã configure).
+# - StubVisionBackend: chạy offline, giả lập độ trễ upload theo dung lượng ảnh
+#   để đo hiệu quả tiền xử lý / throughput mà không tốn quota.
+REQUEST_TIMEOUT_S = 20.0   # Timeout phía SDK cho 1 lần gọi (khớp attempt_timeout_s của OCR_POLICY)
+
+OCR_PROMPT = """
+        Extract chemical ingredient names from skincare label.
+        Standardize to INCI format.
+        Return ONLY comma-separated list. No text.
+        """
+
+
+def parse_ingredient_text(text):
+    """'Water, Glycerin, ...' -> ['Water', 'Glycerin', ...]"""
+    text = (text or '').strip()
+    return [x.strip() for x in text.split(',') if x.strip()] if text else []
+
+
+class GeminiVisionBackend:
+    name = 'gemini'
+
+    def __init__(self, model_name, timeout_s=REQUEST_TIMEOUT_S):
+        self.model_name = model_name
+        self.timeout_s = timeout_s
+        self._model = None
+
+    def extract(self, image_bytes):
+        """Gửi ảnh lên Gemini, trả về list tên chất. Lỗi mạng/API được ném ra cho bên gọi xử lý."""
+        import google.generativeai as genai
+        from PIL import Image
+
+        if self._model is None:
+            self._model = genai.GenerativeModel(self.model_name)
+        img = Image.open(io.BytesIO(image_bytes))
+        # Timeout phía SDK: lần gọi bị treo thật sự kết thúc (không chỉ bị bên gọi bỏ lại)
+        response = self._model.generate_content([OCR_PROMPT, img], request_options={'timeout': self.timeout_s})
+        return parse_ingredient_text(response.text)
+
+
+class StubVisionBackend:
+    """
+    Backend giả lập: trả về danh sách cố định sau một độ trễ
+    = latency_ms + thời gian upload (bytes / bandwidth_kbps).
+    """
+    name = 'stub'
+
+    def __init__(self, ingredients=None, latency_ms=300, bandwidth_kbps=2000, model_name='stub'):
+        self.ingredients = list(ingredients or ['Water', 'Glycerin', 'Niacinamide', 'Phenoxyethanol'])
+        self.latency_ms = latency_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.model_name = model_name
+        self.calls = 0
+        self.bytes_received = 0
+
+    def extract(self, image_bytes):
+        self.calls += 1
+        self.bytes_received += len(image_bytes)
+        upload_ms = len(image_bytes) * 8 / self.bandwidth_kbps if self.bandwidth_kbps else 0
+        time.sleep((self.latency_ms + upload_ms) / 1000.0)
+        return list(self.ingredients)
+
+
+def analyze_label_image(image_bytes, backend, preprocess=True, **preprocess_options):
+    """
+    Tiền xử lý (tùy chọn) rồi OCR một ảnh nhãn.
+    Trả về (list tên chất, metrics dict: bytes tiết kiệm, thời gian từng bước).
+    """
+    start = time.perf_counter()
+    metrics = {'backend': backend.name, 'original_bytes': len(image_bytes)}
+    payload = image_bytes
+    if preprocess:
+        from image_preprocessing import preprocess_image
+        result = preprocess_image(image_bytes, **preprocess_options)
+        payload = result.data
+        metrics.update(result.as_dict())
+    else:
+        metrics.update({'output_bytes': len(image_bytes), 'bytes_saved': 0, 'preprocess_ms': 0.0})
+
+    ocr_start = time.perf_counter()
+    ingredients = backend.extract(payload)
+    metrics['ocr_ms'] = round((time.perf_counter() - ocr_start) * 1000, 2)
+    metrics['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return ingredients, metrics
+
+
+if __name__ == "__main__":
+    # Đo offline: python vision_service.py anh1.jpg anh2.jpg [--crop]
+    import json
+    import sys
+
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    crop = '--crop' in sys.argv
+    stub = StubVisionBackend()
+    for path in args:
+        with open(path, 'rb') as f:
+            data = f.read()
+        _, raw = analyze_label_image(data, stub, preprocess=False)
+        _, pre = analyze_label_image(data, stub, preprocess=True, crop_label=crop)
+        print(json.dumps({'file': path, 'raw': raw, 'preprocessed': pre}, ensure_ascii=False))